@@ -8,7 +8,7 @@ from collections import Counter
 
 from tqdm import tqdm
 
-from squad.utils import get_word_span, get_word_idx, process_tokens
+from squad.utils import WordSpanIndex, process_tokens
 
 
 def main():
@@ -148,6 +148,7 @@ def prepro_each(args, data_type, start_ratio=0.0, stop_ratio=1.0, out_name="defa
             context = context.replace("``", '" ')
             xi = list(map(word_tokenize, sent_tokenize(context)))
             xi = [process_tokens(tokens) for tokens in xi]  # process tokens
+            word_index = WordSpanIndex(context, xi)  # spans computed once for all answers
             # given xi, add chars
             cxi = [[list(xijk) for xijk in xij] for xij in xi]
             xp.append(xi)
@@ -178,15 +179,15 @@ def prepro_each(args, data_type, start_ratio=0.0, stop_ratio=1.0, out_name="defa
                     answer_start = answer['answer_start']
                     answer_stop = answer_start + len(answer_text)
                     # TODO : put some function that gives word_start, word_stop here
-                    yi0, yi1 = get_word_span(context, xi, answer_start, answer_stop)
+                    yi0, yi1 = word_index.word_span(answer_start, answer_stop)
                     # yi0 = answer['answer_word_start'] or [0, 0]
                     # yi1 = answer['answer_word_stop'] or [0, 1]
                     assert len(xi[yi0[0]]) > yi0[1]
                     assert len(xi[yi1[0]]) >= yi1[1]
                     w0 = xi[yi0[0]][yi0[1]]
                     w1 = xi[yi1[0]][yi1[1]-1]
-                    i0 = get_word_idx(context, xi, yi0)
-                    i1 = get_word_idx(context, xi, (yi1[0], yi1[1]-1))
+                    i0 = word_index.word_idx(yi0)
+                    i1 = word_index.word_idx((yi1[0], yi1[1]-1))
                     cyi0 = answer_start - i0
                     cyi1 = answer_stop - i1 - 1
                     # print(answer_text, w0[cyi0:], w1[:cyi1+1])
@@ -1,3 +1,4 @@
+import bisect
 import re
 import numpy as np
 
@@ -19,16 +20,31 @@ def get_2d_spans(text, tokenss):
     return spanss
 
 
+class WordSpanIndex(object):
+    """
+    Character spans of the words of one context, computed once per paragraph.
+    Spans never overlap, so the words an answer covers are found by bisecting
+    the sorted start and stop offsets instead of scanning every span.
+    """
+    def __init__(self, context, wordss):
+        self.context = context
+        self.spanss = get_2d_spans(context, wordss)
+        self.idxs = [(sent_idx, word_idx) for sent_idx, spans in enumerate(self.spanss) for word_idx in range(len(spans))]
+        self.starts = [span[0] for spans in self.spanss for span in spans]
+        self.stops = [span[1] for spans in self.spanss for span in spans]
+
+    def word_span(self, start, stop):
+        first = bisect.bisect_right(self.stops, start)
+        last = bisect.bisect_left(self.starts, stop) - 1
+        assert first <= last, "{} {} {} {}".format(self.context, self.spanss, start, stop)
+        return self.idxs[first], (self.idxs[last][0], self.idxs[last][1] + 1)
+
+    def word_idx(self, idx):
+        return self.spanss[idx[0]][idx[1]][0]
+
+
 def get_word_span(context, wordss, start, stop):
-    spanss = get_2d_spans(context, wordss)
-    idxs = []
-    for sent_idx, spans in enumerate(spanss):
-        for word_idx, span in enumerate(spans):
-            if not (stop <= span[0] or start >= span[1]):
-                idxs.append((sent_idx, word_idx))
-
-    assert len(idxs) > 0, "{} {} {} {}".format(context, spanss, start, stop)
-    return idxs[0], (idxs[-1][0], idxs[-1][1] + 1)
+    return WordSpanIndex(context, wordss).word_span(start, stop)
 
 
 def get_phrase(context, wordss, span):
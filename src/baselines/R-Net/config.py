@@ -20,16 +20,17 @@ answer_dir = "log/answer"
 train_record_file = os.path.join(target_dir, "train.tfrecords")
 dev_record_file = os.path.join(target_dir, "dev.tfrecords")
 test_record_file = os.path.join(target_dir, "test.tfrecords")
-word_emb_file = os.path.join(target_dir, "word_emb.json")
-char_emb_file = os.path.join(target_dir, "char_emb.json")
+word_emb_file = os.path.join(target_dir, "word_emb.npy")
+char_emb_file = os.path.join(target_dir, "char_emb.npy")
 
 train_eval = os.path.join(target_dir, "train_eval.jsonl")
 dev_eval = os.path.join(target_dir, "dev_eval.jsonl")
 test_eval = os.path.join(target_dir, "test_eval.jsonl")
 
-train_examples = os.path.join(target_dir, "train_examples.jsonl")
-dev_examples = os.path.join(target_dir, "dev_examples.jsonl")
-test_examples = os.path.join(target_dir, "test_examples.jsonl")
+# example stores, see example_store.py
+train_examples = os.path.join(target_dir, "train_examples")
+dev_examples = os.path.join(target_dir, "dev_examples")
+test_examples = os.path.join(target_dir, "test_examples")
 word_counter = os.path.join(target_dir, "word_counter.pickle")
 char_counter = os.path.join(target_dir, "char_counter.pickle")
 
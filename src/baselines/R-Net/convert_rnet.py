@@ -7,6 +7,8 @@ import os.path
 import pickle
 import argparse
 
+from offset_index import ContextCache
+
 nlp = spacy.blank("en")
 
 def word_tokenize(sent):
@@ -14,52 +16,29 @@ def word_tokenize(sent):
     return [token.text for token in doc]
 
 
-def convert_idx(text, tokens):
-    current = 0
-    spans = []
-    for token in tokens:
-        current = text.find(token, current)
-        if current < 0:
-            print("Token {} cannot be found".format(token))
-            raise Exception()
-        spans.append((current, current + len(token)))
-        current += len(token)
-    return spans
-
-
 def main(args):
     wfp_eval = open(args.eval_file, 'w')
     wfp = open(args.examples_file, 'w')
     
     rfp = open(args.file, 'r')
 
+    contexts = ContextCache(str.split)
+
     for line in tqdm(rfp):
         para = json.loads(line)
         context = para["context"]
-        context_tokens = context.split()
-        context_chars = [list(token) for token in context_tokens]
-        spans = convert_idx(context, context_tokens)
-        for qa in para["qas"]:
+        context_index = contexts.get(context)
+        context_tokens = context_index.tokens
+        context_chars = context_index.chars
+        spans = context_index.spans
+        answer_spans = context_index.answer_spans([qa["answers"] for qa in para["qas"]])
+        for qa, (y1s, y2s) in zip(para["qas"], answer_spans):
             ques = qa["question"].replace(
                 "''", '" ').replace("``", '" ')
             ques_tokens = ques.split()
             ques_chars = [list(token) for token in ques_tokens]
-            
-            y1s, y2s = [], []
-            answer_texts = []
-            for answer in qa["answers"]:
-                answer_text = answer["text"]
-                answer_start = answer['answer_start']
-                answer_end = answer_start + len(answer_text)
-                answer_texts.append(answer_text)
-                answer_span = []
-                for idx, span in enumerate(spans):
-                    if not (answer_end <= span[0] or answer_start >= span[1]):
-                        answer_span.append(idx)
-                y1, y2 = answer_span[0], answer_span[-1]
-                y1s.append(y1)
-                y2s.append(y2)
-            
+            answer_texts = [answer["text"] for answer in qa["answers"]]
+
             example = {"context_tokens": context_tokens, "context_chars": context_chars, "ques_tokens": ques_tokens,
                    "ques_chars": ques_chars, "y1s": y1s, "y2s": y2s, "id": qa["_id"]}
             wfp.write(json.dumps(example) + '\n')
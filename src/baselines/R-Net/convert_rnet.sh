@@ -50,6 +50,9 @@ for part in "${parts[@]}"; do
 
 	rm $out_dir/$part-split-*
 	echo "Shuffle and Delete Completed"
+
+	python3 example_store.py --examples_file $examples_all --store_dir $out_dir/$part"_examples"
+	echo "Example Store Completed"
 done
 
 
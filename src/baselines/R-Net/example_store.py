@@ -0,0 +1,266 @@
+import os
+import json
+import argparse
+
+import numpy as np
+from tqdm import tqdm
+
+# Columnar store for R-Net examples. A store is a directory of shards, each a set of
+# .npy files that are memory mapped on load:
+#
+#   context_offsets        [num_contexts + 1]      token range of every context
+#   context_tokens         [num_context_tokens]    word-table ids
+#   context_char_offsets   [num_context_tokens + 1]
+#   context_chars          [num_context_chars]     char-table ids
+#   ques_offsets, ques_tokens, ques_char_offsets, ques_chars    same, one per example
+#   example_context        [num_examples]          context row of every example
+#   answer_offsets         [num_examples + 1]      range of y1s/y2s of every example
+#   y1s, y2s               [num_answers]
+#   ids                    [num_examples]
+#
+# The token and char tables the ids refer to are stored the same way, as UTF-8 bytes
+# plus offsets (words_bytes.npy and words_offsets.npy, chars_bytes.npy and
+# chars_offsets.npy), and index.json holds the number of examples per shard.
+# Contexts are stored once per paragraph.
+
+SHARD_SIZE = 100000
+
+
+class _Ragged(object):
+    # append-only list of token lists, kept as flat ids plus offsets, with the chars of
+    # every token stored the same way one level down
+    def __init__(self):
+        self.offsets = [0]
+        self.tokens = []
+        self.char_offsets = [0]
+        self.chars = []
+
+    def append(self, token_ids, char_ids):
+        self.tokens.extend(token_ids)
+        self.offsets.append(len(self.tokens))
+        for ids in char_ids:
+            self.chars.extend(ids)
+            self.char_offsets.append(len(self.chars))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def arrays(self, prefix):
+        return {
+            prefix + '_offsets': np.array(self.offsets, dtype=np.int64),
+            prefix + '_tokens': np.array(self.tokens, dtype=np.int32),
+            prefix + '_char_offsets': np.array(self.char_offsets, dtype=np.int64),
+            prefix + '_chars': np.array(self.chars, dtype=np.int32),
+        }
+
+
+class _StringTable(object):
+    # the strings of a word or char table, decoded on lookup
+    def __init__(self, store_dir, name, mmap_mode=None):
+        self.data = np.load(os.path.join(store_dir, name + '_bytes.npy'), mmap_mode=mmap_mode)
+        self.offsets = np.load(os.path.join(store_dir, name + '_offsets.npy'), mmap_mode=mmap_mode)
+
+    @staticmethod
+    def save(store_dir, name, strings):
+        encoded = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(data) for data in encoded])
+        np.save(os.path.join(store_dir, name + '_bytes.npy'), np.frombuffer(b''.join(encoded), dtype=np.uint8))
+        np.save(os.path.join(store_dir, name + '_offsets.npy'), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        return self.data[self.offsets[idx]:self.offsets[idx + 1]].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def take(self, ids):
+        return [self[idx] for idx in ids]
+
+
+class ExampleWriter(object):
+    def __init__(self, store_dir, shard_size=SHARD_SIZE):
+        self.store_dir = store_dir
+        self.shard_size = shard_size
+        self.word2id = {}
+        self.char2id = {}
+        self.shard_sizes = []
+        if not os.path.exists(store_dir):
+            os.makedirs(store_dir)
+        self._new_shard()
+
+    def _new_shard(self):
+        self.contexts = _Ragged()
+        self.questions = _Ragged()
+        self.example_context = []
+        self.answer_offsets = [0]
+        self.y1s = []
+        self.y2s = []
+        self.ids = []
+
+    def _encode(self, tokens):
+        token_ids = [self.word2id.setdefault(token, len(self.word2id)) for token in tokens]
+        char_ids = [[self.char2id.setdefault(char, len(self.char2id)) for char in token] for token in tokens]
+        return token_ids, char_ids
+
+    def add_paragraph(self, context_tokens, questions):
+        # questions: (ques_tokens, y1s, y2s, example_id) for every question of the context
+        if len(self.ids) >= self.shard_size:
+            self._write_shard()
+        context_row = len(self.contexts)
+        self.contexts.append(*self._encode(context_tokens))
+        for ques_tokens, y1s, y2s, example_id in questions:
+            self.questions.append(*self._encode(ques_tokens))
+            self.example_context.append(context_row)
+            self.y1s.extend(y1s)
+            self.y2s.extend(y2s)
+            self.answer_offsets.append(len(self.y1s))
+            self.ids.append(example_id)
+
+    def _write_shard(self):
+        shard_dir = os.path.join(self.store_dir, 'shard-%05d' % len(self.shard_sizes))
+        if not os.path.exists(shard_dir):
+            os.makedirs(shard_dir)
+        columns = {
+            'example_context': np.array(self.example_context, dtype=np.int32),
+            'answer_offsets': np.array(self.answer_offsets, dtype=np.int64),
+            'y1s': np.array(self.y1s, dtype=np.int32),
+            'y2s': np.array(self.y2s, dtype=np.int32),
+            'ids': np.array(self.ids, dtype=np.int64),
+        }
+        columns.update(self.contexts.arrays('context'))
+        columns.update(self.questions.arrays('ques'))
+        for name, array in columns.items():
+            np.save(os.path.join(shard_dir, name + '.npy'), array)
+        self.shard_sizes.append(len(self.ids))
+        self._new_shard()
+
+    def close(self):
+        if len(self.ids) > 0 or len(self.shard_sizes) == 0:
+            self._write_shard()
+        # tables are saved in id order
+        _StringTable.save(self.store_dir, 'words', sorted(self.word2id, key=self.word2id.get))
+        _StringTable.save(self.store_dir, 'chars', sorted(self.char2id, key=self.char2id.get))
+        with open(os.path.join(self.store_dir, 'index.json'), 'w') as fh:
+            json.dump({'shard_sizes': self.shard_sizes}, fh)
+
+
+class ExampleStore(object):
+    def __init__(self, store_dir, mmap=True):
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(store_dir, 'index.json'), 'r') as fh:
+            self.shard_sizes = json.load(fh)['shard_sizes']
+        self.words = _StringTable(store_dir, 'words', mmap_mode)
+        self.chars = _StringTable(store_dir, 'chars', mmap_mode)
+        self.shards = []
+        for shard_idx in range(len(self.shard_sizes)):
+            shard_dir = os.path.join(store_dir, 'shard-%05d' % shard_idx)
+            self.shards.append(dict(
+                (name[:-len('.npy')], np.load(os.path.join(shard_dir, name), mmap_mode=mmap_mode))
+                for name in os.listdir(shard_dir) if name.endswith('.npy')
+            ))
+        self.shard_starts = np.cumsum([0] + self.shard_sizes)
+
+        # example id -> position, for random access by id
+        ids = np.concatenate([shard['ids'] for shard in self.shards]) if len(self.shards) > 0 else np.zeros(0, dtype=np.int64)
+        self.id_order = np.argsort(ids, kind='stable')
+        self.sorted_ids = ids[self.id_order]
+
+    def __len__(self):
+        return int(self.shard_starts[-1])
+
+    def example(self, idx):
+        # arrays are views into the shard; chars come as (flat ids, per-token offsets)
+        shard_idx = int(np.searchsorted(self.shard_starts, idx, side='right')) - 1
+        shard = self.shards[shard_idx]
+        i = idx - self.shard_starts[shard_idx]
+        context = shard['example_context'][i]
+        context_tokens, context_chars = _row(shard, 'context', context)
+        ques_tokens, ques_chars = _row(shard, 'ques', i)
+        a_start, a_end = shard['answer_offsets'][i], shard['answer_offsets'][i + 1]
+        return {
+            "context_tokens": context_tokens, "context_chars": context_chars,
+            "ques_tokens": ques_tokens, "ques_chars": ques_chars,
+            "y1s": shard['y1s'][a_start:a_end], "y2s": shard['y2s'][a_start:a_end],
+            "id": int(shard['ids'][i]),
+        }
+
+    def by_id(self, example_id):
+        pos = int(np.searchsorted(self.sorted_ids, example_id))
+        if pos == len(self.sorted_ids) or self.sorted_ids[pos] != example_id:
+            raise KeyError(example_id)
+        return self.example(int(self.id_order[pos]))
+
+    def decode(self, example):
+        # the JSON-lines form of an example, with token and char strings
+        def chars(flat, offsets):
+            return [self.chars.take(flat[offsets[t]:offsets[t + 1]]) for t in range(len(offsets) - 1)]
+        return {
+            "context_tokens": self.words.take(example["context_tokens"]),
+            "context_chars": chars(*example["context_chars"]),
+            "ques_tokens": self.words.take(example["ques_tokens"]),
+            "ques_chars": chars(*example["ques_chars"]),
+            "y1s": example["y1s"].tolist(), "y2s": example["y2s"].tolist(), "id": example["id"],
+        }
+
+
+def _row(shard, prefix, row):
+    start, end = shard[prefix + '_offsets'][row], shard[prefix + '_offsets'][row + 1]
+    char_offsets = shard[prefix + '_char_offsets'][start:end + 1]
+    chars = shard[prefix + '_chars'][char_offsets[0]:char_offsets[-1]]
+    return shard[prefix + '_tokens'][start:end], (chars, char_offsets - char_offsets[0])
+
+
+def char_matrix(chars, char_offsets, table, limit, char_limit):
+    # [limit, char_limit] char ids of the first limit tokens, each cut to char_limit chars
+    num_tokens = min(len(char_offsets) - 1, limit)
+    matrix = np.zeros([limit, char_limit], dtype=np.int32)
+    if num_tokens == 0 or len(chars) == 0:
+        return matrix
+    starts = char_offsets[:num_tokens]
+    lengths = np.minimum(char_offsets[1:num_tokens + 1] - starts, char_limit)
+    positions = np.arange(char_limit)
+    mask = positions[None, :] < lengths[:, None]
+    index = np.minimum(starts[:, None] + positions[None, :], len(chars) - 1)
+    matrix[:num_tokens] = np.where(mask, table[chars[index]], 0)
+    return matrix
+
+
+def save_emb(filename, emb_mat, message=None):
+    if message is not None:
+        print("Saving {}...".format(message))
+    np.save(filename, np.array(emb_mat, dtype=np.float32))
+
+
+def load_emb(filename):
+    # .npy matrices load without parsing; JSON files from older runs still work
+    if filename.endswith('.npy'):
+        return np.load(filename)
+    with open(filename, "r") as fh:
+        return np.array(json.load(fh), dtype=np.float32)
+
+
+def convert_jsonl(examples_file, store_dir, shard_size=SHARD_SIZE):
+    # examples written as JSON lines (e.g. by convert_rnet.py) to a store
+    writer = ExampleWriter(store_dir, shard_size)
+    with open(examples_file, 'r') as fh:
+        for line in tqdm(fh):
+            example = json.loads(line)
+            writer.add_paragraph(example["context_tokens"], [
+                (example["ques_tokens"], example["y1s"], example["y2s"], example["id"])
+            ])
+    writer.close()
+
+
+if __name__ == '__main__':
+    argParser = argparse.ArgumentParser(description="Convert R-Net JSON-lines examples to an example store")
+    argParser.add_argument("--examples_file", type=str)
+    argParser.add_argument("--store_dir", type=str)
+    argParser.add_argument("--shard_size", type=int, default=SHARD_SIZE)
+
+    args = argParser.parse_args()
+    convert_jsonl(args.examples_file, args.store_dir, args.shard_size)
@@ -6,7 +6,9 @@ import ujson as json
 
 
 from func import cudnn_gru, native_gru, dot_attention, summ, ptr_net
-from prepro import word_tokenize, convert_idx
+from prepro import word_tokenize
+from offset_index import ContextCache
+from example_store import load_emb
 
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
 
@@ -20,8 +22,8 @@ use_cudnn = True
 # File path
 target_dir = "data"
 save_dir = "log/model"
-word_emb_file = os.path.join(target_dir, "word_emb.json")
-char_emb_file = os.path.join(target_dir, "char_emb.json")
+word_emb_file = os.path.join(target_dir, "word_emb.npy")
+char_emb_file = os.path.join(target_dir, "char_emb.npy")
 word2idx_file = os.path.join(target_dir, "word2idx.json")
 char2idx_file = os.path.join(target_dir, "char2idx.json")
 
@@ -125,10 +127,8 @@ class InfModel(object):
 class Inference(object):
 
     def __init__(self):
-        with open(word_emb_file, "r") as fh:
-            self.word_mat = np.array(json.load(fh), dtype=np.float32)
-        with open(char_emb_file, "r") as fh:
-            self.char_mat = np.array(json.load(fh), dtype=np.float32)
+        self.word_mat = load_emb(word_emb_file)
+        self.char_mat = load_emb(char_emb_file)
         with open(word2idx_file, "r") as fh:
             self.word2idx_dict = json.load(fh)
         with open(char2idx_file, "r") as fh:
@@ -139,6 +139,8 @@ class Inference(object):
         self.sess = tf.Session(config=sess_config)
         saver = tf.train.Saver()
         saver.restore(self.sess, tf.train.latest_checkpoint(save_dir))
+        # a context is usually asked several questions in a row
+        self.contexts = ContextCache(word_tokenize)
 
     def response(self, context, question):
         sess = self.sess
@@ -158,9 +160,10 @@ class Inference(object):
 
     def prepro(self, context, question):
         context = context.replace("''", '" ').replace("``", '" ')
-        context_tokens = word_tokenize(context)
-        context_chars = [list(token) for token in context_tokens]
-        spans = convert_idx(context, context_tokens)
+        context_index = self.contexts.get(context)
+        context_tokens = context_index.tokens
+        context_chars = context_index.chars
+        spans = context_index.spans
         ques = question.replace("''", '" ').replace("``", '" ')
         ques_tokens = word_tokenize(ques)
         ques_chars = [list(token) for token in ques_tokens]
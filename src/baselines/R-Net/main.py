@@ -6,13 +6,12 @@ import os
 
 from model import Model
 from util import get_record_parser, convert_tokens, evaluate, get_batch_dataset, get_dataset
+from example_store import load_emb
 
 
 def train(config):
-    with open(config.word_emb_file, "r") as fh:
-        word_mat = np.array(json.load(fh), dtype=np.float32)
-    with open(config.char_emb_file, "r") as fh:
-        char_mat = np.array(json.load(fh), dtype=np.float32)
+    word_mat = load_emb(config.word_emb_file)
+    char_mat = load_emb(config.char_emb_file)
 
     train_eval_file = {}
     with open(config.train_eval_file, "r") as fh:
@@ -122,10 +121,8 @@ def evaluate_batch(model, num_batches, eval_file, sess, data_type, handle, str_h
 
 
 def test(config):
-    with open(config.word_emb_file, "r") as fh:
-        word_mat = np.array(json.load(fh), dtype=np.float32)
-    with open(config.char_emb_file, "r") as fh:
-        char_mat = np.array(json.load(fh), dtype=np.float32)
+    word_mat = load_emb(config.word_emb_file)
+    char_mat = load_emb(config.char_emb_file)
     with open(config.test_eval_file, "r") as fh:
         eval_file = json.load(fh)
     with open(config.test_meta, "r") as fh:
@@ -0,0 +1,77 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+def convert_idx(text, tokens):
+    current = 0
+    spans = []
+    for token in tokens:
+        current = text.find(token, current)
+        if current < 0:
+            print("Token {} cannot be found".format(token))
+            raise Exception()
+        spans.append((current, current + len(token)))
+        current += len(token)
+    return spans
+
+
+class OffsetIndex(object):
+    # token spans of one context with their start/end offsets as sorted arrays, so that
+    # the tokens an answer overlaps are found with two binary searches
+
+    def __init__(self, context, tokens):
+        self.context = context
+        self.tokens = tokens
+        self.chars = [list(token) for token in tokens]
+        self.spans = convert_idx(context, tokens)
+        self.starts = np.array([span[0] for span in self.spans], dtype=np.int64)
+        self.ends = np.array([span[1] for span in self.spans], dtype=np.int64)
+
+    def token_spans(self, answer_starts, answer_ends):
+        # first and last token overlapping each [start, end) character range; tokens
+        # never overlap, so both offset arrays are sorted
+        answer_starts = np.asarray(answer_starts, dtype=np.int64)
+        answer_ends = np.asarray(answer_ends, dtype=np.int64)
+        y1s = np.searchsorted(self.ends, answer_starts, side='right')
+        y2s = np.searchsorted(self.starts, answer_ends, side='left') - 1
+        if np.any(y1s > y2s):
+            i = int(np.argmax(y1s > y2s))
+            raise IndexError("Answer ({}, {}) overlaps no token".format(answer_starts[i], answer_ends[i]))
+        return y1s.tolist(), y2s.tolist()
+
+    def answer_spans(self, answerss):
+        # token spans for the answers of all questions of the paragraph in one batch
+        starts, ends, sizes = [], [], []
+        for answers in answerss:
+            for answer in answers:
+                starts.append(answer['answer_start'])
+                ends.append(answer['answer_start'] + len(answer['text']))
+            sizes.append(len(answers))
+        y1s, y2s = self.token_spans(starts, ends)
+
+        spans, offset = [], 0
+        for size in sizes:
+            spans.append((y1s[offset:offset + size], y2s[offset:offset + size]))
+            offset += size
+        return spans
+
+
+class ContextCache(object):
+    # LRU cache of OffsetIndex by context text; the same review context is shared by
+    # all questions that retrieved it
+
+    def __init__(self, tokenize, cache_size=1024):
+        self.tokenize = tokenize
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def get(self, context):
+        if context in self.cache:
+            self.cache.move_to_end(context)
+            return self.cache[context]
+        index = OffsetIndex(context, self.tokenize(context))
+        self.cache[context] = index
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return index
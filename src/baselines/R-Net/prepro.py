@@ -8,6 +8,9 @@ import numpy as np
 import os.path
 import pickle
 
+from offset_index import convert_idx, ContextCache
+from example_store import ExampleWriter, ExampleStore, char_matrix, save_emb
+
 nlp = spacy.blank("en")
 
 
@@ -16,85 +19,60 @@ def word_tokenize(sent):
     return [token.text for token in doc]
 
 
-def convert_idx(text, tokens):
-    current = 0
-    spans = []
-    for token in tokens:
-        current = text.find(token, current)
-        if current < 0:
-            print("Token {} cannot be found".format(token))
-            raise Exception()
-        spans.append((current, current + len(token)))
-        current += len(token)
-    return spans
-
-
 def process_file(config, data_type, word_counter, char_counter):
     print("Generating {} examples...".format(data_type))
     
     if data_type == "dev":
         rfp = open(config.dev_file, 'r')
-        wfp = open(config.dev_examples_file, 'w')
+        writer = ExampleWriter(config.dev_examples_file)
         wfp_eval = open(config.dev_eval_file, 'w')
     elif data_type == "test":
         rfp = open(config.test_file, 'r')
-        wfp = open(config.test_examples_file, 'w')
+        writer = ExampleWriter(config.test_examples_file)
         wfp_eval = open(config.test_eval_file, 'w')
     elif data_type == "train":
         rfp = open(config.train_file, 'r')
-        wfp = open(config.train_examples_file, 'w')
+        writer = ExampleWriter(config.train_examples_file)
         wfp_eval = open(config.train_eval_file, 'w')
     else:
         exit(1)
 
     total = 0
+    contexts = ContextCache(word_tokenize)
 
     for line in tqdm(rfp):
         para = json.loads(line)
         context = para["context"].replace(
             "''", '" ').replace("``", '" ')
-        context_tokens = word_tokenize(context)
-        context_chars = [list(token) for token in context_tokens]
-        spans = convert_idx(context, context_tokens)
+        context_index = contexts.get(context)
+        context_tokens = context_index.tokens
+        spans = context_index.spans
         for token in context_tokens:
             word_counter[token] += len(para["qas"])
             for char in token:
                 char_counter[char] += len(para["qas"])
-        for qa in para["qas"]:
+        answer_spans = context_index.answer_spans([qa["answers"] for qa in para["qas"]])
+        questions = []
+        for qa, (y1s, y2s) in zip(para["qas"], answer_spans):
             total += 1
             ques = qa["question"].replace(
                 "''", '" ').replace("``", '" ')
             ques_tokens = word_tokenize(ques)
-            ques_chars = [list(token) for token in ques_tokens]
             for token in ques_tokens:
                 word_counter[token] += 1
                 for char in token:
                     char_counter[char] += 1
-            y1s, y2s = [], []
-            answer_texts = []
-            for answer in qa["answers"]:
-                answer_text = answer["text"]
-                answer_start = answer['answer_start']
-                answer_end = answer_start + len(answer_text)
-                answer_texts.append(answer_text)
-                answer_span = []
-                for idx, span in enumerate(spans):
-                    if not (answer_end <= span[0] or answer_start >= span[1]):
-                        answer_span.append(idx)
-                y1, y2 = answer_span[0], answer_span[-1]
-                y1s.append(y1)
-                y2s.append(y2)
-            
-            example = {"context_tokens": context_tokens, "context_chars": context_chars, "ques_tokens": ques_tokens,
-                   "ques_chars": ques_chars, "y1s": y1s, "y2s": y2s, "id": total}
-            wfp.write(json.dumps(example) + '\n')
+            answer_texts = [answer["text"] for answer in qa["answers"]]
+
+            questions.append((ques_tokens, y1s, y2s, total))
 
             row = {"context": context, "spans": spans, "answers": answer_texts, "uuid": qa["id"], "id":total}
             wfp_eval.write(json.dumps(row) + '\n')
+        writer.add_paragraph(context_tokens, questions)
 
     rfp.close()
     wfp_eval.close()
-    wfp.close()
+    writer.close()
     #shuffle wfp
     return
 
@@ -146,13 +124,13 @@ def build_features(config, data_type, word2idx_dict, char2idx_dict, is_test=Fals
 
     if data_type == "dev":
         out_file = config.dev_record_file
-        rfp = open(config.dev_examples_file, 'r')
+        store = ExampleStore(config.dev_examples_file)
     elif data_type == "test":
         out_file = config.test_record_file
-        rfp = open(config.test_examples_file, 'r')
+        store = ExampleStore(config.test_examples_file)
     elif data_type == "train":
         out_file = config.train_record_file
-        rfp = open(config.train_examples_file, 'r')
+        store = ExampleStore(config.train_examples_file)
     else:
         exit(1)
 
@@ -163,59 +141,43 @@ def build_features(config, data_type, word2idx_dict, char2idx_dict, is_test=Fals
     def filter_func(example, is_test=False):
         return len(example["context_tokens"]) > para_limit or len(example["ques_tokens"]) > ques_limit
 
+    def _get_word(word):
+        for each in (word, word.lower(), word.capitalize(), word.upper()):
+            if each in word2idx_dict:
+                return word2idx_dict[each]
+        return 1
+
+    def _get_char(char):
+        if char in char2idx_dict:
+            return char2idx_dict[char]
+        return 1
+
+    # every distinct token and char is looked up once, examples are then plain gathers
+    word_table = np.array([_get_word(word) for word in store.words], dtype=np.int32)
+    char_table = np.array([_get_char(char) for char in store.chars], dtype=np.int32)
+
     print("Processing {} examples...".format(data_type))
     writer = tf.python_io.TFRecordWriter(out_file)
     total = 0
     total_ = 0
     meta = {}
-    for line in tqdm(rfp):
-        example = json.loads(line)
+    for idx in tqdm(range(len(store))):
+        example = store.example(idx)
         total_ += 1
 
-        if len(example["context_tokens"]) > para_limit:
-            example["context_tokens"] = example["context_tokens"][0:para_limit]
-            example["context_chars"] = example["context_chars"][0:para_limit]
-
-        if len(example["ques_tokens"]) > ques_limit:
-            example["ques_tokens"] = example["ques_tokens"][0:ques_limit]
-            example["ques_chars"] = example["ques_chars"][0:ques_limit]
-
         total += 1
         context_idxs = np.zeros([para_limit], dtype=np.int32)
-        context_char_idxs = np.zeros([para_limit, char_limit], dtype=np.int32)
         ques_idxs = np.zeros([ques_limit], dtype=np.int32)
-        ques_char_idxs = np.zeros([ques_limit, char_limit], dtype=np.int32)
         y1 = np.zeros([para_limit], dtype=np.float32)
         y2 = np.zeros([para_limit], dtype=np.float32)
 
-        def _get_word(word):
-            for each in (word, word.lower(), word.capitalize(), word.upper()):
-                if each in word2idx_dict:
-                    return word2idx_dict[each]
-            return 1
-
-        def _get_char(char):
-            if char in char2idx_dict:
-                return char2idx_dict[char]
-            return 1
+        context_tokens = example["context_tokens"][:para_limit]
+        context_idxs[:len(context_tokens)] = word_table[context_tokens]
+        ques_tokens = example["ques_tokens"][:ques_limit]
+        ques_idxs[:len(ques_tokens)] = word_table[ques_tokens]
 
-        for i, token in enumerate(example["context_tokens"]):
-            context_idxs[i] = _get_word(token)
-
-        for i, token in enumerate(example["ques_tokens"]):
-            ques_idxs[i] = _get_word(token)
-
-        for i, token in enumerate(example["context_chars"]):
-            for j, char in enumerate(token):
-                if j == char_limit:
-                    break
-                context_char_idxs[i, j] = _get_char(char)
-
-        for i, token in enumerate(example["ques_chars"]):
-            for j, char in enumerate(token):
-                if j == char_limit:
-                    break
-                ques_char_idxs[i, j] = _get_char(char)
+        context_char_idxs = char_matrix(example["context_chars"][0], example["context_chars"][1], char_table, para_limit, char_limit)
+        ques_char_idxs = char_matrix(example["ques_chars"][0], example["ques_chars"][1], char_table, ques_limit, char_limit)
 
         start, end = example["y1s"][-1], example["y2s"][-1]
         if start < len(y1) and end < len(y2):
@@ -234,7 +196,6 @@ def build_features(config, data_type, word2idx_dict, char2idx_dict, is_test=Fals
     print("Build {} / {} instances of features in total".format(total, total_))
     meta["total"] = total
     writer.close()
-    rfp.close()
     return meta
 
 
@@ -302,8 +263,8 @@ def prepro(config):
         char_counter, "char", emb_file=char_emb_file, size=char_emb_size, 
         vec_size=char_emb_dim, token2idx_dict=char2idx_dict)
 
-    save(config.word_emb_file, word_emb_mat, message="word embedding")
-    save(config.char_emb_file, char_emb_mat, message="char embedding")
+    save_emb(config.word_emb_file, word_emb_mat, message="word embedding")
+    save_emb(config.char_emb_file, char_emb_mat, message="char embedding")
 
     save(config.word2idx_file, word2idx_dict, message="word2idx")
     save(config.char2idx_file, char2idx_dict, message="char2idx")
@@ -0,0 +1,144 @@
+import torch
+import torch.nn.functional as F
+
+# the finished state is read back from the device only every few steps
+EOS_CHECK_EVERY = 4
+
+
+class BeamSearch(object):
+    r"""
+    Inference-only batched beam search over a DecoderRNN. All hypotheses of a batch are
+    decoded together as one (batch * beam_width) decoder batch; finished hypotheses
+    only extend with <EOS> at no cost, and decoding stops once every hypothesis has
+    emitted <EOS> or after `max_length` steps. A beam width of 1 is greedy decoding.
+
+    Args:
+        decoder (DecoderRNN): decoder providing `forward_step`, `_init_state`, `sos_id`, `eos_id`
+        beam_width (int, optional): number of hypotheses kept per sample (default: 1)
+        length_penalty (float, optional): alpha of the GNMT length penalty
+            ((5 + length) / 6) ** alpha the final scores are divided by (default: 0)
+        max_length (int, optional): maximum number of decoding steps (default: `decoder.max_length`)
+
+    Inputs: encoder_hidden, encoder_outputs, batch_size
+        - **encoder_hidden**: initial decoder state, as for `DecoderRNN.forward` (default `None`)
+        - **encoder_outputs**: tensor, or tuple/list of tensors, with the batch as first
+          dimension, used for attention (default `None`)
+        - **batch_size** (int): needed only when both of the above are `None`
+
+    Outputs: sequences, lengths, scores
+        - **sequences** (batch, steps): best hypothesis of every sample, <EOS> included
+        - **lengths** (batch): length of every sequence, up to and including <EOS>
+        - **scores** (batch): length normalized log probability of every sequence
+    """
+
+    def __init__(self, decoder, beam_width=1, length_penalty=0.0, max_length=None):
+        self.decoder = decoder
+        self.beam_width = beam_width
+        self.length_penalty = length_penalty
+        self.max_length = max_length if max_length is not None else decoder.max_length
+
+    def decode(self, encoder_hidden=None, encoder_outputs=None, batch_size=None):
+        with torch.no_grad():
+            return self._decode(encoder_hidden, encoder_outputs, batch_size)
+
+    def _decode(self, encoder_hidden, encoder_outputs, batch_size):
+        reference = _first_tensor(encoder_hidden) if encoder_hidden is not None else _first_tensor(encoder_outputs)
+        if reference is not None:
+            batch_size = reference.size(1) if encoder_hidden is not None else reference.size(0)
+            device = reference.device
+        else:
+            device = torch.device('cpu')
+        K = self.beam_width
+        eos_id = self.decoder.eos_id
+
+        # every sample repeated beam_width times, beams of a sample next to each other
+        expand_idx = torch.arange(batch_size).long().to(device).view(-1, 1).repeat(1, K).view(-1)
+        hidden = _index_select(self.decoder._init_state(encoder_hidden), 1, expand_idx)
+        encoder_outputs = _index_select(encoder_outputs, 0, expand_idx)
+
+        # only the first beam of a sample is live at the start, so that the beams do
+        # not all pick the same tokens
+        scores = torch.zeros(batch_size, K).to(device)
+        if K > 1:
+            scores[:, 1:] = -float('inf')
+        scores = scores.view(-1)
+        finished = torch.zeros(batch_size * K).long().to(device)
+        lengths = torch.zeros(batch_size * K).long().to(device)
+        beam_offsets = (torch.arange(batch_size).long().to(device) * K).view(-1, 1)
+
+        symbols = torch.LongTensor([self.decoder.sos_id] * (batch_size * K)).to(device).view(-1, 1)
+        step_symbols, step_beams = [], []
+        eos_row = None
+        for step in range(self.max_length):
+            log_probs, hidden, _ = self.decoder.forward_step(symbols, hidden, encoder_outputs, function=F.log_softmax)
+            log_probs = log_probs.squeeze(1)
+            vocab_size = log_probs.size(1)
+
+            if eos_row is None:
+                eos_row = torch.zeros(vocab_size).fill_(-float('inf')).to(device)
+                eos_row[eos_id] = 0
+            # a finished hypothesis can only be extended with <EOS>, which costs nothing
+            done = finished.view(-1, 1).expand_as(log_probs) > 0
+            log_probs = torch.where(done, eos_row.view(1, -1).expand_as(log_probs), log_probs)
+
+            if K == 1:
+                step_scores, tokens = log_probs.max(1)
+                scores = scores + step_scores
+                beams = None
+            else:
+                candidates = (scores.view(-1, 1) + log_probs).view(batch_size, K * vocab_size)
+                scores, flat_idx = candidates.topk(K, dim=1)
+                scores = scores.view(-1)
+                beams = flat_idx // vocab_size + beam_offsets
+                beams = beams.view(-1)
+                tokens = (flat_idx % vocab_size).view(-1)
+
+                hidden = _index_select(hidden, 1, beams)
+                finished = finished.index_select(0, beams)
+                lengths = lengths.index_select(0, beams)
+
+            lengths = lengths + (1 - finished)
+            finished = torch.max(finished, tokens.eq(eos_id).long())
+            step_symbols.append(tokens)
+            step_beams.append(beams)
+            symbols = tokens.view(-1, 1)
+
+            if (step + 1) % EOS_CHECK_EVERY == 0 and int(finished.min()) == 1:
+                break
+
+        # best hypothesis of every sample, after length normalization
+        lengths_f = lengths.float()
+        normalized = scores / ((5.0 + lengths_f) / 6.0) ** self.length_penalty
+        best = normalized.view(batch_size, K).max(1)[1] + beam_offsets.view(-1)
+
+        # follow the back pointers from the last step
+        sequences = []
+        idx = best
+        for tokens, beams in zip(reversed(step_symbols), reversed(step_beams)):
+            sequences.append(tokens.index_select(0, idx))
+            if beams is not None:
+                idx = beams.index_select(0, idx)
+        sequences = torch.stack(sequences[::-1], 1) if sequences else torch.zeros(batch_size, 0).long().to(device)
+
+        return sequences, lengths.index_select(0, best), normalized.index_select(0, best)
+
+
+def _first_tensor(obj):
+    if obj is None:
+        return None
+    if isinstance(obj, (tuple, list)):
+        for item in obj:
+            tensor = _first_tensor(item)
+            if tensor is not None:
+                return tensor
+        return None
+    return obj
+
+
+def _index_select(obj, dim, index):
+    # index_select over a tensor or a (nested) tuple/list of tensors
+    if obj is None:
+        return None
+    if isinstance(obj, (tuple, list)):
+        return type(obj)(_index_select(item, dim, index) for item in obj)
+    return obj.index_select(dim, index)
@@ -11,6 +11,7 @@ import numpy as np
 
 import constants as C
 from DecoderRNN import DecoderRNN
+from beam_search import BeamSearch
 
 import modules
 from modules.highway import Highways
@@ -273,43 +274,7 @@ class BidafModel(nn.Module):
         """
         Forward pass
         """
-
-        # Encode the text
-        enc_passage = self._encode(passage, p_lengths)
-        enc_question = self._encode(question, q_lengths)
-
-        # Get the sizes
-        batch_size, p_num_tokens = enc_passage.size()[:2]
-        q_batch_size, q_num_tokens = enc_question.size()[:2]
-        assert batch_size == q_batch_size
-        assert batch_size == p_lengths.size()[0]
-        assert batch_size == q_lengths.size()[0]
-
-        # Create the masks
-        p_mask = self._create_mask_like(p_lengths, enc_passage)
-        q_mask = self._create_mask_like(q_lengths, enc_question)
-
-        # Get similarities and apply the attention mechanism
-        (question_in_passage, passage_in_question) = \
-            self._attention(enc_passage, enc_question, p_mask, q_mask)
-
-        # Concatenate the passage and similarities, then use a LSTM stack to
-        # extract features.
-        # 4 [b, p_num_tokens, hidden_size]
-        # -> [b, n, 4*hidden_size]
-        merged_passage = torch.cat([
-            enc_passage,
-            question_in_passage,
-            enc_passage * question_in_passage,
-            enc_passage * passage_in_question],
-            dim=2)
-        extracted = self.dropout(self._pack_and_unpack_lstm(
-            merged_passage, p_lengths, self.extractor))
-
-        # Use the features to get the start point probability vectors.
-        # Also use it to as attention over the features.
-        start_input = self.dropout(
-            torch.cat([merged_passage, extracted], dim=2))
+        start_input = self._decoder_input(passage, p_lengths, question, q_lengths)
 
         result = self.decoder(inputs=targets,
             encoder_hidden=None,
@@ -355,6 +320,57 @@ class BidafModel(nn.Module):
 
         return result
 
+    def _decoder_input(self, passage, p_lengths, question, q_lengths):
+        """
+        Encode passage and question into the features the decoder attends over.
+        """
+        # Encode the text
+        enc_passage = self._encode(passage, p_lengths)
+        enc_question = self._encode(question, q_lengths)
+
+        # Get the sizes
+        batch_size, p_num_tokens = enc_passage.size()[:2]
+        q_batch_size, q_num_tokens = enc_question.size()[:2]
+        assert batch_size == q_batch_size
+        assert batch_size == p_lengths.size()[0]
+        assert batch_size == q_lengths.size()[0]
+
+        # Create the masks
+        p_mask = self._create_mask_like(p_lengths, enc_passage)
+        q_mask = self._create_mask_like(q_lengths, enc_question)
+
+        # Get similarities and apply the attention mechanism
+        (question_in_passage, passage_in_question) = \
+            self._attention(enc_passage, enc_question, p_mask, q_mask)
+
+        # Concatenate the passage and similarities, then use a LSTM stack to
+        # extract features.
+        # 4 [b, p_num_tokens, hidden_size]
+        # -> [b, n, 4*hidden_size]
+        merged_passage = torch.cat([
+            enc_passage,
+            question_in_passage,
+            enc_passage * question_in_passage,
+            enc_passage * passage_in_question],
+            dim=2)
+        extracted = self.dropout(self._pack_and_unpack_lstm(
+            merged_passage, p_lengths, self.extractor))
+
+        # Use the features to get the start point probability vectors.
+        # Also use it to as attention over the features.
+        start_input = self.dropout(
+            torch.cat([merged_passage, extracted], dim=2))
+        return start_input
+
+    def generate(self, passage, p_lengths, question, q_lengths, beam_width=1, length_penalty=0.0):
+        """
+        Decode answers with batched beam search, without teacher forcing.
+        Returns the (batch, steps) sequences, their lengths (with EOS) and scores.
+        """
+        start_input = self._decoder_input(passage, p_lengths, question, q_lengths)
+        beam_search = BeamSearch(self.decoder, beam_width=beam_width, length_penalty=length_penalty)
+        return beam_search.decode(encoder_outputs=start_input)
+
     @classmethod
     def get_loss(cls, start_log_probs, end_log_probs, starts, ends):
         """
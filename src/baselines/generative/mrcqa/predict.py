@@ -126,22 +126,20 @@ def get_loader(data, args):
     return data
 
 
-def predict(logger, model, data):
+def predict(logger, model, data, beam_width=1, length_penalty=0.0):
     """
-    Train for one epoch.
+    Generate answers for every question, with beam search.
     """
     for batch_id, (qids, passages, queries, targets, _, _) in enumerate(data):
-        decoder_outputs, decoder_hidden, ret_dict = model(
+        output_seq, output_lengths, _ = model.generate(
             passages[:2], passages[2],
             queries[:2], queries[2],
-            targets[0], 0
+            beam_width=beam_width,
+            length_penalty=length_penalty
         )
 
-        output_seq = ret_dict['sequence']
-        output_lengths = ret_dict['length']
-        output_seq = torch.cat(output_seq, 1)
-
-        output_seq = output_seq.data.cpu().numpy()
+        output_seq = output_seq.cpu().numpy()
+        output_lengths = output_lengths.tolist()
         for seq_itr, length in enumerate(output_lengths):
             length = int(length)
             seq = output_seq[seq_itr, :length]
@@ -193,6 +191,13 @@ def main():
     argparser.add_argument("--batch_size",
                            type=int, default=64,
                            help="Batch size to use")
+    argparser.add_argument("--beam_width",
+                           type=int, default=1,
+                           help="Beam width, 1 for greedy decoding")
+    argparser.add_argument("--length_penalty",
+                           type=float, default=0.0,
+                           help="Alpha of the length penalty the beam "
+                           "scores are normalized with")
     argparser.add_argument("--cuda",
                            type=bool, default=torch.cuda.is_available(),
                            help="Use GPU if possible")
@@ -222,7 +227,7 @@ def main():
         data.tensor_type = torch.cuda.LongTensor
 
     with open(args.dest, 'w') as f_o:
-        for qid, toks in predict(logger, model, data):
+        for qid, toks in predict(logger, model, data, args.beam_width, args.length_penalty):
             toks = ' '.join(id_to_token[tok] for tok in toks)
             print(repr(qid), repr(toks), file=f_o)
 
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import random
+import unittest
+
+from nlgeval.pycocoevalcap.bleu.bleu import Bleu
+from nlgeval.pycocoevalcap.bleu.bleu_scorer import BleuScorer
+
+
+def cooked_score(gts, res):
+    # scores of the per sentence cooking scorer that Bleu used before
+    bleu_scorer = BleuScorer(n=4)
+    for id in gts.keys():
+        bleu_scorer += (res[id][0], gts[id])
+    return bleu_scorer.compute_score(option='closest', verbose=0)
+
+
+class TestBleu(unittest.TestCase):
+    def assertSameScores(self, gts, res):
+        score, scores = Bleu(4).compute_score(gts, res)
+        expected_score, expected_scores = cooked_score(gts, res)
+        # the same floats, not just close ones
+        self.assertEqual(expected_score, score)
+        self.assertEqual(expected_scores, scores)
+
+    def test_examples(self):
+        self.assertSameScores({0: ["this is a test", "this is also a test"]},
+                              {0: ["this is a good test"]})
+        self.assertSameScores({
+            0: ["this is one reference sentence for sentence1",
+                "this is one more reference sentence for sentence1"],
+            1: ["this is a reference sentence for sentence2 which was generated by your model",
+                "this is the second reference sentence for sentence2"],
+        }, {
+            0: ["this is the model generated sentence1 which seems good enough"],
+            1: ["this is sentence2 which has been generated by your model"],
+        })
+
+    def test_edge_cases(self):
+        # empty hypotheses and references, repeated n-grams, ties between the
+        # closest reference lengths and hypotheses shorter than every n-gram order
+        self.assertSameScores({
+            0: ["a a a a", "a a"],
+            1: ["b c", "b c d e"],
+            2: [""],
+            3: ["a b c d e f"],
+            4: ["x y z", "z y x"],
+        }, {
+            0: ["a a a a a a"],
+            1: ["b c d"],
+            2: ["a"],
+            3: [""],
+            4: ["x  y"],
+        })
+
+    def test_random_corpora(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            words = ['w%d' % i for i in range(rng.choice([2, 3, 5, 50]))]
+
+            def sentence():
+                return ' '.join(rng.choice(words) for _ in range(rng.choice([0, 1, 2, 3, 4, 6, 10, 20])))
+
+            ids = rng.sample(range(1000), rng.randint(1, 40))
+            gts = dict((id, [sentence() for _ in range(rng.randint(1, 5))]) for id in ids)
+            res = dict((id, [sentence()]) for id in ids)
+            self.assertSameScores(gts, res)
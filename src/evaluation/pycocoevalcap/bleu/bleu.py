@@ -8,7 +8,7 @@
 # Last Modified : Thu 19 Mar 2015 09:13:28 PM PDT
 # Authors : Hao Fang <hfang@uw.edu> and Tsung-Yi Lin <tl483@cornell.edu>
 
-from pycocoevalcap.bleu.bleu_scorer import BleuScorer
+from pycocoevalcap.bleu.vectorized_bleu import encode, corpus_bleu
 
 
 class Bleu:
@@ -23,8 +23,11 @@ class Bleu:
         assert(gts.keys() == res.keys())
         imgIds = gts.keys()
 
-        bleu_scorer = BleuScorer(n=self._n)
-        for id in imgIds:
+        # all hypotheses and references are encoded into flat word id arrays and
+        # scored at once; the scores are those of
+        # BleuScorer.compute_score(option='closest')
+        hypos, refs, ref_segments = [], [], []
+        for segment, id in enumerate(imgIds):
             hypo = res[id]
             ref = gts[id]
 
@@ -34,11 +37,15 @@ class Bleu:
             assert(type(ref) is list)
             assert(len(ref) >= 1)
 
-            bleu_scorer += (hypo[0], ref)
+            hypos.append(hypo[0])
+            refs.extend(ref)
+            ref_segments.extend([segment] * len(ref))
 
-        #score, scores = bleu_scorer.compute_score(option='shortest')
-        score, scores = bleu_scorer.compute_score(option='closest', verbose=0)
-        #score, scores = bleu_scorer.compute_score(option='average', verbose=1)
+        vocab = {}
+        hyp_ids, hyp_lengths = encode(hypos, vocab)
+        ref_ids, ref_lengths = encode(refs, vocab)
+        score, sentence_scores = corpus_bleu(hyp_ids, hyp_lengths, ref_ids, ref_lengths, ref_segments, n=self._n)
+        scores = [sentence_score.tolist() for sentence_score in sentence_scores]
 
         # return (bleu, bleu_info)
         return score, scores
@@ -0,0 +1,116 @@
+"""Scaling benchmark for data parallel CPU training
+
+Runs a fixed number of training steps of the Trainer on synthetic batches with 1, 2,
+4 and 8 gloo processes on this machine and reports the throughput of every run.
+Every process trains on batches of --batch_size samples, so the global batch grows
+with the number of processes (weak scaling); model hyperparameters are taken from
+the usual command line flags, e.g.
+
+    python benchmark_distributed.py --model_name LM_QAR --processes 1,2,4,8 --steps 20
+"""
+
+import os
+import time
+import argparse
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+import config
+import constants as C
+from data.vocabulary import Vocabulary
+from trainer import distributed
+from trainer.trainer import Trainer
+
+RANDOM_SEED = 1
+
+
+def get_benchmark_params():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_name', dest='model_name', type=str, default=C.LM_QUESTION_ANSWERS_REVIEWS)
+    parser.add_argument('--processes', dest='processes', type=str, default='1,2,4,8')
+    parser.add_argument('--steps', dest='steps', type=int, default=20)
+    parser.add_argument('--warmup_steps', dest='warmup_steps', type=int, default=3)
+    parser.add_argument('--port', dest='port', type=int, default=29500)
+    args, _ = parser.parse_known_args()
+    return args
+
+
+def synthetic_batches(params, num_batches, vocab_size, seed):
+    # batches of fixed shape with random tokens, in the form the Trainer gets
+    # them from the prefetcher
+    rng = np.random.RandomState(seed)
+    batch_size = params[C.BATCH_SIZE]
+    q_len, a_len, r_len = params[C.MAX_QUESTION_LEN], params[C.MAX_ANSWER_LEN], params[C.MAX_REVIEW_LEN]
+    num_slots = params[C.REVIEW_SELECT_NUM] or 0
+
+    def tokens(*shape):
+        return torch.from_numpy(rng.randint(C.RESERVED_IDS, vocab_size, size=shape)).long()
+
+    batches = []
+    for _ in range(num_batches):
+        answer_seqs = tokens(batch_size, a_len)
+        answer_lengths = np.full(batch_size, a_len)
+        question_seqs = tokens(batch_size, q_len)
+        review_seqs = (
+            tokens(batch_size * num_slots, r_len),
+            torch.LongTensor([r_len] * (batch_size * num_slots)),
+            torch.arange(batch_size * num_slots).long(),
+            num_slots
+        ) if num_slots else None
+        batches.append((answer_seqs, question_seqs, None, review_seqs, answer_lengths))
+    return batches
+
+
+def run(process_idx, num_processes, args, params, results):
+    distributed.init(process_idx, num_processes, 'tcp://127.0.0.1:%d' % args.port)
+    np.random.seed(RANDOM_SEED)
+    torch.manual_seed(RANDOM_SEED)
+
+    vocab = Vocabulary(['w%d' % i for i in range(params[C.VOCAB_SIZE])])
+    batches = synthetic_batches(params, args.warmup_steps + args.steps, vocab.get_vocab_size(), RANDOM_SEED + process_idx)
+    trainer = Trainer(batches, params, vocab=vocab, print_every=args.warmup_steps + args.steps + 1)
+    trainer.lr = params[C.LR]
+    trainer._set_optimizer(0)
+    trainer.loss.reset()
+    trainer._reset_accumulation()
+    trainer._reset_throughput()
+
+    for step, (answer_seqs, question_seqs, _, review_seqs, answer_lengths) in enumerate(batches):
+        if step == args.warmup_steps:
+            start = time.time()
+            trainer._reset_throughput()
+        trainer.train_batch(question_seqs, review_seqs, answer_seqs, answer_lengths)
+        trainer._train_step(0, step + 1)
+    elapsed = time.time() - start
+
+    if distributed.is_master():
+        results[num_processes] = (elapsed, trainer.throughput_tokens, trainer.throughput_sentences)
+
+
+def main():
+    args = get_benchmark_params()
+    params = config.get_model_params(args.model_name)
+    params[C.MODEL_NAME] = args.model_name
+    processes = [int(num) for num in args.processes.split(',')]
+
+    print('Model: %s, batch size per process = %d, %d cores' % (args.model_name, params[C.BATCH_SIZE], os.cpu_count()))
+    results = mp.Manager().dict()
+    for num_processes in processes:
+        mp.spawn(run, args=(num_processes, args, params, results), nprocs=num_processes)
+        args.port += 1
+
+    print('%10s %12s %14s %14s %10s %12s' % ('processes', 'time/step', 'tokens/s', 'sentences/s', 'speedup', 'efficiency'))
+    base = None
+    for num_processes in processes:
+        elapsed, num_tokens, num_sentences = results[num_processes]
+        sentences_per_sec = num_sentences / elapsed
+        base = base or sentences_per_sec / num_processes
+        speedup = sentences_per_sec / base
+        print('%10d %11.3fs %14.1f %14.1f %9.2fx %11.1f%%' % (num_processes, elapsed / args.steps,
+            num_tokens / elapsed, sentences_per_sec, speedup, 100.0 * speedup / num_processes))
+
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,8 @@ def get_main_params():
     parser.add_argument('--output_file', dest='output_file', type=str, default='output.txt')
     parser.add_argument('--process_idx', dest='process_idx', type=int, default=0)
     parser.add_argument('--num_processes', dest='num_processes', type=int, default=1)
+    parser.add_argument('--dist_init_method', dest='dist_init_method', type=str, default='tcp://127.0.0.1:29500')
+    parser.add_argument('--workers', dest='workers', type=int, default=1)
     args, _ = parser.parse_known_args()
     return args
 
@@ -28,6 +30,10 @@ def get_model_params(model_name):
     add_arg(parser, int, C.REVIEW_SELECT_NUM, H)
     add_arg(parser, int, C.NUM_EPOCHS, H)
     add_arg(parser, int, C.BATCH_SIZE, H)
+    add_arg(parser, int, C.MAX_BATCH_TOKENS, H)
+    add_arg(parser, int, C.PREFETCH_BATCHES, H)
+    add_arg(parser, int, C.ACCUMULATE_TOKENS, H)
+    add_arg(parser, int, C.CHECKPOINT_EVERY, H)
     add_arg(parser, float, C.DROPOUT, H)
     add_arg(parser, float, C.LR, H)
     add_arg(parser, int, C.HDIM_A, H)
@@ -41,6 +47,8 @@ def get_model_params(model_name):
     add_arg(parser, int, C.VOCAB_SIZE, H)
     add_arg(parser, float, C.TEACHER_FORCING_RATIO, H)
     add_arg(parser, int, C.OUTPUT_MAX_LEN, H)
+    add_arg(parser, int, C.BEAM_WIDTH, H)
+    add_arg(parser, float, C.LENGTH_PENALTY, H)
     add_arg(parser, str, C.LOG_FILENAME, H)
     add_arg(parser, str, C.OPTIMIZER_TYPE, H)
     add_arg(parser, int, C.MAX_QUESTION_LEN, H)
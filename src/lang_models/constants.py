@@ -35,6 +35,7 @@ REVIEWS_DATA_PATH = '../../data/reviews_small'
 TEXT_DATA_PATH = '../../data/text_data'
 JSON_DATA_PATH = '../../data/json_data'
 INPUT_DATA_PATH = '../data'
+DATASET_CACHE_DIR = '%s/dataset_cache' % INPUT_DATA_PATH
 
 # Types of categories
 AUTOMOTIVE = 'Automotive'
@@ -127,6 +128,10 @@ Default Hyperparameters for LM MODELS
 # Hyperparameter constants
 NUM_EPOCHS = 'num_epochs'
 BATCH_SIZE = 'batch_size'
+MAX_BATCH_TOKENS = 'max_batch_tokens'
+PREFETCH_BATCHES = 'prefetch_batches'
+ACCUMULATE_TOKENS = 'accumulate_tokens'
+CHECKPOINT_EVERY = 'checkpoint_every'
 DROPOUT = 'dropout'
 LR = 'lr'
 HDIM_A = 'hdim_a'
@@ -146,6 +151,8 @@ MAX_REVIEW_LEN = 'max_review_len'
 
 TEACHER_FORCING_RATIO = 'teacher_forcing_ratio'
 OUTPUT_MAX_LEN = 'output_max_len'
+BEAM_WIDTH = 'beam_width'
+LENGTH_PENALTY = 'length_penalty'
 MODEL_NAME = 'model_name'
 OPTIMIZER_TYPE = 'optimizer_type'
 
@@ -188,6 +195,10 @@ LM_HP = {
     REVIEW_SELECT_NUM:            [None,              None,               5],
     NUM_EPOCHS:                   [25,                25,                 25],
     BATCH_SIZE:                   [32,                256,                128],
+    MAX_BATCH_TOKENS:             [None,              None,               None],
+    PREFETCH_BATCHES:             [4,                 4,                  4],
+    ACCUMULATE_TOKENS:            [None,              None,               None],
+    CHECKPOINT_EVERY:             [None,              None,               None],
     DROPOUT:                      [0.2,               0.2,                0.0],
     LR:                           [0.01,              0.01,               0.01],
     HDIM_A:                       [256,               128,                128],
@@ -201,6 +212,8 @@ LM_HP = {
     VOCAB_SIZE:                   [30000,             30000,              20000],
     TEACHER_FORCING_RATIO:        [1.0,               1.0,                1.0],
     OUTPUT_MAX_LEN:               [128,               128,                128],
+    BEAM_WIDTH:                   [1,                 1,                  1],
+    LENGTH_PENALTY:               [0.0,               0.0,                0.0],
     USE_ATTENTION:                [False,             True,              True],
     CATEGORY:                     ["NEW"] * 3,
     LOG_FILENAME:                 ['log.log'] * 3,
@@ -11,6 +11,9 @@ import config
 import constants as C
 from data.vocabulary import Vocabulary
 from data import review_utils
+from data import tokenization
+from preprocessing import convert_rnet
+from preprocessing import record_pipeline
 import string
 import argparse
 from evaluator.evaluator import COCOEvalCap
@@ -20,6 +23,12 @@ import json
 DEBUG = False
 TEMPFILEPATH = './temp'
 
+# MS MARCO query types of the question types, as in prepro/convert_msmarco.py
+QUERY_TYPES = {
+    'descriptive': 'DESCRIPTION',
+    'yesno': 'YESNO',
+}
+
 def get_main_params():
     parser = argparse.ArgumentParser()
     parser.add_argument('--model_name', dest='model_name', type=str, default=C.LM_ANSWERS)
@@ -30,6 +39,10 @@ def get_main_params():
     parser.add_argument('--max_review_len', dest='max_review_len', type=int, default=50)
     parser.add_argument('--max_num_spans', dest='max_num_spans', type=int, default=5)
     parser.add_argument('--seed', dest='seed', type=int, default=1)
+    parser.add_argument('--workers', dest='workers', type=int, default=1)
+    parser.add_argument('--msmarco_file', dest='msmarco_file', type=str, default=None)
+    parser.add_argument('--rnet_examples_file', dest='rnet_examples_file', type=str, default=None)
+    parser.add_argument('--rnet_eval_file', dest='rnet_eval_file', type=str, default=None)
     args, _ = parser.parse_known_args()
     return args
 
@@ -43,18 +56,7 @@ class AmazonDataset(object):
         self.val_path = '%s/val-%s.pickle' % (C.INPUT_DATA_PATH, category)
         self.test_path = '%s/test-%s.pickle' % (C.INPUT_DATA_PATH, category)
 
-    @staticmethod
-    def tokenize(text):
-        punctuations = string.punctuation.replace("\'", '')
-
-        for ch in punctuations:
-            text = text.replace(ch, " " + ch + " ")
-
-        tokens = text.split()
-        for i, token in enumerate(tokens):
-            if not token.isupper():
-                tokens[i] = token.lower()
-        return tokens
+    tokenize = staticmethod(tokenization.tokenize)
 
     def find_answer_spans(self, max_num_spans, answer_span_lens, answers, context):
         context = context.split(' ')
@@ -80,7 +82,70 @@ class AmazonDataset(object):
 
         return [i[1] for i in sorted(answers, reverse=True, key=itemgetter(0))[:max_num_spans]]
 
-    def save_data(self, p_idx, num_processes, max_num_products, path, max_review_len, answer_span_lens, max_num_spans, log, filename):
+    def product_paragraphs(self, row, max_review_len, answer_span_lens, max_num_spans, stop_words):
+        # combine all or get only the reviews
+        reviews = row[C.REVIEWS_LIST]
+        review_tokens = []
+        review_texts = []
+        for review in reviews:
+            sentences = nltk.sent_tokenize(review[C.TEXT])
+            bufr = []
+            buffer_len = 0
+            for sentence in sentences:
+                buffer_len += len(self.tokenize(sentence))
+                if buffer_len > max_review_len:
+                    review_texts.append(' '.join(bufr))
+                    bufr = []
+                    buffer_len = 0
+                else:
+                    bufr.append(sentence)
+
+        review_tokens = [self.tokenize(r) for r in review_texts]
+        review_tokens = [[token for token in r if token not in stop_words and token not in string.punctuation] for r in review_tokens]
+        inverted_index = _create_inverted_index(review_tokens)
+        review_tokens = list(map(set, review_tokens))
+
+        paragraphs = []
+        for qid, question in enumerate(row[C.QUESTIONS_LIST]):
+            qas = []
+            question_text = question[C.TEXT]
+            question_tokens = self.tokenize(question_text)
+
+            # Get Context
+            scores_q, top_reviews_q = review_utils.top_reviews_and_scores(
+                set(question_tokens),
+                review_tokens,
+                inverted_index,
+                None,
+                review_texts,
+                self.review_select_mode,
+                self.review_select_num
+            )
+            context = ' '.join(top_reviews_q)
+
+            answers = question[C.ANSWERS]
+            new_answers = self.find_answer_spans(max_num_spans, answer_span_lens, answers, context)
+            # max_num_spans, answer_span_lens, answers, context
+
+            # is_answerable = find_answerable(question_text, context)
+            is_answerable = False
+
+            # New Question
+            qas.append({
+                'id': qid,
+                'is_impossible': is_answerable,
+                'question': question_text,
+                'answers': new_answers,
+                'human_answers': [answer[C.TEXT] for answer in answers],
+            })
+
+            paragraphs.append(({
+                    'context': context,
+                    'qas': qas,
+            }, top_reviews_q, question.get(C.TYPE)))
+        return paragraphs
+
+    def save_data(self, p_idx, num_processes, max_num_products, path, max_review_len, answer_span_lens, max_num_spans, log, output_files, workers=1):
         log("Creating Dataset from " + path)
         assert os.path.exists(path)
 
@@ -90,78 +155,64 @@ class AmazonDataset(object):
                 dataFrame = dataFrame.iloc[:5]
 
         log('Number of products: %d' % len(dataFrame))
-        stop_words = set(stopwords.words('english'))
 
-        paragraphs = []
-        product_idx = 0
-        with open(filename, 'w') as fp:
+        def products():
+            product_idx = 0
             for (_, row) in dataFrame.iterrows():
                 product_idx += 1
                 if product_idx % num_processes != p_idx:
                     continue
                 if product_idx >= max_num_products:
                     break
-                log('Iteration: %d / %d' % (product_idx // num_processes, max_num_products // num_processes))
-
-                # combine all or get only the reviews
-                reviews = row[C.REVIEWS_LIST]
-                review_tokens = []
-                review_texts = []
-                for review in reviews:
-                    sentences = nltk.sent_tokenize(review[C.TEXT])
-                    bufr = []
-                    buffer_len = 0
-                    for sentence in sentences:
-                        buffer_len += len(self.tokenize(sentence))
-                        if buffer_len > max_review_len:
-                            review_texts.append(' '.join(bufr))
-                            bufr = []
-                            buffer_len = 0
-                        else:
-                            bufr.append(sentence)
-
-                review_tokens = [self.tokenize(r) for r in review_texts]
-                review_tokens = [[token for token in r if token not in stop_words and token not in string.punctuation] for r in review_tokens]
-                inverted_index = _create_inverted_index(review_tokens)
-                review_tokens = list(map(set, review_tokens))
-
-                for qid, question in enumerate(row[C.QUESTIONS_LIST]):
-                    qas = []
-                    question_text = question[C.TEXT]
-                    question_tokens = self.tokenize(question_text)
-
-                    # Get Context
-                    scores_q, top_reviews_q = review_utils.top_reviews_and_scores(
-                        set(question_tokens),
-                        review_tokens,
-                        inverted_index,
-                        None,
-                        review_texts,
-                        self.review_select_mode,
-                        self.review_select_num
-                    )
-                    context = ' '.join(top_reviews_q)
-
-                    answers = question[C.ANSWERS]
-                    new_answers = self.find_answer_spans(max_num_spans, answer_span_lens, answers, context)
-                    # max_num_spans, answer_span_lens, answers, context
-
-                    # is_answerable = find_answerable(question_text, context)
-                    is_answerable = False
-
-                    # New Question
-                    qas.append({
-                        'id': qid,
-                        'is_impossible': is_answerable,
-                        'question': question_text,
-                        'answers': new_answers,
-                        'human_answers': [answer[C.TEXT] for answer in answers],
-                    })
-
-                    fp.write(json.dumps({
-                            'context': context,
-                            'qas': qas,
-                    }) + '\n')
+                yield row
+
+        results = record_pipeline.map_ordered(
+            _process_product,
+            products(),
+            workers,
+            initializer=_init_worker,
+            initargs=(self, max_review_len, answer_span_lens, max_num_spans)
+        )
+
+        # ids of the R-Net examples and MS MARCO queries have to be unique over the
+        # whole file; question ids only count the questions of a product
+        example_id = 0
+        query_id = 0
+        with record_pipeline.RecordWriter(output_files) as writer:
+            for iteration, paragraphs in enumerate(results, 1):
+                log('Iteration: %d / %d' % (iteration, max_num_products // num_processes))
+                for paragraph, top_reviews, question_type in paragraphs:
+                    query_id += 1
+                    outputs = {'squad': [paragraph]}
+                    if 'msmarco' in writer.formats():
+                        outputs['msmarco'] = [_to_msmarco(paragraph, top_reviews, question_type, query_id)]
+                    if 'rnet_examples' in writer.formats() or 'rnet_eval' in writer.formats():
+                        example_id += 1
+                        outputs['rnet_examples'], outputs['rnet_eval'] = convert_rnet.to_rnet(paragraph, example_id, 'answers')
+                    writer.write(outputs)
+
+# per-process state, filled by _init_worker
+_worker = {}
+
+def _init_worker(dataset, max_review_len, answer_span_lens, max_num_spans):
+    _worker['dataset'] = dataset
+    _worker['params'] = (max_review_len, answer_span_lens, max_num_spans, set(stopwords.words('english')))
+
+def _process_product(row):
+    return _worker['dataset'].product_paragraphs(row, *_worker['params'])
+
+def _to_msmarco(paragraph, top_reviews, question_type, query_id):
+    qa = paragraph['qas'][0]
+    if question_type not in QUERY_TYPES:
+        raise ValueError('new query_type %s' % question_type)
+    return {
+        'answers': qa['human_answers'],
+        'passages': [{'is_selected': 1, 'url': '', 'passage_text': review} for review in top_reviews],
+        'query': qa['question'],
+        'query_id': query_id,
+        'query_type': QUERY_TYPES[question_type],
+        'wellFormedAnswers': [],
+    }
 
 def _reviews_and_answer(top_reviews_a, answer_texts, i):
     if len(top_reviews_a) <= i:
@@ -234,14 +285,20 @@ def main():
         answer_span_lens,
         max_num_spans,
         log,
-        process_filepath(
-            params[C.CATEGORY],
-            main_params.mode,
-            max_review_len,
-            max_num_spans,
-            seed, 
-            main_params.process_idx,
-        ),
+        {
+            'squad': process_filepath(
+                params[C.CATEGORY],
+                main_params.mode,
+                max_review_len,
+                max_num_spans,
+                seed,
+                main_params.process_idx,
+            ),
+            'msmarco': main_params.msmarco_file,
+            'rnet_examples': main_params.rnet_examples_file,
+            'rnet_eval': main_params.rnet_eval_file,
+        },
+        main_params.workers,
     )
     with open('%s/all_processes.log' % TEMPFILEPATH, 'a') as fp:
         fp.write('Finished process: %d / %d\n' % (main_params.process_idx, main_params.num_processes))
@@ -9,143 +9,184 @@ from torch.utils.data import Dataset, DataLoader
 
 import constants as C
 
+# lengths are rounded up to a multiple of this before bucketing, so that a bucket
+# holds enough samples to fill batches
+BUCKET_WIDTH = 8
+
 class AmazonDataLoader(object):
 
-    def __init__(self, data, model, batch_size):
-        self.answersDict, self.questionsDict, self.questionAnswersDict, self.reviewsDict, self.data = data
+    def __init__(self, data, model, batch_size, max_tokens=None, shuffle=True, drop_last=True):
+        self.answersDict, self.questionsDict, self.questionAnswersDict, self.reviewsDict, \
+            self.questionReviewsDict, data = data
 
         self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.shuffle = shuffle
+        self.drop_last = drop_last
         self.model = model
-        self.data = sorted(self.data, key=self.sortByLength, reverse=True)
-        self.num_batches = len(self.data) // self.batch_size
-
-    def sortByLength(self, item):
-        max_len = 0
-
-        if self.model == C.LM_ANSWERS:
-            assert(len(item) == 1)
-            answer = self.answersDict[item[0]]
-            max_len = len(answer)
-
-        elif self.model == C.LM_QUESTION_ANSWERS:
-            assert(len(item) == 2)
-            question = self.questionsDict[item[1]]
-            max_len = len(question)
-
-        elif self.model == C.LM_QUESTION_ANSWERS_REVIEWS:
-            assert(len(item) == 3)
-            #reviewIds = item[2]
-            #for reviewId in reviewIds:
-            #   review = self.reviewsDict[reviewId]
-            #   max_len = max(max_len, len(review))
-            question = self.questionsDict[item[1]]
-            max_len = len(question)
-        else:
+        if self.model not in [C.LM_ANSWERS, C.LM_QUESTION_ANSWERS, C.LM_QUESTION_ANSWERS_REVIEWS]:
             raise 'Unknown Model %s' % self.model
 
-        return max_len
+        lengths = self.lengths(data)
+        order = self.sortByLength(lengths)
+        self.data = data[order]
+        self.sample_lengths = lengths[order]
+        self.batches = self.make_batches()
+        self.num_batches = len(self.batches)
+        self.batch_order = None
+        self.resume_position = None
+        self.shard_idx, self.num_shards, self.shard_drop_last = 0, 1, True
+        self.reset_padding_stats()
+
+    def lengths(self, data):
+        # [num_samples, 4]: question length, max review length, answer length and
+        # number of review slots of every (answerId, questionId) sample
+        answerIds, questionIds = data[:, 0], data[:, 1]
+        lengths = np.zeros((len(data), 4), dtype=np.int64)
+        lengths[:, 2] = self.answersDict.lengths(answerIds)
+        if self.model == C.LM_ANSWERS:
+            return lengths
+
+        lengths[:, 0] = self.questionsDict.lengths(questionIds)
+        if self.model == C.LM_QUESTION_ANSWERS:
+            return lengths
+
+        # max review length of every question, at least 1
+        num_reviews = self.questionReviewsDict.lengths()
+        max_review_lens = np.ones(len(num_reviews), dtype=np.int64)
+        review_questions = np.repeat(np.arange(len(num_reviews)), num_reviews)
+        np.maximum.at(max_review_lens, review_questions, self.reviewsDict.lengths(self.questionReviewsDict.flat))
+        lengths[:, 1] = max_review_lens[questionIds]
+        lengths[:, 3] = num_reviews[questionIds]
+        return lengths
+
+    def sortByLength(self, lengths):
+        # stable order by descending bucket key; samples of a bucket have similar
+        # lengths in every field
+        buckets = (lengths[:, :3] + BUCKET_WIDTH - 1) // BUCKET_WIDTH
+        return np.lexsort((-buckets[:, 2], -buckets[:, 1], -buckets[:, 0]))
+
+    def make_batches(self):
+        # Without max_tokens: fixed batch_size batches, the last partial batch dropped
+        # unless drop_last is off.
+        # With max_tokens: a batch grows while its padded size in tokens (all fields,
+        # every review slot) stays within the budget.
+        if not self.max_tokens:
+            num_batches = len(self.data) // self.batch_size
+            batches = [list(range(i * self.batch_size, (i + 1) * self.batch_size)) for i in range(num_batches)]
+            if not self.drop_last and num_batches * self.batch_size < len(self.data):
+                batches.append(list(range(num_batches * self.batch_size, len(self.data))))
+            return batches
+
+        batches = []
+        batch = []
+        max_q, max_r, max_a, max_slots = 0, 0, 0, 0
+        for idx, (q_len, r_len, a_len, slots) in enumerate(self.sample_lengths.tolist()):
+            new_max = (max(max_q, q_len), max(max_r, r_len), max(max_a, a_len), max(max_slots, slots))
+            cost = (len(batch) + 1) * (new_max[0] + new_max[3] * new_max[1] + new_max[2])
+            if len(batch) > 0 and cost > self.max_tokens:
+                batches.append(batch)
+                batch = []
+                new_max = (q_len, r_len, a_len, slots)
+            batch.append(idx)
+            max_q, max_r, max_a, max_slots = new_max
+        if len(batch) > 0:
+            batches.append(batch)
+        return batches
+
+    def reset_padding_stats(self):
+        self.num_tokens = 0
+        self.num_padded_tokens = 0
+
+    def padding_waste(self):
+        # fraction of the batch positions fed to the model that were padding
+        if self.num_padded_tokens == 0:
+            return 0.0
+        return 1.0 - self.num_tokens / float(self.num_padded_tokens)
+
+    def _pad(self, ragged, ids, reverse=False, max_len=None, align_left=None):
+        padded_data, lengths = ragged.padded(ids, max_len=max_len, reverse=reverse, align_left=align_left)
+        self.num_tokens += int(lengths.sum())
+        self.num_padded_tokens += padded_data.size
+        return padded_data, lengths
 
     def pad_answers(self, answerIds):
-        batch_data = []
-        for answerId in answerIds:
-            ids = self.answersDict[answerId]
-            batch_data.append(ids)
-
-        lengths = np.array([len(item) for item in batch_data])
-        max_len = max(lengths)
-
-        padded_data = np.array(
-            [np.pad(item, (0, max_len - len(item)), 'constant') for item in batch_data])
+        padded_data, lengths = self._pad(self.answersDict, answerIds)
         return (padded_data, lengths)
 
 
     def pad_questions(self, questionIds):
-        batch_data = []
-        for questionId in questionIds:
-            ids = self.questionsDict[questionId]
-            batch_data.append(ids)
-
-        lengths = np.array([len(item) for item in batch_data])
-        max_len = max(lengths)
-
-        padded_data = np.array(
-            [np.pad(item, (0, max_len - len(item)), 'constant') for item in batch_data])
-        padded_data = _reverse(padded_data)
-
+        padded_data, _ = self._pad(self.questionsDict, questionIds, reverse=True)
         return (padded_data)
 
-    def pad_reviews(self, reviewIdsList):
-        review_data = []
-        for reviewIds in reviewIdsList:
-            reviews = []
-            for reviewId in reviewIds:
-                ids = self.reviewsDict[reviewId]
-                reviews.append(ids)
-            review_data.append(reviews)
-
-        max_num_reviews = 0
-        for reviews in review_data:
-            max_num_reviews = max(max_num_reviews, len(reviews))
-
-        data = []
-        for i in range(max_num_reviews):
-            batch_data = []
-            for j in range(self.batch_size):
-                reviews = review_data[j]
-                if i < len(reviews):
-                    batch_data.append(reviews[i])
-                else:
-                    batch_data.append([0])
-            data.append(batch_data)
-
-        padded_data = []
-        for i in range(max_num_reviews):
-            batch_data = data[i]
-            lengths = [len(review) for review in batch_data]
-            max_len = max(lengths)
-
-            padded_batch_data = np.array(
-                [np.pad(item, (0, max_len - len(item)), 'constant') for item in batch_data])
-            padded_batch_data = _reverse(padded_batch_data)
-
-            padded_data.append(padded_batch_data)
-
-        return padded_data
-
+    def pad_reviews(self, questionIds):
+        # all reviews of the batch as one [num_reviews, max_len] array for a single
+        # packed encoder pass: reversed, left aligned and sorted by descending length.
+        # slots[i] is the position of review i in the (batch, num_slots) grid of review
+        # slots; a slot without a review has no row and is masked in the model.
+        starts = self.questionReviewsDict.offsets[questionIds]
+        num_reviews = self.questionReviewsDict.lengths(questionIds)
+        num_slots = max(int(num_reviews.max()), 1)
+
+        samples = np.repeat(np.arange(len(questionIds)), num_reviews)
+        positions = np.arange(len(samples)) - np.repeat(np.cumsum(num_reviews) - num_reviews, num_reviews)
+        reviewIds = self.questionReviewsDict.flat[starts[samples] + positions]
+        slots = samples * num_slots + positions
+
+        order = np.argsort(-self.reviewsDict.lengths(reviewIds), kind='stable')
+        padded_data, lengths = self._pad(self.reviewsDict, reviewIds[order], reverse=True, align_left=True)
+        return (padded_data, lengths, slots[order], num_slots)
+
+
+    def shard(self, shard_idx, num_shards, drop_last=True):
+        # Iterate only every num_shards-th batch of the epoch's order, starting at
+        # shard_idx. The order must be the same in every shard (same numpy seed).
+        # With drop_last, every shard gets the same number of batches so that data
+        # parallel processes step in lockstep; without it, the leftover batches go
+        # to the first shards, for evaluation, which must see every batch.
+        self.shard_idx, self.num_shards, self.shard_drop_last = shard_idx, num_shards, drop_last
+
+    def resume_from(self, batch_order, next_batch):
+        # the next iteration continues an interrupted epoch: same batch order,
+        # starting at position next_batch
+        self.resume_position = (np.asarray(batch_order), next_batch)
 
     def __iter__(self):
-        indices = np.arange(self.num_batches)
-        np.random.shuffle(indices)
-
-        for index in indices:
-            start = index * self.batch_size
-            end = (index + 1) * self.batch_size
-
-            batch_data = self.data[start:end]
-            #print(batch_data)
-            assert(self.batch_size == len(batch_data))
+        if self.resume_position is not None:
+            indices, start = self.resume_position
+            self.resume_position = None
+        else:
+            indices = np.arange(self.num_batches)
+            if self.shuffle:
+                np.random.shuffle(indices)
+            start = 0
+        self.batch_order = indices
+        self.reset_padding_stats()
+
+        if self.shard_drop_last:
+            indices = indices[:len(self) * self.num_shards]
+        indices = indices[self.shard_idx::self.num_shards]
+        for index in indices[start:]:
+            batch_data = self.data[self.batches[index]]
+            answerIds, questionIds = batch_data[:, 0], batch_data[:, 1]
 
             if self.model == C.LM_ANSWERS:
-                [answerIds] = zip(*batch_data)
-                paded_answers = self.pad_answers(list(answerIds))
+                paded_answers = self.pad_answers(answerIds)
                 yield (paded_answers)
 
             elif self.model == C.LM_QUESTION_ANSWERS:
-                [answerIds, questionIds] = zip(*batch_data)
-                paded_answers = self.pad_answers(list(answerIds))
-                padded_questions = self.pad_questions(list(questionIds))
-                yield (paded_answers, padded_questions, list(questionIds))
+                paded_answers = self.pad_answers(answerIds)
+                padded_questions = self.pad_questions(questionIds)
+                yield (paded_answers, padded_questions, questionIds.tolist())
 
             elif self.model == C.LM_QUESTION_ANSWERS_REVIEWS:
-                [answerIds, questionIds, reviewIds] = zip(*batch_data)
-                paded_answers = self.pad_answers(list(answerIds))
-                padded_questions = self.pad_questions(list(questionIds))
-                padded_reviews = self.pad_reviews(list(reviewIds))
-                yield (paded_answers, padded_questions, list(questionIds), padded_reviews)
+                paded_answers = self.pad_answers(answerIds)
+                padded_questions = self.pad_questions(questionIds)
+                padded_reviews = self.pad_reviews(questionIds)
+                yield (paded_answers, padded_questions, questionIds.tolist(), padded_reviews)
 
 
     def __len__(self):
-        return self.num_batches
-
-def _reverse(array):
-    return np.ascontiguousarray(array[:, ::-1])
+        if not self.shard_drop_last:
+            return len(range(self.shard_idx, self.num_batches, self.num_shards))
+        return self.num_batches // self.num_shards
@@ -1,4 +1,7 @@
 import os
+import itertools
+import functools
+import numpy as np
 import torch
 import string
 import pandas as pd
@@ -6,15 +9,22 @@ from tqdm import tqdm
 from nltk.corpus import stopwords
 
 import constants as C
-from data.vocabulary import Vocabulary
+from data.vocabulary import VocabularyBuilder, count_tokens
 from data import review_utils
+from data import tokenization
+from data.ragged import RaggedBuilder
+from data.dataset_cache import DatasetCache, cache_key, vocab_fingerprint
+from preprocessing.record_pipeline import map_ordered
 import string
 import json
 
 DEBUG = False
 
+# lines per shard when counting and encoding
+SHARD_LINES = 10000
+
 class AmazonDataset(object):
-    def __init__(self, params, mode):
+    def __init__(self, params, mode, vocab=None, cache_dir=C.DATASET_CACHE_DIR, workers=1):
         self.model = params[C.MODEL_NAME]
         self.max_question_len = params[C.MAX_QUESTION_LEN]
         self.max_answer_len = params[C.MAX_ANSWER_LEN]
@@ -22,10 +32,14 @@ class AmazonDataset(object):
         self.review_select_num = params[C.REVIEW_SELECT_NUM]
         self.review_select_mode = params[C.REVIEW_SELECT_MODE]
         self.max_vocab_size = params[C.VOCAB_SIZE]
+        self.workers = workers
         suffix = 'qar_all'
 
+        # tokenized data is cached on disk; vocab is passed in when evaluating a saved model
+        self.cache = DatasetCache(cache_dir) if cache_dir else None
+
         train_path = '%s/train-%s.jsonl' % (C.INPUT_DATA_PATH, suffix)
-        self.vocab = self.create_vocab(train_path)
+        self.vocab = vocab if vocab is not None else self.load_vocab(train_path)
 
         if mode == C.TRAIN_TYPE:
             self.train = self.get_data(train_path)
@@ -37,121 +51,142 @@ class AmazonDataset(object):
             test_path = '%s/test-%s.jsonl' % (C.INPUT_DATA_PATH, suffix)
             self.test = self.get_data(test_path)
 
-    @staticmethod
-    def tokenize(text):
-        punctuations = string.punctuation.replace("\'", '')
-
-        for ch in punctuations:
-            text = text.replace(ch, " " + ch + " ")
-
-        tokens = text.split()
-        for i, token in enumerate(tokens):
-            if not token.isupper():
-                tokens[i] = token.lower()
-        return tokens
+    tokenize = staticmethod(tokenization.tokenize)
 
     def truncate_tokens(self, text, max_length):
         return self.tokenize(text)[:max_length]
 
+    def max_lens(self):
+        return [self.max_question_len, self.max_answer_len, self.max_review_len]
+
+    def load_vocab(self, train_path):
+        if self.cache is None:
+            return self.create_vocab(train_path)
+
+        key = cache_key('vocab', self.cache.file_hash(train_path), self.max_lens(), self.max_vocab_size)
+        vocab = self.cache.load_vocab(key)
+        if vocab is None:
+            vocab = self.create_vocab(train_path)
+            self.cache.save_vocab(key, vocab)
+        else:
+            print("Loaded cached vocab for %s, Vocab Size = %d" % (train_path, vocab.get_vocab_size()))
+        return vocab
+
     def create_vocab(self, train_path):
-        vocab = Vocabulary(self.max_vocab_size)
+        # shards of the train file are counted in parallel and merged in order
+        builder = VocabularyBuilder(self.max_vocab_size)
         assert os.path.exists(train_path)
         total_tokens = 0
 
+        count_shard = functools.partial(_count_shard, max_lens=self.max_lens())
         with open(train_path, 'r') as fp:
-            for line in fp:
-                try:
-                    question = json.loads(line)
-                except json.JSONDecodeError:
-                    raise Exception('\"%s\" is not a valid json' % line)
-
-                if question[C.IS_ANSWERABLE] == 0:
-                    continue
-
-                tokens = self.truncate_tokens(question[C.QUESTION_TEXT], self.max_question_len)
-                vocab.add_sequence(tokens)
+            for counts, num_answer_tokens in map_ordered(count_shard, _shards(fp), workers=self.workers, chunksize=1):
+                builder.merge(counts)
+                total_tokens += num_answer_tokens
 
-                for answer in question[C.ANSWERS]:
-                    tokens = self.truncate_tokens(answer[C.ANSWER_TEXT], self.max_answer_len)
-                    total_tokens += len(tokens)
-                    vocab.add_sequence(tokens)
-
-                for review in question[C.REVIEW_SNIPPETS]:
-                    tokens = self.truncate_tokens(review, self.max_review_len)
-                    vocab.add_sequence(tokens)
-
-        print("Train: No. of Tokens = %d, Vocab Size = %d" % (total_tokens, vocab.size))
+        vocab = builder.build()
+        print("Train: No. of Tokens = %d, Vocab Size = %d" % (total_tokens, vocab.get_vocab_size()))
         return vocab
 
     def get_data(self, path):
-        answersDict = []
-        questionsDict = []
-        reviewsDict = []
-        questionAnswersDict = []
-        reviewsDictList = []
-
-        questionId = -1
-        reviewId = -1
-        answerId = -1
-        data = []
+        if self.cache is None:
+            return self.make_data(self.read_data(path))
+
+        key = cache_key('data', self.cache.file_hash(path), self.max_lens(), vocab_fingerprint(self.vocab))
+        arrays = self.cache.load_data(key)
+        if arrays is None:
+            arrays = self.read_data(path)
+            self.cache.save_data(key, arrays)
+        else:
+            print("Loaded cached dataset for " + path)
+        return self.make_data(arrays)
+
+    def make_data(self, arrays):
+        # a sample is an (answerId, questionId) row; the reviews of a sample are the
+        # reviews of its question, looked up through questionReviewsDict
+        answersDict, questionsDict, reviewsDict = arrays['answers'], arrays['questions'], arrays['reviews']
+        questionAnswersDict, questionReviewsDict = arrays['question_answers'], arrays['question_reviews']
+
+        data = np.empty((len(questionAnswersDict.flat), 2), dtype=np.int32)
+        data[:, 0] = questionAnswersDict.flat
+        data[:, 1] = np.repeat(np.arange(len(questionAnswersDict)), questionAnswersDict.lengths())
+
+        print("Number of samples in the data = %d" % (len(data)))
+        return (answersDict, questionsDict, questionAnswersDict, reviewsDict, questionReviewsDict, data)
+
+    def read_data(self, path):
+        answersDict = RaggedBuilder()
+        questionsDict = RaggedBuilder()
+        reviewsDict = RaggedBuilder()
+        questionAnswersDict = RaggedBuilder()
+        questionReviewsDict = RaggedBuilder()
 
         print("Creating Dataset from " + path)
         assert os.path.exists(path)
 
         with open(path, 'r') as fp:
-            for line in fp:
-                try:
-                    row = json.loads(line)
-                except json.JSONDecodeError:
-                    raise Exception('\"%s\" is not a valid json' % line)
-
-                if row[C.IS_ANSWERABLE] == 0:
-                    continue
-
-                question = row[C.QUESTION_TEXT]
-                answers = row[C.ANSWERS]
-                reviews = row[C.REVIEW_SNIPPETS][:5]    # TODO: Make this limit (5) a parameter
-
-                review_tokens = []
-                reviewsDictList = []
-                for review in reviews:
-                    tokens = self.tokenize(review)
-                    review_tokens.append(tokens)
-                    review_ids = self.vocab.indices_from_token_list(tokens[:self.max_review_len])
-                    reviewsDict.append(review_ids)
-                    reviewId += 1
-                    reviewsDictList.append(reviewId)
-
-                # Add tuples to data 
-                question_tokens = self.tokenize(question)[:self.max_question_len]
-                question_ids = self.vocab.indices_from_token_list(question_tokens)
-                questionsDict.append(question_ids)
-                questionId += 1
-
-                answerIdsList = []
-                tuples = []
-                for answer in answers:
-                    answer_tokens = self.truncate_tokens(answer[C.ANSWER_TEXT], self.max_answer_len)
-                    answer_ids = self.vocab.indices_from_token_list(answer_tokens)
-                    answersDict.append(answer_ids)
-                    answerId += 1
-                    answerIdsList.append(answerId)
-
-                    if self.model == C.LM_ANSWERS:
-                        tuples.append((answerId,))
-                    elif self.model == C.LM_QUESTION_ANSWERS:
-                        tuples.append((answerId, questionId))
-                    elif self.model == C.LM_QUESTION_ANSWERS_REVIEWS:
-                        tuples.append((answerId, questionId, reviewsDictList))
-                    else:
-                        raise 'Unexpected'
-                questionAnswersDict.append(answerIdsList)
-                data.extend(tuples)
-
-        assert(len(answersDict) == answerId+1)
-        assert(len(questionsDict) == questionId+1)
-        assert(len(reviewsDict) == reviewId+1)
-        data_size = len(data)
-        print("Number of samples in the data = %d" % (data_size))
-
-        return (answersDict, questionsDict, questionAnswersDict, reviewsDict, data)
+            for lines in _shards(fp):
+                questions, answers, reviews = [], [], []
+                num_answers, num_reviews = [], []
+                for row in _answerable_rows(lines):
+                    questions.append(self.truncate_tokens(row[C.QUESTION_TEXT], self.max_question_len))
+                    answers.extend(self.truncate_tokens(answer[C.ANSWER_TEXT], self.max_answer_len) for answer in row[C.ANSWERS])
+                    # TODO: Make this limit (5) a parameter
+                    reviews.extend(self.truncate_tokens(review, self.max_review_len) for review in row[C.REVIEW_SNIPPETS][:5])
+                    num_answers.append(len(row[C.ANSWERS]))
+                    num_reviews.append(len(row[C.REVIEW_SNIPPETS][:5]))
+
+                # every question's answers and reviews are consecutive rows
+                questionsDict.extend(self.vocab.encode_many(questions))
+                answerId = answersDict.extend(self.vocab.encode_many(answers))
+                reviewId = reviewsDict.extend(self.vocab.encode_many(reviews))
+                for n_answers, n_reviews in zip(num_answers, num_reviews):
+                    questionAnswersDict.append(range(answerId, answerId + n_answers))
+                    questionReviewsDict.append(range(reviewId, reviewId + n_reviews))
+                    answerId += n_answers
+                    reviewId += n_reviews
+
+        assert(len(questionAnswersDict) == len(questionsDict) == len(questionReviewsDict))
+        assert(len(answersDict) == len(questionAnswersDict.flat) and len(reviewsDict) == len(questionReviewsDict.flat))
+
+        return {
+            'answers': answersDict.build(),
+            'questions': questionsDict.build(),
+            'reviews': reviewsDict.build(),
+            'question_answers': questionAnswersDict.build(),
+            'question_reviews': questionReviewsDict.build(),
+        }
+
+
+def _shards(lines, num_lines=SHARD_LINES):
+    while True:
+        shard = list(itertools.islice(lines, num_lines))
+        if not shard:
+            return
+        yield shard
+
+
+def _answerable_rows(lines):
+    for line in lines:
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError:
+            raise Exception('\"%s\" is not a valid json' % line)
+
+        if row[C.IS_ANSWERABLE] != 0:
+            yield row
+
+
+def _count_shard(lines, max_lens):
+    # token counts of one shard of the train file and its number of answer tokens
+    max_question_len, max_answer_len, max_review_len = max_lens
+    sequences = []
+    num_answer_tokens = 0
+    for row in _answerable_rows(lines):
+        sequences.append(tokenization.tokenize(row[C.QUESTION_TEXT])[:max_question_len])
+        for answer in row[C.ANSWERS]:
+            sequences.append(tokenization.tokenize(answer[C.ANSWER_TEXT])[:max_answer_len])
+            num_answer_tokens += len(sequences[-1])
+        for review in row[C.REVIEW_SNIPPETS]:
+            sequences.append(tokenization.tokenize(review)[:max_review_len])
+    return count_tokens(sequences), num_answer_tokens
@@ -0,0 +1,107 @@
+import os
+import json
+import shutil
+import hashlib
+
+import constants as C
+from data.ragged import RaggedArray
+from data.vocabulary import Vocabulary
+
+# On-disk cache of tokenized datasets. Every entry is a directory named by a key over
+# the cache version, the sha1 of the input file and the params the content depends on:
+#
+#   vocab-<key>/vocab.json      Vocabulary.save of the vocab built from the train file
+#   data-<key>/<field>_flat.npy, <field>_offsets.npy
+#                               ragged int32 arrays, loaded memory mapped
+#
+# Data entries are keyed by the vocab they were encoded with, so a saved model's vocab
+# can be used as well as one built from the train file. Bump CACHE_VERSION whenever
+# tokenization or the layout changes.
+
+CACHE_VERSION = 2
+FILE_HASHES_FILENAME = 'file_hashes.json'
+VOCAB_FILENAME = 'vocab.json'
+DATA_FIELDS = ['answers', 'questions', 'reviews', 'question_answers', 'question_reviews']
+
+
+def cache_key(*parts):
+    return hashlib.sha1(json.dumps([CACHE_VERSION] + list(parts)).encode('utf-8')).hexdigest()[:20]
+
+
+def vocab_fingerprint(vocab):
+    return hashlib.sha1(json.dumps(vocab.tokens()).encode('utf-8')).hexdigest()
+
+
+class DatasetCache(object):
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def file_hash(self, path):
+        # sha1 of the file contents; remembered by size and mtime so that unchanged
+        # files are not read again
+        hashes_filename = os.path.join(self.cache_dir, FILE_HASHES_FILENAME)
+        hashes = {}
+        if os.path.exists(hashes_filename):
+            with open(hashes_filename, 'r') as fp:
+                hashes = json.load(fp)
+
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        entry = hashes.get(path)
+        if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1 << 24), b''):
+                sha1.update(chunk)
+        hashes[path] = [stat.st_size, stat.st_mtime_ns, sha1.hexdigest()]
+
+        tmp_filename = '%s.%d.tmp' % (hashes_filename, os.getpid())
+        with open(tmp_filename, 'w') as fp:
+            json.dump(hashes, fp)
+        os.replace(tmp_filename, hashes_filename)
+        return hashes[path][2]
+
+    def _entry_dir(self, prefix, key):
+        return os.path.join(self.cache_dir, '%s-%s' % (prefix, key))
+
+    def _commit(self, write, entry_dir):
+        # written to a temporary directory first, so that a crashed or concurrent
+        # build never leaves a partial entry behind
+        tmp_dir = '%s.%d.tmp' % (entry_dir, os.getpid())
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        write(tmp_dir)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # another process finished the same entry first
+            shutil.rmtree(tmp_dir)
+
+    def load_vocab(self, key):
+        filename = os.path.join(self._entry_dir('vocab', key), VOCAB_FILENAME)
+        if not os.path.exists(filename):
+            return None
+        return Vocabulary.load(filename)
+
+    def save_vocab(self, key, vocab):
+        def write(dirname):
+            vocab.save(os.path.join(dirname, VOCAB_FILENAME))
+        self._commit(write, self._entry_dir('vocab', key))
+
+    def load_data(self, key, mmap=True):
+        entry_dir = self._entry_dir('data', key)
+        if not os.path.exists(entry_dir):
+            return None
+        return dict((field, RaggedArray.load(entry_dir, field, mmap=mmap)) for field in DATA_FIELDS)
+
+    def save_data(self, key, arrays):
+        def write(dirname):
+            for field in DATA_FIELDS:
+                arrays[field].save(dirname, field)
+        self._commit(write, self._entry_dir('data', key))
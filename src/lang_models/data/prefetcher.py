@@ -0,0 +1,97 @@
+import threading
+import time
+import queue
+
+import torch
+
+import constants as C
+
+_END = object()
+
+class BatchPrefetcher(object):
+    """
+    Iterates a dataloader in a background thread, collating and converting the next
+    `depth` batches while the training thread runs the model on the current one.
+    `collate` turns a raw batch into what the consumer needs, typically tensors.
+    """
+
+    def __init__(self, loader, collate, depth=4):
+        self.loader = loader
+        self.collate = collate
+        self.depth = max(1, depth)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.num_batches = 0
+        self.num_stalls = 0
+        self.stall_time = 0.0
+        self.queue_depth_sum = 0
+
+    def stats(self):
+        return {
+            'batches': self.num_batches,
+            'stalls': self.num_stalls,
+            'stall_time': self.stall_time,
+            'mean_queue_depth': self.queue_depth_sum / float(max(1, self.num_batches)),
+        }
+
+    def log_stats(self, logger, mode):
+        stats = self.stats()
+        logger.log('\t[%s] Prefetch: mean queue depth = %.2f / %d, stalls = %d, stall time = %.2fs over %d batches' % (
+            mode.upper(), stats['mean_queue_depth'], self.depth, stats['stalls'], stats['stall_time'], stats['batches']))
+
+    def _produce(self, batches, stop):
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            for inputs in self.loader:
+                if not put(self.collate(inputs)):
+                    return
+            put(_END)
+        except BaseException as e:
+            put(e)
+
+    def __iter__(self):
+        self.reset_stats()
+        batches = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(batches, stop))
+        producer.daemon = True
+        producer.start()
+
+        try:
+            while True:
+                self.queue_depth_sum += batches.qsize()
+                if batches.empty():
+                    self.num_stalls += 1
+                start = time.time()
+                item = batches.get()
+                self.stall_time += time.time() - start
+
+                if item is _END:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                self.num_batches += 1
+                yield item
+        finally:
+            stop.set()
+            producer.join()
+
+    def __len__(self):
+        return len(self.loader)
+
+
+def to_tensor(array):
+    # LongTensor sharing the numpy buffer; page-locked so the copy to the GPU can be async
+    tensor = torch.from_numpy(array).long()
+    if C.USE_CUDA:
+        tensor = tensor.pin_memory()
+    return tensor
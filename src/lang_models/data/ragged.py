@@ -0,0 +1,102 @@
+import os
+import array
+
+import numpy as np
+
+
+class RaggedArray(object):
+    # a list of int sequences as one flat buffer plus offsets; row i is
+    # flat[offsets[i]:offsets[i + 1]] and indexing returns a view
+
+    def __init__(self, flat, offsets):
+        self.flat = flat
+        self.offsets = offsets
+
+    @classmethod
+    def from_lists(cls, rows, dtype=np.int32):
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum([len(row) for row in rows], out=offsets[1:])
+        flat = np.fromiter((value for row in rows for value in row), dtype=dtype, count=int(offsets[-1]))
+        return cls(flat, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def lengths(self, ids=None):
+        lengths = np.diff(self.offsets)
+        return lengths if ids is None else lengths[ids]
+
+    def padded(self, ids, max_len=None, reverse=False, align_left=None):
+        # rows ids as a [len(ids), max_len] int64 array, zero padded, in one gather.
+        # An id of -1 gives an empty row. Reversed rows are right aligned by default,
+        # which is what reversing a left aligned padded array gives; align_left=True
+        # keeps them left aligned, as pack_padded_sequence expects.
+        ids = np.asarray(ids, dtype=np.int64)
+        valid = ids >= 0
+        rows = np.where(valid, ids, 0)
+        starts = np.where(valid, self.offsets[rows], 0)
+        ends = np.where(valid, self.offsets[np.minimum(rows + 1, len(self.offsets) - 1)], 0)
+        lengths = ends - starts
+        if max_len is None:
+            max_len = int(lengths.max()) if len(lengths) > 0 else 0
+
+        positions = np.arange(max_len)
+        if align_left is None:
+            align_left = not reverse
+        if reverse and align_left:
+            mask = positions[None, :] < lengths[:, None]
+            index = (ends - 1)[:, None] - positions[None, :]
+        elif reverse:
+            mask = positions[None, :] >= (max_len - lengths)[:, None]
+            index = starts[:, None] + (max_len - 1 - positions)[None, :]
+        else:
+            mask = positions[None, :] < lengths[:, None]
+            index = starts[:, None] + positions[None, :]
+        padded_data = np.zeros((len(ids), max_len), dtype=np.int64)
+        padded_data[mask] = self.flat[index[mask]]
+        return padded_data, lengths
+
+    def __getitem__(self, idx):
+        return self.flat[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def save(self, dirname, name):
+        np.save(os.path.join(dirname, name + '_flat.npy'), self.flat)
+        np.save(os.path.join(dirname, name + '_offsets.npy'), self.offsets)
+
+    @classmethod
+    def load(cls, dirname, name, mmap=True):
+        mmap_mode = 'r' if mmap else None
+        flat = np.load(os.path.join(dirname, name + '_flat.npy'), mmap_mode=mmap_mode)
+        offsets = np.load(os.path.join(dirname, name + '_offsets.npy'), mmap_mode=mmap_mode)
+        return cls(flat, offsets)
+
+
+class RaggedBuilder(object):
+    # appends rows straight into flat buffers, without a Python list per row
+
+    def __init__(self):
+        self.flat = array.array('i')
+        self.offsets = array.array('q', [0])
+
+    def append(self, row):
+        self.flat.extend(row)
+        self.offsets.append(len(self.flat))
+        return len(self.offsets) - 2
+
+    def extend(self, ragged):
+        # appends all rows of a RaggedArray; returns the index of the first one
+        first = len(self)
+        base = len(self.flat)
+        self.flat.frombytes(np.ascontiguousarray(ragged.flat, dtype=np.int32).tobytes())
+        self.offsets.frombytes((np.asarray(ragged.offsets[1:], dtype=np.int64) + base).tobytes())
+        return first
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def build(self):
+        return RaggedArray(np.array(self.flat, dtype=np.int32), np.array(self.offsets, dtype=np.int64))
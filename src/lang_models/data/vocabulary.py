@@ -1,95 +1,122 @@
+import json
+import itertools
+from collections import Counter
+
+import numpy as np
+
 import constants as C
+from data.ragged import RaggedArray
+
+VOCAB_FORMAT_VERSION = 1
+
+RESERVED_TOKENS = [C.PAD_TOKEN, C.EOS_TOKEN, C.SOS_TOKEN, C.UNK_TOKEN]
+RESERVED_INDICES = [C.PAD_INDEX, C.EOS_INDEX, C.SOS_INDEX, C.UNK_INDEX]
+
+
+class VocabularyBuilder(object):
+    """
+    Counts tokens, possibly over several shards, and freezes the counts into a Vocabulary.
+    Counters of shards are merged in shard order, so ties in frequency are broken by
+    first occurrence exactly as if the whole corpus was counted in one pass.
+    """
 
-class Vocabulary():
     def __init__(self, max_vocab_size):
-        self.reserved = set([C.PAD_TOKEN, C.EOS_TOKEN, C.SOS_TOKEN,\
-                              C.UNK_TOKEN])
-        self.res_token2index = {
-                C.PAD_TOKEN : C.PAD_INDEX,
-                C.UNK_TOKEN : C.UNK_INDEX,
-                C.SOS_TOKEN : C.SOS_INDEX,
-                C.EOS_TOKEN : C.EOS_INDEX
-        }
-
-        self.token2index = self.res_token2index
-        self.index2token = dict([(self.res_token2index[tok], tok) for tok in self.res_token2index])
-        self.token2freq = {}  # would never have reserved tokens, would have all the tokens
-        self.token2count = {}
-
-        self.num_tokens = 0  # non reserved tokens
-        self.num_reserved = C.RESERVED_IDS
+        self.max_vocab_size = max_vocab_size
+        self.counts = Counter()
 
-        self.is_sorted = False
+    def add_sequence(self, sequence):
+        self.counts.update(sequence)
 
-        if max_vocab_size != -1:
-            self.size = max_vocab_size
-        else:
-            self.size = 10**9
+    def merge(self, counts):
+        self.counts.update(counts)
 
-    def sort_vocabulary(self):
-        """
-        Sorts the vocabulary in descending order based on frequency
-        token2index and index2token has only top self.size words
-        """
-        if self.is_sorted:
-            return
+    def build(self):
+        for token in RESERVED_TOKENS:
+            self.counts.pop(token, None)
+        size = self.max_vocab_size if self.max_vocab_size != -1 else None
+        # sorted() is stable, so equal counts keep their first occurrence order
+        tokens = sorted(self.counts, key=self.counts.get, reverse=True)[:size]
+        return Vocabulary(tokens)
 
-        trimmed_token2freq = sorted(self.token2freq.items(), \
-                key=lambda kv:kv[1] , reverse=True)[0:self.size]
 
-        for index, (token, freq) in enumerate(trimmed_token2freq):
-            self.token2index[token] = index + self.num_reserved
-            self.index2token[index + self.num_reserved] = token
+def count_tokens(sequences):
+    # Counter of one shard, for merging with VocabularyBuilder.merge
+    counts = Counter()
+    for sequence in sequences:
+        counts.update(sequence)
+    return counts
 
-        if self.num_tokens > self.size:
-            self.num_tokens = self.size
 
-        self.is_sorted = True
+class Vocabulary(object):
+    """
+    Frozen map between tokens and ids. Ids 0-3 are the reserved tokens, followed by the
+    kept tokens in descending order of frequency.
+    """
+
+    def __init__(self, tokens):
+        self.num_reserved = C.RESERVED_IDS
+        self.num_tokens = len(tokens)
+
+        self.index2token = dict(zip(RESERVED_INDICES, RESERVED_TOKENS))
+        self.index2token.update((index + self.num_reserved, token) for index, token in enumerate(tokens))
+        self.token2index = dict((token, index) for index, token in self.index2token.items())
+
+    def tokens(self):
+        # kept tokens in id order, without the reserved ones
+        return [self.index2token[index] for index in range(self.num_reserved, self.get_vocab_size())]
 
     def get_index(self, token):
-        self.sort_vocabulary()
         return self.token2index[token]
 
     def get_token(self, index):
-        self.sort_vocabulary()
         return self.index2token[index]
 
     def get_vocab_size(self):
-        self.sort_vocabulary()
         return self.num_tokens + self.num_reserved
 
-    def add_token(self, token):
-        if token not in self.reserved:
-            if token not in self.token2freq:
-                self.token2freq[token] = 1
-                self.num_tokens += 1
-            else:
-                self.token2freq[token] += 1
-        self.is_sorted = False
-
-    def add_sequence(self, sequence):
-        for tok in sequence:
-            self.add_token(tok)
-
     def indices_from_token_list(self, tok_list):
         """
         Maps a list of words to token IDs
         if the word is rare/unknown, map to <UNK>.
         """
-        self.sort_vocabulary()
-        indices = [C.SOS_INDEX]
-        for tok in tok_list:
-            if tok in self.token2index:
-                indices.append(self.token2index[tok])
-            else:
-                indices.append(C.UNK_INDEX)
-        indices.append(C.EOS_INDEX)
-        return indices
+        get = self.token2index.get
+        return [C.SOS_INDEX] + [get(tok, C.UNK_INDEX) for tok in tok_list] + [C.EOS_INDEX]
+
+    def encode_many(self, tok_lists):
+        """
+        Maps a list of token lists to a RaggedArray of token IDs, each sequence wrapped
+        in <SOS> and <EOS> like indices_from_token_list.
+        """
+        lengths = np.fromiter(map(len, tok_lists), dtype=np.int64, count=len(tok_lists))
+        num_tokens = int(lengths.sum())
+        get = self.token2index.get
+        ids = np.fromiter((get(tok, C.UNK_INDEX) for tok in itertools.chain.from_iterable(tok_lists)),
+            dtype=np.int32, count=num_tokens)
+
+        offsets = np.zeros(len(tok_lists) + 1, dtype=np.int64)
+        np.cumsum(lengths + 2, out=offsets[1:])
+        flat = np.empty(offsets[-1], dtype=np.int32)
+        flat[offsets[:-1]] = C.SOS_INDEX
+        flat[offsets[1:] - 1] = C.EOS_INDEX
+        # the i-th sequence's tokens start one after its <SOS>
+        token_starts = np.cumsum(lengths) - lengths
+        flat[np.repeat(offsets[:-1] + 1 - token_starts, lengths) + np.arange(num_tokens)] = ids
+        return RaggedArray(flat, offsets)
 
     def token_list_from_indices(self, indices):
         """
         Get a list of tokens from a list of token IDs.
         """
-        self.sort_vocabulary()
-        seq = [self.index2token[idx] for idx in indices]
-        return seq
+        return [self.index2token[idx] for idx in indices]
+
+    def save(self, filename):
+        with open(filename, 'w') as fp:
+            json.dump({'version': VOCAB_FORMAT_VERSION, 'tokens': self.tokens()}, fp)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'r') as fp:
+            obj = json.load(fp)
+        if obj.get('version') != VOCAB_FORMAT_VERSION:
+            raise Exception('Unsupported vocab format in %s' % filename)
+        return cls(obj['tokens'])
@@ -3,7 +3,6 @@
 
 import os
 import argparse
-import pickle
 import json
 import torch
 import numpy as np
@@ -11,14 +10,16 @@ import numpy as np
 import config
 import constants as C
 from trainer.trainer import Trainer, hsizes
+from trainer import distributed
+from trainer.generator import generate_answers, load_answers, reference_filename
 from data.dataloader import AmazonDataLoader
 from data.dataset import AmazonDataset
 from models.seq2seq import Seq2Seq
-from utils.logger import Logger
-from utils.saver import Saver
+from utils.logger import Logger, NullLogger
+from utils.saver import Saver, load_params
+from evaluator.evaluator import COCOEvalCap
 
 RANDOM_SEED = 1
-CACHE_DATASET = False
 
 def main():
     _set_random_seeds(RANDOM_SEED)
@@ -28,9 +29,19 @@ def main():
 
     resume, epoch = args.resume, args.epoch
 
+    # --resume with --epoch continues after that epoch's saved model; without
+    # --epoch it continues from the latest mid-epoch checkpoint
     if args.resume:
         assert mode == C.TRAIN_TYPE
-        assert epoch >= 0
+        resume_epoch = epoch if epoch >= 0 else None
+
+    # With --num_processes > 1 this is one process of data parallel training; all
+    # processes are started with the same arguments and their own --process_idx
+    num_processes = args.num_processes
+    if num_processes > 1:
+        assert mode == C.TRAIN_TYPE
+        assert not args.resume, 'Resuming data parallel training is not supported'
+    distributed.init(args.process_idx, num_processes, args.dist_init_method)
 
     params = config.get_model_params(model_name)
     params[C.MODEL_NAME] = model_name
@@ -39,29 +50,36 @@ def main():
     # If save_dir is passed in from command line
     #   params are loaded from the save_dir
     # Logger is instantiated in saver
-    saver = Saver(save_dir, params)
-    logger = saver.logger
-    params = saver.params
+    # Only the master process saves and logs
+    if distributed.is_master():
+        saver = Saver(save_dir, params)
+        logger = saver.logger
+        saved_params = saver.params
+    else:
+        saver = None
+        logger = NullLogger()
+        saved_params = load_params(save_dir)
+    # decoding settings are not part of the trained model; take them from the command line
+    for key in [C.BEAM_WIDTH, C.LENGTH_PENALTY]:
+        saved_params[key] = params[key]
+    params = saved_params
 
     # if save_dir is passed, 
     # model_name is used from the model_name in saved params
     model_name = params[C.MODEL_NAME]
-    logger.log('SaveDir: %s' % saver.save_dir)
+    logger.log('SaveDir: %s' % save_dir)
 
     if mode == C.TRAIN_TYPE:
         logger.log('\nLoading dataset..')
-        dataset = AmazonDataset(params, mode)
+        dataset = AmazonDataset(params, mode, workers=args.workers)
         logger.log('\n Model: %s, Mode = %s \n' % (model_name, mode))
         logger.log('\nLoading dataloader..')
 
-        if CACHE_DATASET:
-            train_loader = pickle.load(open(model_name + 'train.pickle', 'rb'))
-            dev_loader = pickle.load(open(model_name + 'dev.pickle', 'rb'))
-        else:
-            train_loader = AmazonDataLoader(dataset.train, model_name, params[C.BATCH_SIZE])
-            dev_loader = AmazonDataLoader(dataset.val, model_name, params[C.BATCH_SIZE])
-            pickle.dump(train_loader, open(model_name + 'train.pickle', 'wb'))
-            pickle.dump(dev_loader, open(model_name + 'dev.pickle', 'wb'))
+        train_loader = AmazonDataLoader(dataset.train, model_name, params[C.BATCH_SIZE], params.get(C.MAX_BATCH_TOKENS))
+        dev_loader = AmazonDataLoader(dataset.val, model_name, params[C.BATCH_SIZE], params.get(C.MAX_BATCH_TOKENS))
+        # training shards step in lockstep; the dev loss is summed over all batches
+        train_loader.shard(args.process_idx, num_processes)
+        dev_loader.shard(args.process_idx, num_processes, drop_last=False)
 
         logger.log('\nInstantiating training..')
         trainer = Trainer(
@@ -71,7 +89,7 @@ def main():
             vocab=dataset.vocab,
             saver=saver,
             resume_training=resume,
-            resume_epoch=epoch if resume else None
+            resume_epoch=resume_epoch if resume else None
         )
         trainer.train()
 
@@ -83,11 +101,10 @@ def main():
         logger.log('Loading vocab..')
         vocab = saver.load_vocab()
         model_name = params[C.MODEL_NAME]
-        dataset = AmazonDataset(params, mode)
+        dataset = AmazonDataset(params, mode, vocab=vocab, workers=args.workers)
         #TODO: next line is a temporary change only. 
         dataset_typed = dataset.test
         #dataset_typed = dataset.val if mode == C.DEV_TYPE else dataset.test
-        loader = AmazonDataLoader(dataset_typed, model_name, params[C.BATCH_SIZE])
 
         # Load model
         logger.log('Loading saved model..')
@@ -98,6 +115,20 @@ def main():
         )
         saver.load_model(epoch, model)
 
+        if mode == C.TEST_TYPE:
+            # one answer per test question, generated by --workers processes with a
+            # model copy each
+            logger.log('Generating answers with %d workers..' % args.workers)
+            num_questions = generate_answers(params, vocab, dataset_typed, model, output_file, workers=args.workers, logger=logger)
+            logger.log('Saved generated answers for %d questions to %s, gold answers to %s' % (
+                num_questions, output_file, reference_filename(output_file)))
+            scores = COCOEvalCap.compute_scores(load_answers(reference_filename(output_file)), load_answers(output_file))
+            logger.log('Scores: %s' % scores)
+            logger.log('\nCompleted Evaluation..\n')
+            return
+
+        loader = AmazonDataLoader(dataset_typed, model_name, params[C.BATCH_SIZE], params.get(C.MAX_BATCH_TOKENS))
+
         # Instantiate trainer with saved model
         logger.log('Instantiating trainer..')
         trainer = Trainer(
@@ -111,7 +142,7 @@ def main():
         trainer.model = model
 
         # Evaluation on test set
-        logger.log('Total number of [%s] batches: %d' % (mode.upper(), len(list(loader))))
+        logger.log('Total number of [%s] batches: %d' % (mode.upper(), len(loader)))
         trainer.eval(loader, mode, output_filename=output_file)
 
         logger.log('\nCompleted Evaluation..\n')
@@ -75,16 +75,29 @@ class Attention(nn.Module):
         return attn, mix
 
 
+    def get_review_mix(self, output, review_context):
+        # attention over every review slot in one bmm; the softmax is taken per review
+        # and the per-review mixes are averaged with review_weights, padding and
+        # missing reviews masked out
+        review_out, review_bias, review_weights = review_context
+        num_slots, max_len = review_bias.size(1), review_bias.size(2)
+        # (batch, out_len, dim) * (batch, num_slots * max_len, dim) -> (batch, out_len, num_slots, max_len)
+        attn = torch.bmm(output, review_out.transpose(1, 2)).view(self.batch_size, -1, num_slots, max_len)
+        attn = F.softmax(attn + review_bias.unsqueeze(1), dim=3) * review_weights.view(self.batch_size, 1, num_slots, 1)
+
+        # (batch, out_len, num_slots * max_len) * (batch, num_slots * max_len, dim) -> (batch, out_len, dim)
+        return torch.bmm(attn.view(self.batch_size, -1, num_slots * max_len), review_out)
+
+
     def forward(self, output, context):
         self.batch_size = output.size(0)
         self.hidden_size = output.size(2)
 
-        (question_out, review_outs) = context
+        (question_out, review_context) = context
         attn, question_mix = self.get_mix(output, question_out)
 
         if self.model_name == C.LM_QUESTION_ANSWERS_REVIEWS:
-            review_mixs = [self.get_mix(output, review_out)[1] for review_out in review_outs]
-            review_mix = _mean(review_mixs)
+            review_mix = self.get_review_mix(output, review_context)
             # concat -> (batch, out_len, 2*dim)
             combined = torch.cat((question_mix, review_mix, output), dim=2)
         else:
@@ -94,7 +107,3 @@ class Attention(nn.Module):
         output = F.tanh(self.linear_out(combined.view(-1, self.dim_factor * self.hidden_size))).view(self.batch_size, -1, self.hidden_size)
         return output, attn
 
-
-def _mean(vars):
-    return torch.mean(torch.cat([i.unsqueeze(0) for i in vars], 0), 0)
-
@@ -10,6 +10,7 @@ import constants as C
 from models.DecoderRNN import DecoderRNN
 from models.EncoderRNN import EncoderRNN
 from models.baseRNN import BaseRNN
+from models.beam_search import BeamSearch
 
 
 class Seq2Seq(nn.Module):
@@ -35,7 +36,7 @@ class Seq2Seq(nn.Module):
 
         if model_name == C.LM_QUESTION_ANSWERS_REVIEWS:
             self.reviews_encoder = EncoderRNN(vocab_size=vocab_size, max_len=max_len, embedding_size=e_size,
-                        hidden_size=r_hsize, n_layers=n_layers, dropout_p=dropout_p)
+                        hidden_size=r_hsize, n_layers=n_layers, dropout_p=dropout_p, variable_lengths=True)
             self.decoder.embedding.weight = self.reviews_encoder.embedding.weight
         else:
             self.reviews_encoder = None
@@ -59,6 +60,21 @@ class Seq2Seq(nn.Module):
         teacher_forcing_ratio
     ):
         #print(question_seqs, review_seqs, answer_seqs, target_seqs)
+        d_hidden, d_out = self._encode(question_seqs, review_seqs)
+        return self.decoder(inputs=target_seqs, encoder_hidden=d_hidden, 
+            encoder_outputs=d_out, teacher_forcing_ratio=teacher_forcing_ratio)
+
+    def generate(self, question_seqs, review_seqs, beam_width=1, length_penalty=0.0, batch_size=None):
+        """
+        Decodes answers without teacher forcing using batched beam search; returns the
+        (batch, steps) sequences, their lengths (with <EOS>) and their scores.
+        batch_size is only needed for LM_ANSWERS, which has no encoder.
+        """
+        d_hidden, d_out = self._encode(question_seqs, review_seqs)
+        beam_search = BeamSearch(self.decoder, beam_width=beam_width, length_penalty=length_penalty)
+        return beam_search.decode(encoder_hidden=d_hidden, encoder_outputs=d_out, batch_size=batch_size)
+
+    def _encode(self, question_seqs, review_seqs):
         if self.model_name == C.LM_ANSWERS:
             d_hidden = None
             question_out = None
@@ -68,15 +84,13 @@ class Seq2Seq(nn.Module):
             review_outs = None
         elif self.model_name == C.LM_QUESTION_ANSWERS_REVIEWS:
             question_out, question_hidden = self.question_encoder(question_seqs)
-            reviews_encoder_outs = [self.reviews_encoder(seq) for seq in review_seqs]
-            review_outs, review_hiddens = map(list, zip(*reviews_encoder_outs))
+            review_outs, review_hiddens = self._encode_reviews(review_seqs, question_seqs.size(0))
 
             # TODO Fix this workaround
             if self.use_attention:
                 d_hidden = question_hidden
             else:
-                reviews_hidden = list(map(_mean, zip(*review_hiddens)))
-                d_hidden = tuple(torch.cat([q_h, r_h], 2) for q_h, r_h in zip(question_hidden, reviews_hidden))
+                d_hidden = tuple(torch.cat([q_h, r_h], 2) for q_h, r_h in zip(question_hidden, review_hiddens))
         else:
             raise 'Unimplemented model: %s' % self.model_name
         
@@ -84,11 +98,44 @@ class Seq2Seq(nn.Module):
             d_out = (question_out, review_outs)
         else:
             d_out = None
-        return self.decoder(inputs=target_seqs, encoder_hidden=d_hidden, 
-            encoder_outputs=d_out, teacher_forcing_ratio=teacher_forcing_ratio)
-
-def _mean(vars):
-    return torch.mean(torch.cat([i.unsqueeze(0) for i in vars], 0), 0)
+        return d_hidden, d_out
+
+    def _encode_reviews(self, review_seqs, batch_size):
+        # All reviews of the batch go through the encoder in one packed pass and are
+        # scattered into a (batch, num_slots) grid of review slots. Returns the
+        # attention context (review_out, review_bias, review_weights) and the hidden
+        # state averaged over the reviews of every sample:
+        #   review_out      (batch, num_slots * max_len, dim), zero for missing slots
+        #   review_bias     (batch, num_slots, max_len), -inf on padding of real reviews
+        #   review_weights  (batch, num_slots), 1 / number of reviews, zero if missing
+        review_seqs, review_lengths, review_slots, num_slots = review_seqs
+        review_out, review_hidden = self.reviews_encoder(review_seqs, review_lengths)
+        max_len, dim = review_out.size(1), review_out.size(2)
+        num_grid = batch_size * num_slots
+
+        slot_lengths = review_out.new_zeros(num_grid).long().index_copy(0, review_slots, review_lengths.to(review_slots.device))
+        slot_lengths = slot_lengths.view(batch_size, num_slots)
+        has_review = slot_lengths > 0
+        review_weights = has_review.float() / has_review.sum(1, keepdim=True).clamp(min=1).float()
+
+        # padding of a real review is masked out; the softmax over a missing review
+        # stays finite and its weight is zero
+        positions = torch.arange(max_len, device=review_out.device).view(1, 1, -1)
+        padding = (positions >= slot_lengths.unsqueeze(2)) & has_review.unsqueeze(2)
+        review_bias = review_out.new_zeros(batch_size, num_slots, max_len).masked_fill(padding, -float('inf'))
+
+        review_out = review_out.new_zeros(num_grid, max_len, dim).index_copy(0, review_slots, review_out)
+        review_out = review_out.view(batch_size, num_slots * max_len, dim)
+
+        review_hiddens = tuple(_slot_mean(h, review_slots, review_weights) for h in review_hidden)
+        return (review_out, review_bias, review_weights), review_hiddens
+
+def _slot_mean(hidden, review_slots, review_weights):
+    # (layers, num_reviews, dim) -> (layers, batch, dim), a weighted sum over slots
+    batch_size, num_slots = review_weights.size()
+    layers, _, dim = hidden.size()
+    grid = hidden.new_zeros(layers, batch_size * num_slots, dim).index_copy(1, review_slots, hidden)
+    return (grid.view(layers, batch_size, num_slots, dim) * review_weights.view(1, batch_size, num_slots, 1)).sum(2)
 
 # def _cat_hidden(h1, h2):
 #     return (torch.cat([h])
@@ -0,0 +1,52 @@
+import bisect
+
+# R-Net example and eval rows for a converted SQuAD paragraph, the same records that
+# baselines/R-Net/convert_rnet.py writes, without needing a SQuAD file in between
+
+
+def convert_idx(text, tokens):
+    current = 0
+    spans = []
+    for token in tokens:
+        current = text.find(token, current)
+        if current < 0:
+            raise ValueError("Token {} cannot be found".format(token))
+        spans.append((current, current + len(token)))
+        current += len(token)
+    return spans
+
+
+def to_rnet(paragraph, example_id, answers_field):
+    context = paragraph["context"]
+    context_tokens = context.split()
+    context_chars = [list(token) for token in context_tokens]
+    spans = convert_idx(context, context_tokens)
+    starts = [span[0] for span in spans]
+    ends = [span[1] for span in spans]
+
+    examples, eval_rows = [], []
+    for qa in paragraph["qas"]:
+        ques = qa["question"].replace(
+            "''", '" ').replace("``", '" ')
+        ques_tokens = ques.split()
+        ques_chars = [list(token) for token in ques_tokens]
+
+        y1s, y2s = [], []
+        answer_texts = []
+        for answer in qa[answers_field]:
+            answer_text = answer["text"]
+            answer_start = answer['answer_start']
+            answer_end = answer_start + len(answer_text)
+            answer_texts.append(answer_text)
+            # first and last token overlapping the answer; spans are sorted and disjoint
+            y1 = bisect.bisect_right(ends, answer_start)
+            y2 = bisect.bisect_left(starts, answer_end) - 1
+            if y1 > y2:
+                raise IndexError("Answer {} overlaps no token".format(answer))
+            y1s.append(y1)
+            y2s.append(y2)
+
+        examples.append({"context_tokens": context_tokens, "context_chars": context_chars, "ques_tokens": ques_tokens,
+                         "ques_chars": ques_chars, "y1s": y1s, "y2s": y2s, "id": example_id})
+        eval_rows.append({"context": context, "spans": spans, "answers": answer_texts, "uuid": qa["id"], "id": example_id})
+    return examples, eval_rows
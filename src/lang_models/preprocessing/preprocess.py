@@ -1,6 +1,7 @@
+import os
 import pickle
+import multiprocessing
 import pandas as pd
-import gzip
 import numpy as np
 import nltk
 from nltk.corpus import stopwords
@@ -8,13 +9,12 @@ import string
 import constants as C
 from tqdm import tqdm
 import json
+from preprocessing import dump_parser
 
 np.random.seed(2018)
 
 def parse(path):
-    g = gzip.open(path, 'rb')
-    for l in g:
-        yield eval(l)
+    return dump_parser.parse(path)
 
 def filepath(category, key):
     if key == C.QA:
@@ -99,9 +99,22 @@ def generate_raw_data(category):
     qa_reviews.to_pickle(f)
 
 
-def generate_raw_data_all_categories():
-  for category in tqdm(C.CATEGORIES):
-    generate_raw_data(category)
+def generate_raw_data_all_categories(num_processes=1):
+  # largest categories first so the long ones do not end up running alone at the end
+  def input_size(category):
+    return sum(os.path.getsize(filepath(category, key)) for key in [C.QA, C.REVIEWS])
+  categories = sorted(C.CATEGORIES, key=input_size, reverse=True)
+
+  if num_processes == 1:
+    for category in tqdm(categories):
+      generate_raw_data(category)
+    return
+
+  pool = multiprocessing.Pool(num_processes, maxtasksperchild=1)
+  for _ in tqdm(pool.imap_unordered(generate_raw_data, categories), total=len(categories)):
+    pass
+  pool.close()
+  pool.join()
 
 
 def get_raw_dataframe(category):
@@ -0,0 +1,82 @@
+import os
+import json
+import threading
+import multiprocessing
+
+# Shared plumbing for the converters: records are read lazily, fanned out to a process
+# pool with a bounded number of them in flight, and the outputs are written in input
+# order, one file per target format.
+
+
+def read_records(input_file):
+    # yields (record_idx, line) for a JSONL file
+    with open(input_file, 'rb') as rfp:
+        for record_idx, line in enumerate(rfp):
+            yield record_idx, line
+
+
+def _bounded(items, in_flight):
+    for item in items:
+        in_flight.acquire()
+        yield item
+
+
+def map_ordered(process, items, workers=1, chunksize=8, initializer=None, initargs=()):
+    # like map(process, items) but over a pool of workers; results come back in input
+    # order and reading never runs more than a few chunks ahead of the consumer
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for item in items:
+            yield process(item)
+        return
+
+    in_flight = threading.BoundedSemaphore(workers * chunksize * 4)
+    pool = multiprocessing.Pool(workers, initializer=initializer, initargs=initargs)
+    try:
+        for result in pool.imap(process, _bounded(items, in_flight), chunksize=chunksize):
+            in_flight.release()
+            yield result
+    except BaseException:
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+
+
+class RecordWriter(object):
+    # one JSONL file per format; files are written to <path>.tmp and only renamed
+    # once the whole input went through, so a failed run leaves no partial outputs
+
+    def __init__(self, output_files):
+        self.output_files = dict((fmt, path) for fmt, path in output_files.items() if path)
+        self.fps = dict((fmt, open(path + '.tmp', 'w')) for fmt, path in self.output_files.items())
+        self.counts = dict((fmt, 0) for fmt in self.output_files)
+
+    def formats(self):
+        return set(self.output_files)
+
+    def write(self, outputs):
+        # outputs maps a format to the list of rows produced for one record
+        for fmt, rows in outputs.items():
+            if fmt not in self.fps:
+                continue
+            fp = self.fps[fmt]
+            for row in rows:
+                fp.write(json.dumps(row) + '\n')
+            self.counts[fmt] += len(rows)
+
+    def close(self, success=True):
+        for fmt, fp in self.fps.items():
+            fp.close()
+            if success:
+                os.replace(self.output_files[fmt] + '.tmp', self.output_files[fmt])
+            else:
+                os.remove(self.output_files[fmt] + '.tmp')
+        self.fps = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(success=exc_type is None)
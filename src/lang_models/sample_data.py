@@ -11,6 +11,7 @@ import config
 import constants as C
 from data.vocabulary import Vocabulary
 from data import review_utils
+from data import tokenization
 import string
 
 DEBUG = False
@@ -26,18 +27,7 @@ class AmazonDataset(object):
 		self.val_path = '%s/val-%s.pickle' % (C.INPUT_DATA_PATH, category)
 		self.test_path = '%s/test-%s.pickle' % (C.INPUT_DATA_PATH, category)
 
-	@staticmethod
-	def tokenize(text):
-		punctuations = string.punctuation.replace("\'", '')
-
-		for ch in punctuations:
-			text = text.replace(ch, " " + ch + " ")
-
-		tokens = text.split()
-		for i, token in enumerate(tokens):
-			if not token.isupper():
-				tokens[i] = token.lower()
-		return tokens
+	tokenize = staticmethod(tokenization.tokenize)
 
 	def save_data(self, path, num_entries, max_review_len=50, filename='temp.csv'):
 		questionId = -1
@@ -66,7 +66,7 @@ if __name__ == "__main__":
 	#preprocess_data(params[C.CATEGORY])
 
 	dataset = AmazonDataset(params)
-	answersDict, questionsDict, questionAnswersDict, reviewsDict, data = dataset.test
+	answersDict, questionsDict, questionAnswersDict, reviewsDict, questionReviewsDict, data = dataset.test
 	print(answersDict)
 	print(questionsDict)
 	print(questionAnswersDict)
@@ -90,7 +90,6 @@ if __name__ == "__main__":
 				print(question_seqs[i])
 			
 		if model_name == C.LM_QUESTION_ANSWERS_REVIEWS:
-			for i in range(len(review_seqs)):
-				for review_seq in review_seqs[i]:
-					print(" ".join(dataset.vocab.token_list_from_indices(review_seq)))
+			for review_seq, review_length in zip(review_seqs[0], review_seqs[1]):
+				print(" ".join(dataset.vocab.token_list_from_indices(review_seq[:review_length])))
 
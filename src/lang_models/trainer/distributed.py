@@ -0,0 +1,65 @@
+"""Data parallel training over torch.distributed (gloo) processes on one machine
+"""
+
+import torch
+import torch.distributed as dist
+
+DEFAULT_INIT_METHOD = 'tcp://127.0.0.1:29500'
+
+
+def init(process_idx, num_processes, init_method=DEFAULT_INIT_METHOD):
+    # every process gets an equal share of torch's default intra-op threads, so
+    # that processes do not oversubscribe the cores; a single process keeps the
+    # default
+    if num_processes > 1:
+        torch.set_num_threads(max(1, torch.get_num_threads() // num_processes))
+        dist.init_process_group('gloo', init_method=init_method, rank=process_idx, world_size=num_processes)
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_master():
+    return rank() == 0
+
+
+def broadcast_parameters(model):
+    # every process starts from the master's weights
+    for param in model.state_dict().values():
+        dist.broadcast(param, 0)
+
+
+def all_reduce_sum(values):
+    # sums a list of numbers over all processes
+    tensor = torch.DoubleTensor(values)
+    dist.all_reduce(tensor)
+    return tensor.tolist()
+
+
+def all_reduce_gradients(params, values=()):
+    # Sums the gradients of params, and a few numbers such as the step's token
+    # count, over all processes with one all_reduce of a flat buffer; returns the
+    # summed numbers
+    grads = [param.grad.data if param.grad is not None else param.data.new_zeros(param.size()) for param in params]
+    flat = torch.cat([grad.contiguous().view(-1) for grad in grads] + [grads[0].new_tensor(list(values))])
+    dist.all_reduce(flat)
+
+    offset = 0
+    for param, grad in zip(params, grads):
+        numel = grad.numel()
+        summed = flat[offset:offset + numel].view_as(grad)
+        if param.grad is None:
+            param.grad = summed.clone()
+        else:
+            param.grad.data.copy_(summed)
+        offset += numel
+    return flat[offset:].tolist()
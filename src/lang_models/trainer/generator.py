@@ -0,0 +1,161 @@
+"""Test time answer generation, sharded over worker processes
+"""
+
+import os
+import json
+
+import numpy as np
+import torch
+
+import constants as C
+from data.dataloader import AmazonDataLoader
+from models.seq2seq import Seq2Seq
+from preprocessing.record_pipeline import map_ordered, RecordWriter
+
+# Predictions and references are written in the JSONL format of evaluation/, one
+# {"qid": ..., "answers": [...]} row per test question:
+#   predictions   the generated answer of every question
+#   references    the gold answers of every question
+#
+# Questions are split into contiguous shards of a fixed number of questions, so the
+# batches, and with them the outputs, do not depend on the number of workers. Every
+# worker holds its own copy of the model and streams the rows of a shard into shard
+# files, which are merged into the output files in shard order.
+
+QID = 'qid'
+ANSWERS = 'answers'
+PREDICTIONS = 'predictions'
+REFERENCES = 'references'
+SHARD_QUESTIONS = 2000
+
+
+class AnswerDecoder(object):
+    # token ids to answer text, through one lookup array instead of a dict lookup
+    # per token
+
+    def __init__(self, vocab):
+        self.tokens = np.array([vocab.get_token(index) for index in range(vocab.get_vocab_size())], dtype=object)
+
+    def text(self, ids):
+        return ' '.join(self.tokens[np.asarray(ids, dtype=np.int64)])
+
+    def generated_text(self, seq, length):
+        # a generated sequence up to its length, without the final <EOS>
+        seq = seq[:int(length)]
+        if len(seq) > 0 and seq[-1] == C.EOS_INDEX:
+            seq = seq[:-1]
+        return self.text(seq)
+
+    def gold_answers(self, answersDict, questionAnswersDict, question_id):
+        # answers of a question without their <SOS> and <EOS>
+        return [self.text(answersDict[answer_id][1:-1]) for answer_id in questionAnswersDict[question_id]]
+
+
+def reference_filename(output_filename):
+    return '%s.%s.jsonl' % (os.path.splitext(output_filename)[0], REFERENCES)
+
+
+def generate_answers(params, vocab, data, model, output_filename, workers=1, logger=None, shard_questions=SHARD_QUESTIONS):
+    """
+    Generates an answer for every question of data with the decoding settings in
+    params, and writes the predictions to output_filename and the gold answers next
+    to it (see reference_filename). Returns the number of questions.
+    """
+    question_rows = _question_rows(data[-1])
+    bounds = list(range(0, len(question_rows), shard_questions)) + [len(question_rows)]
+    num_shards = len(bounds) - 1
+    shards = [(shard_idx, bounds[shard_idx], bounds[shard_idx + 1]) for shard_idx in range(num_shards)]
+
+    # every worker gets an equal share of the cores
+    num_threads = max(1, (os.cpu_count() or 1) // max(1, workers))
+    state_dict = dict((key, value.cpu()) for key, value in model.state_dict().items())
+    initargs = (params, vocab, data[:-1], question_rows, state_dict, num_threads, output_filename)
+
+    output_files = {PREDICTIONS: output_filename, REFERENCES: reference_filename(output_filename)}
+    num_questions = 0
+    with RecordWriter(output_files) as writer:
+        for shard_idx, shard_files in map_ordered(_generate_shard, shards, workers=workers, chunksize=1,
+                initializer=_init_worker, initargs=initargs):
+            writer.write(dict((kind, _sorted_rows(filename)) for kind, filename in shard_files.items()))
+            for filename in shard_files.values():
+                os.remove(filename)
+            num_questions += bounds[shard_idx + 1] - bounds[shard_idx]
+            if logger:
+                logger.log('Generated shard %d / %d (%d questions)' % (shard_idx + 1, num_shards, num_questions))
+    return num_questions
+
+
+def load_answers(filename):
+    # {qid: answers} of a predictions or references file
+    answers = {}
+    with open(filename, 'r') as fp:
+        for line in fp:
+            row = json.loads(line)
+            answers[row[QID]] = row[ANSWERS]
+    return answers
+
+
+def _question_rows(data):
+    # one (answerId, questionId) row per question, the first of its samples, in
+    # question order
+    _, first = np.unique(data[:, 1], return_index=True)
+    return data[first]
+
+
+def _sorted_rows(filename):
+    with open(filename, 'r') as fp:
+        rows = [json.loads(line) for line in fp]
+    return sorted(rows, key=lambda row: row[QID])
+
+
+# state of a worker process, set up once by _init_worker
+_worker = {}
+
+
+def _init_worker(params, vocab, dicts, question_rows, state_dict, num_threads, output_filename):
+    # imported here, as the trainer module imports this one
+    from trainer.trainer import Trainer, hsizes
+
+    torch.set_num_threads(num_threads)
+    model_name = params[C.MODEL_NAME]
+    model = Seq2Seq(vocab.get_vocab_size(), hsizes(params, model_name), params)
+    model.load_state_dict(state_dict)
+    if C.USE_CUDA:
+        model = model.cuda()
+    trainer = Trainer(None, params, vocab=vocab)
+    trainer.model = model
+    trainer.model.eval()
+
+    _worker.update({
+        'trainer': trainer,
+        'decoder': AnswerDecoder(vocab),
+        'dicts': dicts,
+        'question_rows': question_rows,
+        'output_filename': output_filename,
+    })
+
+
+def _generate_shard(shard):
+    # generates the answers of the questions in question_rows[start:end] into shard
+    # files; returns (shard_idx, {kind: filename})
+    shard_idx, start, end = shard
+    trainer, decoder = _worker['trainer'], _worker['decoder']
+    answersDict, _, questionAnswersDict = _worker['dicts'][:3]
+    params = trainer.params
+
+    loader = AmazonDataLoader(tuple(_worker['dicts']) + (_worker['question_rows'][start:end],), params[C.MODEL_NAME],
+        params[C.BATCH_SIZE], params.get(C.MAX_BATCH_TOKENS), shuffle=False, drop_last=False)
+    shard_files = dict((kind, '%s.%s-%d' % (_worker['output_filename'], kind, shard_idx)) for kind in [PREDICTIONS, REFERENCES])
+
+    with open(shard_files[PREDICTIONS], 'w') as pred_fp, open(shard_files[REFERENCES], 'w') as ref_fp:
+        # batches come in loader order, since it does not shuffle
+        for batch, inputs in zip(loader.batches, trainer._prefetch(loader)):
+            answer_seqs, question_seqs, _, review_seqs, answer_lengths = inputs
+            output_seq, output_lengths = trainer._generate(question_seqs, review_seqs, len(answer_lengths))
+            output_seq = output_seq.data.cpu().numpy()
+
+            for question_id, seq, length in zip(loader.data[batch, 1].tolist(), output_seq, output_lengths):
+                pred_fp.write(json.dumps({QID: question_id, ANSWERS: [decoder.generated_text(seq, length)]}) + '\n')
+                gold_answers = decoder.gold_answers(answersDict, questionAnswersDict, question_id)
+                ref_fp.write(json.dumps({QID: question_id, ANSWERS: gold_answers}) + '\n')
+    return shard_idx, shard_files
@@ -28,6 +28,19 @@ class Loss:
         self.total_loss = 0
 
 
+    def state_dict(self):
+        return {
+            'total_num_tokens': int(self.total_num_tokens),
+            'total_num_sentences': int(self.total_num_sentences),
+            'total_num_batches': self.total_num_batches,
+            'total_loss': self.total_loss
+        }
+
+
+    def load_state_dict(self, state):
+        self.__dict__.update(state)
+
+
     def eval_batch_loss(self, outputs, targets):
         batch_num_sentences = targets.size(0)
         batch_num_tokens = targets.data.ne(C.PAD_INDEX).sum()
@@ -3,10 +3,11 @@
 
 import json
 import os
+import time
 import pickle
 from datetime import datetime
 from tqdm import tqdm
-import itertools
+import functools
 
 import numpy as np
 import torch
@@ -17,11 +18,16 @@ from torch.autograd import Variable
 import constants as C
 from models.seq2seq import Seq2Seq
 from trainer.loss import Loss
+from trainer import distributed
+from trainer.generator import AnswerDecoder
+from data.prefetcher import BatchPrefetcher, to_tensor
 
 from evaluator.evaluator import COCOEvalCap
+from utils.logger import NullLogger
 
 
 USE_CUDA = torch.cuda.is_available()
+METRICS_KEYS = ['train_loss', 'dev_loss', 'train_perplexity', 'dev_perplexity']
 
 class TrainerMetrics:
 
@@ -53,6 +59,13 @@ class TrainerMetrics:
         self.logger.log('\n\t[%s] Loss = %.4f, Min [%s] Loss = %.4f' % (mode, epoch_loss, mode, min_loss))
         self.logger.log('\t[%s] Perplexity = %.2f, Min [%s] Perplexity = %.2f' % (mode, epoch_perplexity, mode, min_perplexity))
 
+    def state_dict(self):
+        return dict((key, [float(value) for value in getattr(self, key)]) for key in METRICS_KEYS)
+
+    def load_state_dict(self, state):
+        for key in METRICS_KEYS:
+            setattr(self, key, list(state[key]))
+
     def is_best_dev_loss(self):
         return float(len(self.dev_loss)) > 0.0 and float(self.dev_loss[-1]) == float(np.nanmin(self.dev_loss))
 
@@ -78,15 +91,19 @@ class Trainer:
         self.start_epoch = 0
         self.resume_training = resume_training
         self.lr = None
+        self.step = 0
+        self.checkpoint = None
 
         # Data Loaders
         self.dataloader = dataloader
         self.dev_loader = dev_loader
         #self.test_loader = test_loader
 
-        # Saver and Logger
-        self.saver = saver
-        self.logger = self.saver.logger
+        # Saver and Logger; in data parallel training only the master process
+        # has them
+        self.is_master = distributed.is_master()
+        self.saver = saver if self.is_master else None
+        self.logger = self.saver.logger if self.saver else NullLogger()
 
         # Model
         self.model = Seq2Seq(
@@ -99,7 +116,21 @@ class Trainer:
         self.logger.log('PARAMS: %s' % self.params)
 
         # Optimizer and loss metrics
+        # resuming restores through the master's saver, and only in a single
+        # process: the other processes would not get the optimizer, metrics and
+        # loader state
         if self.resume_training:
+            assert self.is_master and not distributed.is_distributed(), 'Resuming data parallel training is not supported'
+            assert self.saver is not None, 'Resuming training needs a saver'
+        if self.resume_training and resume_epoch is None:
+            # latest mid-epoch checkpoint; the optimizer state is restored in train()
+            optimizer_state, metrics_state, trainer_state = self.saver.load_checkpoint(self.model)
+            self.optimizer = None
+            self.metrics = TrainerMetrics(self.logger)
+            self.metrics.load_state_dict(metrics_state)
+            self.checkpoint = (optimizer_state, trainer_state)
+            self.start_epoch = trainer_state['epoch']
+        elif self.resume_training:
             self.optimizer, self.metrics = self.saver.load_model_and_state(resume_epoch, self.model)
             self.start_epoch = resume_epoch + 1
         else:
@@ -110,6 +141,8 @@ class Trainer:
         if USE_CUDA:
             if self.model:
                 self.model = self.model.cuda()
+        if self.model and distributed.is_distributed():
+            distributed.broadcast_parameters(self.model)
 
 
     def train(self):
@@ -117,7 +150,8 @@ class Trainer:
         self._set_optimizer(0)
 
         # Save params, vocab and architecture
-        self.saver.save_params_and_vocab(self.params, self.vocab, str(self.model))
+        if self.saver:
+            self.saver.save_params_and_vocab(self.params, self.vocab, str(self.model))
 
         # For Debuging
         # self.dataloader = list(self.dataloader)[:10]
@@ -132,28 +166,45 @@ class Trainer:
             #self.metrics.add_loss(self.loss, C.TRAIN_TYPE)
             #self.eval(self.dataloader, C.TRAIN_TYPE, epoch=-1)
 
+        first_batch = 0
+        if self.checkpoint is not None:
+            first_batch = self._restore_checkpoint()
+
         for epoch in range(self.start_epoch, self.params[C.NUM_EPOCHS]):
             self.logger.log('\n  --- STARTING EPOCH : %d --- \n' % epoch)
 
-            # refresh loss, perplexity 
-            self.loss.reset()
-            for batch_itr, inputs in enumerate(tqdm(self.dataloader)):
+            # refresh loss, perplexity, unless resuming within the epoch
+            if first_batch == 0:
+                self.loss.reset()
+            batches = self._prefetch(self.dataloader)
+            # micro-batches are accumulated until they hold accumulate_tokens
+            # answer tokens; without it every batch is an optimizer step
+            accumulate_tokens = self.params.get(C.ACCUMULATE_TOKENS) or 0
+            self._reset_accumulation()
+            self._reset_throughput()
+            for batch_itr, inputs in enumerate(tqdm(batches, disable=not self.is_master), first_batch):
                 if batch_itr % 1000 == 0:
                     print("BATCH_ITR: ", batch_itr)
                 answer_seqs, question_seqs, question_ids, review_seqs, \
-                    answer_lengths = _extract_input_attributes(inputs, self.model_name)
-                batch_loss, batch_perplexity = self.train_batch(
+                    answer_lengths = inputs
+                self.train_batch(
                     question_seqs,
                     review_seqs,
                     answer_seqs,
                     answer_lengths
                 )
-                if batch_itr % self.print_every == 0:
-                    self.logger.log('\n\tMean [TRAIN] Loss for batch %d = %.2f' % (batch_itr, batch_loss))
-                    self.logger.log('\tMean [TRAIN] Perplexity for batch %d = %.2f' % (batch_itr, batch_perplexity))
+                if self._accumulated_enough(accumulate_tokens):
+                    self._train_step(epoch, batch_itr + 1)
+
+            if self.accumulated_tokens > 0:
+                self._train_step(epoch, len(self.dataloader))
+            first_batch = 0
 
             self.logger.log('\n  --- END OF EPOCH : %d --- \n' % epoch)
+            self.logger.log('\t[TRAIN] Padding waste = %.2f%% (%d batches)' % (100.0 * self.dataloader.padding_waste(), len(self.dataloader)))
+            batches.log_stats(self.logger, C.TRAIN_TYPE)
             # Compute epoch loss and perplexity
+            self._all_reduce_loss()
             self.metrics.add_loss(self.loss, C.TRAIN_TYPE)
 
             # Eval on dev set
@@ -162,7 +213,7 @@ class Trainer:
             self.logger.log('Finished evaluation on DEV')
 
             # Save model periodically
-            if epoch % self.save_model_every == 0:
+            if self.saver and epoch % self.save_model_every == 0:
                 self.saver.save_model_and_state(epoch,
                     self.model,
                     self.optimizer,
@@ -176,7 +227,7 @@ class Trainer:
                     self._set_optimizer(epoch, lr=lr)
 
             # Save the best model till now
-            if self.metrics.is_best_dev_loss():
+            if self.saver and self.metrics.is_best_dev_loss():
                 self.saver.save_model(C.BEST_EPOCH_IDX, self.model)
 
 
@@ -189,24 +240,102 @@ class Trainer:
         # Set model in train mode
         self.model.train(True)
 
-        # Zero grad and teacher forcing
-        self.optimizer.zero_grad()
+        # Teacher forcing
         teacher_forcing_ratio = self.params[C.TEACHER_FORCING_RATIO]
 
         # run forward pass
         loss, perplexity, _, _ = self._forward_pass(question_seqs, review_seqs, answer_seqs, teacher_forcing_ratio)
 
-        # gradient computation
-        loss.backward()
+        # gradient computation; the loss is a mean over the batch tokens, its sum
+        # is accumulated and divided by the accumulated tokens before the step
+        num_tokens = int(np.sum(answer_lengths))
+        (loss * num_tokens).backward()
 
-        # update parameters
-        params = itertools.chain.from_iterable([g['params'] for g in self.optimizer.param_groups])
-        torch.nn.utils.clip_grad_norm(params, self.params[C.GLOBAL_NORM_MAX])
-        self.optimizer.step()
+        self.accumulated_tokens += num_tokens
+        self.accumulated_loss += loss.data.item() * num_tokens
+        self.accumulated_sentences += len(answer_lengths)
 
         return loss.data.item(), perplexity
 
 
+    def _accumulated_enough(self, accumulate_tokens):
+        # the decision to step is taken on the tokens of all processes, so that
+        # they all step together
+        if not accumulate_tokens:
+            return True
+        if distributed.is_distributed():
+            return distributed.all_reduce_sum([self.accumulated_tokens])[0] >= accumulate_tokens
+        return self.accumulated_tokens >= accumulate_tokens
+
+    def _train_step(self, epoch, next_batch):
+        # update parameters with the gradients accumulated since the last step, on
+        # all processes summed by a single all_reduce
+        if distributed.is_distributed():
+            self.accumulated_tokens, self.accumulated_loss, self.accumulated_sentences = distributed.all_reduce_gradients(
+                self.clip_params, [self.accumulated_tokens, self.accumulated_loss, self.accumulated_sentences])
+        self.throughput_tokens += self.accumulated_tokens
+        self.throughput_sentences += self.accumulated_sentences
+        for param in self.clip_params:
+            if param.grad is not None:
+                param.grad.data.div_(self.accumulated_tokens)
+        torch.nn.utils.clip_grad_norm_(self.clip_params, self.params[C.GLOBAL_NORM_MAX])
+        self.optimizer.step()
+        self.optimizer.zero_grad()
+        self.step += 1
+
+        if self.step % self.print_every == 0:
+            step_loss = self.accumulated_loss / self.accumulated_tokens
+            elapsed = max(time.time() - self.throughput_start, 1e-6)
+            self.logger.log('\n\tMean [TRAIN] Loss for step %d = %.2f' % (self.step, step_loss))
+            self.logger.log('\tMean [TRAIN] Perplexity for step %d = %.2f' % (self.step, np.exp(step_loss)))
+            self.logger.log('\t[TRAIN] Throughput = %.1f tokens/s, %.1f sentences/s' % (
+                self.throughput_tokens / elapsed, self.throughput_sentences / elapsed))
+            self._reset_throughput()
+        self._reset_accumulation()
+
+        checkpoint_every = self.params.get(C.CHECKPOINT_EVERY)
+        if self.saver and checkpoint_every and self.step % checkpoint_every == 0:
+            self.saver.save_checkpoint(self.model, self.optimizer, self.metrics, {
+                'epoch': epoch,
+                'step': self.step,
+                'lr': self.lr,
+                'batch_order': [int(index) for index in self.dataloader.batch_order],
+                'next_batch': next_batch,
+                'loss': self.loss.state_dict()
+            })
+
+    def _restore_checkpoint(self):
+        # continues the checkpointed epoch from the batch after the last step;
+        # returns the position of that batch
+        optimizer_state, trainer_state = self.checkpoint
+        self.checkpoint = None
+        self.lr = trainer_state['lr']
+        self.optimizer.load_state_dict(optimizer_state)
+        self.step = trainer_state['step']
+        self.loss.load_state_dict(trainer_state['loss'])
+        self.dataloader.resume_from(trainer_state['batch_order'], trainer_state['next_batch'])
+        self.logger.log('Resuming epoch %d at batch %d (Step = %d)' % (trainer_state['epoch'], trainer_state['next_batch'], self.step))
+        return trainer_state['next_batch']
+
+    def _reset_accumulation(self):
+        self.accumulated_tokens = 0
+        self.accumulated_loss = 0.0
+        self.accumulated_sentences = 0
+
+    def _all_reduce_loss(self):
+        # loss totals of all processes, so that every process has the same metrics
+        if not distributed.is_distributed():
+            return
+        state = self.loss.state_dict()
+        keys = sorted(state)
+        self.loss.load_state_dict(dict(zip(keys, distributed.all_reduce_sum([state[key] for key in keys]))))
+
+    def _reset_throughput(self):
+        self.throughput_tokens = 0
+        self.throughput_sentences = 0
+        self.throughput_start = time.time()
+
+
     def eval(self, dataloader, mode, output_filename=None, epoch=0):
 
         self.model.eval()
@@ -222,46 +351,48 @@ class Trainer:
 
         gold_answers_dict = {}
         generated_answer_dict = {}
+        if mode == C.TEST_TYPE:
+            decoder = AnswerDecoder(self.vocab)
+            output_fp = open(output_filename, 'a')
 
-        for batch_itr, inputs in tqdm(enumerate(dataloader)):
+        batches = self._prefetch(dataloader)
+        for batch_itr, inputs in tqdm(enumerate(batches), disable=not self.is_master):
             answer_seqs, question_seqs, question_ids, review_seqs, \
-                answer_lengths = _extract_input_attributes(inputs, self.model_name)
+                answer_lengths = inputs
 
-            _, _, output_seq, output_lengths = self._forward_pass(
-                question_seqs,
-                review_seqs,
-                answer_seqs,
-                1.0,
-                compute_loss=compute_loss
-            )
+            if mode == C.TEST_TYPE:
+                # answers are generated without teacher forcing
+                output_seq, output_lengths = self._generate(question_seqs, review_seqs, len(answer_lengths))
+            else:
+                _, _, output_seq, output_lengths = self._forward_pass(
+                    question_seqs,
+                    review_seqs,
+                    answer_seqs,
+                    1.0,
+                    compute_loss=compute_loss
+                )
 
             if mode == C.TEST_TYPE:
                 output_seq = output_seq.data.cpu().numpy()
-                with open(output_filename, 'a') as fp:
-                    for seq_itr, length in enumerate(output_lengths):
-                        length = int(length)
-                        seq = output_seq[seq_itr, :length]
-                        if seq[-1] == C.EOS_INDEX:
-                            seq = seq[:-1]
-                        tokens = self.vocab.token_list_from_indices(seq)
-                        generated_answer = ' '.join(tokens)
-                        fp.write(generated_answer + '\n')
-                        
-                        gold_answers = []
-                        question_id = question_ids[seq_itr]
-                        answer_ids = dataloader.questionAnswersDict[question_id]
-                        for answer_id in answer_ids:
-                            answer_seq = dataloader.answersDict[answer_id]
-                            answer_tokens = self.vocab.token_list_from_indices(answer_seq)
-                            gold_answers.append(' '.join(answer_tokens))
-
-                        gold_answers_dict[question_id] = gold_answers
-                        generated_answer_dict[question_id] = [generated_answer]
-        
+                for seq_itr, length in enumerate(output_lengths):
+                    generated_answer = decoder.generated_text(output_seq[seq_itr], length)
+                    output_fp.write(generated_answer + '\n')
+
+                    question_id = question_ids[seq_itr]
+                    if question_id not in gold_answers_dict:
+                        gold_answers_dict[question_id] = decoder.gold_answers(
+                            dataloader.answersDict, dataloader.questionAnswersDict, question_id)
+                    generated_answer_dict[question_id] = [generated_answer]
+
+        batches.log_stats(self.logger, mode)
+        if mode == C.TEST_TYPE:
+            output_fp.close()
+
         if mode == C.TEST_TYPE:
             print(COCOEvalCap.compute_scores(gold_answers_dict, generated_answer_dict))
 
         if mode == C.DEV_TYPE:
+            self._all_reduce_loss()
             self.metrics.add_loss(self.loss, C.DEV_TYPE)
         elif mode == C.TEST_TYPE:
             self.logger.log('Saving generated answers to file {0}'.format(output_filename))
@@ -277,9 +408,10 @@ class Trainer:
             teacher_forcing_ratio,
             compute_loss=True
         ):
-        target_seqs, answer_seqs  = _var(answer_seqs), _var(answer_seqs)
+        target_seqs = _var(answer_seqs)
+        answer_seqs = target_seqs
         question_seqs = None if self.model_name == C.LM_ANSWERS else _var(question_seqs)
-        review_seqs = map(_var, review_seqs) if self.model_name == C.LM_QUESTION_ANSWERS_REVIEWS else None
+        review_seqs = _review_vars(review_seqs) if self.model_name == C.LM_QUESTION_ANSWERS_REVIEWS else None
 
         # run forward pass
         outputs, output_hidden, ret_dict = self.model(
@@ -301,6 +433,25 @@ class Trainer:
 
         return loss, perplexity, output_seq, output_lengths
 
+    def _generate(self, question_seqs, review_seqs, batch_size):
+        question_seqs = None if self.model_name == C.LM_ANSWERS else _var(question_seqs)
+        review_seqs = _review_vars(review_seqs) if self.model_name == C.LM_QUESTION_ANSWERS_REVIEWS else None
+
+        output_seq, output_lengths, _ = self.model.generate(
+            question_seqs,
+            review_seqs,
+            beam_width=self.params.get(C.BEAM_WIDTH, 1),
+            length_penalty=self.params.get(C.LENGTH_PENALTY, 0.0),
+            batch_size=batch_size
+        )
+        return output_seq, output_lengths.tolist()
+
+    def _prefetch(self, dataloader):
+        # batches are padded and turned into tensors in a background thread, so the
+        # training loop only moves ready tensors to the device
+        collate = functools.partial(_to_tensors, model_name=self.model_name)
+        return BatchPrefetcher(dataloader, collate, self.params.get(C.PREFETCH_BATCHES, 4))
+
     def _set_optimizer(self, epoch):
         opt_type = self.params[C.OPTIMIZER_TYPE]
         if opt_type == C.ADAM:
@@ -309,6 +460,8 @@ class Trainer:
             self.optimizer = optim.SGD(self.model.parameters(), lr=self.lr)
         else:
             raise 'Unimplemented optimization type: %s' % opt_type
+        # parameters are gathered once for gradient clipping
+        self.clip_params = [param for group in self.optimizer.param_groups for param in group['params']]
 
         self.logger.log('\nSetting [%s] Learning Rate = %.6f (Epoch = %d)' % (opt_type.upper(), self.lr, epoch))
 
@@ -326,8 +479,26 @@ class Trainer:
             raise 'Unimplemented optimization type: %s' % opt_type
 
 def _var(variable):
-    dtype = torch.cuda.LongTensor if USE_CUDA else torch.LongTensor
-    return Variable(torch.LongTensor(variable).type(dtype))
+    # tensors from the prefetcher are already pinned; the copy to the GPU is async
+    tensor = variable if torch.is_tensor(variable) else torch.LongTensor(variable)
+    if USE_CUDA:
+        tensor = tensor.cuda(non_blocking=True)
+    return Variable(tensor)
+
+def _review_vars(review_seqs):
+    # the lengths stay on the CPU for pack_padded_sequence
+    review_seqs, review_lengths, review_slots, num_slots = review_seqs
+    return _var(review_seqs), review_lengths, _var(review_slots), num_slots
+
+def _to_tensors(inputs, model_name):
+    answer_seqs, question_seqs, question_ids, review_seqs, \
+        answer_lengths = _extract_input_attributes(inputs, model_name)
+    answer_seqs = to_tensor(answer_seqs)
+    question_seqs = None if question_seqs is None else to_tensor(question_seqs)
+    if review_seqs is not None:
+        review_seqs, review_lengths, review_slots, num_slots = review_seqs
+        review_seqs = (to_tensor(review_seqs), torch.from_numpy(review_lengths), to_tensor(review_slots), num_slots)
+    return answer_seqs, question_seqs, question_ids, review_seqs, answer_lengths
 
 def _extract_input_attributes(inputs, model_name):
     if model_name == C.LM_ANSWERS:
@@ -27,3 +27,10 @@ def _log_file_name(base_dir):
 def _ensure_path(path):
     if not os.path.exists(path):
         os.makedirs(path)
+
+class NullLogger:
+    # stands in for Logger in processes that do not log, e.g. non-master processes
+    # of data parallel training
+
+    def log(self, line, clear=False):
+        pass
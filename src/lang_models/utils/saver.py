@@ -9,18 +9,23 @@ import torch
 import pandas as pd
 
 import constants as C
+from data.vocabulary import Vocabulary
 from utils.logger import Logger
 
 SAVED_PARAMS_FILENAME = 'params.json'
-SAVED_VOCAB_FILENAME = 'vocab.pkl'
+SAVED_VOCAB_FILENAME = 'vocab.json'
+SAVED_VOCAB_PICKLE_FILENAME = 'vocab.pkl'
 SAVED_ARCHITECTURE_FILENAME = 'architecture.txt'
 
 SAVED_MODEL_FILENAME = 'model_%d.pt'
 SAVED_STATE_FILENAME = 'trainer_state_%d.pt'
 SAVED_METRICS_FILENAME = 'metrics_%d.tsv'
+SAVED_CHECKPOINT_FILENAME = 'checkpoint.pt'
 
+MODEL = 'model'
 OPTIMIZER = 'optimizer'
 METRICS = 'metrics'
+TRAINER = 'trainer'
 USE_CUDA = torch.cuda.is_available()
 
 class Saver:
@@ -28,7 +33,7 @@ class Saver:
     def __init__(self, save_dir, params):
         if save_dir:
             self.save_dir = save_dir
-            self.params = _json_load(self._params_filename())
+            self.params = load_params(save_dir)
         else:
             raise Exception("save_dir argument not found")
 
@@ -49,7 +54,7 @@ class Saver:
         _json_dump(params, params_filename)
 
         self.logger.log('Saving vocab in file: %s' % self.vocab_filename)
-        _pickle_dump(vocab, self.vocab_filename)
+        vocab.save(self.vocab_filename)
 
         self.logger.log('Saving architecture in file: %s' % self.architecture_filename)
         with open(self.architecture_filename, 'w') as fp:
@@ -87,6 +92,31 @@ class Saver:
         state = torch.load(state_filename)
         return state[OPTIMIZER], state[METRICS]
 
+    def save_checkpoint(self, model, optimizer, metrics, trainer_state):
+        # latest mid-epoch checkpoint: model, optimizer state, metrics and the
+        # trainer's position in the epoch, all as state dicts; replaced atomically
+        checkpoint_filename = '%s/%s' % (self.save_dir, SAVED_CHECKPOINT_FILENAME)
+        checkpoint = {
+            MODEL: model.state_dict(),
+            OPTIMIZER: optimizer.state_dict(),
+            METRICS: metrics.state_dict(),
+            TRAINER: trainer_state
+        }
+        self.logger.log('\nSaving checkpoint (Epoch = %d, Step = %d)...' % (trainer_state['epoch'], trainer_state['step']))
+        tmp_filename = '%s.tmp' % checkpoint_filename
+        torch.save(checkpoint, tmp_filename)
+        os.replace(tmp_filename, checkpoint_filename)
+
+    def load_checkpoint(self, model):
+        map_location = None if USE_CUDA else lambda storage, loc: storage
+        checkpoint_filename = '%s/%s' % (self.save_dir, SAVED_CHECKPOINT_FILENAME)
+        self.logger.log('\nLoading checkpoint from %s...' % checkpoint_filename)
+        checkpoint = torch.load(checkpoint_filename, map_location=map_location)
+        model.load_state_dict(checkpoint[MODEL])
+        if USE_CUDA:
+            model.cuda()
+        return checkpoint[OPTIMIZER], checkpoint[METRICS], checkpoint[TRAINER]
+
     def save_metrics(self, epoch, metrics):
         metrics_filename = '%s/%s' % (self.save_dir, SAVED_METRICS_FILENAME % epoch)
         pd.DataFrame({
@@ -97,7 +127,11 @@ class Saver:
         }).to_csv(metrics_filename, sep='\t')
 
     def load_vocab(self):
-        return _pickle_load(self.vocab_filename)
+        # save dirs from before the JSON format have a pickled Vocabulary
+        pickle_filename = '%s/%s' % (self.save_dir, SAVED_VOCAB_PICKLE_FILENAME)
+        if not os.path.exists(self.vocab_filename) and os.path.exists(pickle_filename):
+            return _pickle_load(pickle_filename)
+        return Vocabulary.load(self.vocab_filename)
 
     def _save_dir(self, time):
         time_str = time.strftime('%Y-%m-%d-%H-%M-%S')
@@ -106,6 +140,9 @@ class Saver:
     def _params_filename(self):
         return '%s/%s' % (self.save_dir, SAVED_PARAMS_FILENAME)
 
+def load_params(save_dir):
+    return _json_load('%s/%s' % (save_dir, SAVED_PARAMS_FILENAME))
+
 def _ensure_path(path):
     if not os.path.exists(path):
         os.makedirs(path)
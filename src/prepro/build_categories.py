@@ -0,0 +1,238 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+# same categories as constants.CATEGORIES in lang_models
+CATEGORIES = [
+    "Automotive",
+    "Baby",
+    "Beauty",
+    "Cell_Phones_and_Accessories",
+    "Clothing_Shoes_and_Jewelry",
+    "Electronics",
+    "Grocery_and_Gourmet_Food",
+    "Health_and_Personal_Care",
+    "Home_and_Kitchen",
+    "Musical_Instruments",
+    "Office_Products",
+    "Patio_Lawn_and_Garden",
+    "Pet_Supplies",
+    "Sports_and_Outdoors",
+    "Tools_and_Home_Improvement",
+    "Toys_and_Games",
+    "Video_Games",
+]
+
+SPLITS = [('train', 80), ('val', 10), ('test', 10)]
+
+# peak memory of the non-streaming join relative to the compressed input size
+PANDAS_MEMORY_FACTOR = 20
+
+# download locations of the dumps, as in preprocess_data.main
+QA_URL_PREFIX = 'http://jmcauley.ucsd.edu/data/amazon/qa/icdm/QA_'
+REVIEW_URL_PREFIX = 'http://snap.stanford.edu/data/amazon/productGraph/categoryFiles/reviews_'
+HEAD_TIMEOUT = 30
+
+
+def input_paths(data_dir, category):
+    return ["%s/QA_%s.json.gz" % (data_dir, category), "%s/reviews_%s.json.gz" % (data_dir, category)]
+
+
+def input_urls(category):
+    # in the order of input_paths
+    return [QA_URL_PREFIX + category + '.json.gz', REVIEW_URL_PREFIX + category + '.json.gz']
+
+
+def output_path(data_dir, category):
+    return "%s/qar_products_%s.jsonl" % (data_dir, category)
+
+
+def input_size(data_dir, category):
+    return sum(os.path.getsize(path) for path in input_paths(data_dir, category) if os.path.exists(path))
+
+
+def remote_size(url):
+    # Content-Length of a HEAD request, None when the server does not give it
+    request = urllib.request.Request(url, method='HEAD')
+    try:
+        with urllib.request.urlopen(request, timeout=HEAD_TIMEOUT) as response:
+            length = response.headers.get('Content-Length')
+    except (urllib.error.URLError, OSError):
+        return None
+    return int(length) if length is not None else None
+
+
+def input_sizes(args, categories):
+    # compressed input size of every category before anything is built, so that
+    # categories can be ranked and budgeted. Dumps that are not on disk yet are
+    # sized by the Content-Length of their download; when a server does not give
+    # one, the missing dumps of that category are downloaded here and measured on
+    # disk.
+    sizes = {}
+    for category in categories:
+        missing = [(path, url) for path, url in zip(input_paths(args.data_dir, category), input_urls(category))
+                   if not os.path.exists(path)]
+        lengths = [remote_size(url) for _, url in missing] if args.download == 1 else []
+        if None in lengths:
+            for path, url in missing:
+                print("Downloading %s to size %s" % (url, category))
+                download(url, path)
+            lengths = []
+        sizes[category] = sum(lengths) + input_size(args.data_dir, category)
+    return sizes
+
+
+def download(url, path):
+    # through a temporary file, so that an interrupted download is not taken for a dump
+    urllib.request.urlretrieve(url, path + '.part')
+    os.rename(path + '.part', path)
+
+
+def is_up_to_date(data_dir, category):
+    inputs = input_paths(data_dir, category)
+    output = output_path(data_dir, category)
+    if not os.path.exists(output) or not all(os.path.exists(path) for path in inputs):
+        return False
+    return os.path.getmtime(output) > max(os.path.getmtime(path) for path in inputs)
+
+
+def estimate_memory(args, size):
+    if args.streaming == 1:
+        return args.memory_per_category_gb * 2**30
+    return PANDAS_MEMORY_FACTOR * size
+
+
+def total_memory():
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+def build_categories(args, categories, manifest):
+    # largest categories first; a category starts only while the estimated memory of
+    # everything running stays within budget (one category always runs)
+    budget = args.memory_budget_gb * 2**30 if args.memory_budget_gb > 0 else total_memory()
+    sizes = input_sizes(args, categories)
+    pending = sorted(categories, key=lambda category: sizes[category], reverse=True)
+    running = {}
+    used_memory = 0
+
+    while len(pending) > 0 or len(running) > 0:
+        while len(pending) > 0 and len(running) < args.workers:
+            memory = estimate_memory(args, sizes[pending[0]])
+            if len(running) > 0 and used_memory + memory > budget:
+                break
+            category = pending.pop(0)
+            # only download dumps that are not already there
+            downloaded = all(os.path.exists(path) for path in input_paths(args.data_dir, category))
+            command = [
+                sys.executable, 'preprocess_data.py',
+                '--data_dir', args.data_dir,
+                '--category', category,
+                '--download', str(0 if downloaded else args.download),
+                '--streaming', str(args.streaming),
+            ]
+            process = subprocess.Popen(command)
+            running[process.pid] = (category, memory, time.time())
+            used_memory += memory
+            print("Started %s (estimated %.1f GB)" % (category, memory / 2**30))
+
+        # wait4 gives the rusage of exactly the process that finished
+        pid, status, rusage = os.wait4(-1, 0)
+        if pid not in running:
+            continue
+        category, memory, start = running.pop(pid)
+        used_memory -= memory
+        returncode = os.waitstatus_to_exitcode(status)
+        manifest['categories'][category] = {
+            'status': 'built' if returncode == 0 else 'failed',
+            'returncode': returncode,
+            'wall_time': time.time() - start,
+            'peak_rss_mb': rusage.ru_maxrss / 1024.0,
+            'input_bytes': input_size(args.data_dir, category),
+            'output_bytes': os.path.getsize(output_path(args.data_dir, category)) if returncode == 0 else 0,
+        }
+        print("Finished %s: %s" % (category, manifest['categories'][category]))
+
+
+def line_offsets(path):
+    offsets = []
+    with open(path, 'rb') as fp:
+        offset = 0
+        for line in fp:
+            offsets.append(offset)
+            offset += len(line)
+    return offsets
+
+
+def write_splits(data_dir, categories, seed):
+    # shuffles the product lines of all categories together and writes the 80/10/10
+    # train/val/test files; only line offsets are held in memory
+    lines = []
+    for file_idx, category in enumerate(categories):
+        lines += [(file_idx, offset) for offset in line_offsets(output_path(data_dir, category))]
+    order = np.random.RandomState(seed).permutation(len(lines))
+
+    counts = {}
+    files = [open(output_path(data_dir, category), 'rb') for category in categories]
+    start, percent_sum = 0, 0
+    for split, percent in SPLITS:
+        percent_sum += percent
+        end = len(lines) * percent_sum // 100
+        with open("%s/%s-qar_products_all.jsonl" % (data_dir, split), 'wb') as wfp:
+            for idx in order[start:end]:
+                file_idx, offset = lines[idx]
+                files[file_idx].seek(offset)
+                wfp.write(files[file_idx].readline())
+        counts[split] = int(end - start)
+        start = end
+    for fp in files:
+        fp.close()
+    return counts
+
+
+def main(args):
+    categories = CATEGORIES if args.categories is None else args.categories.split(',')
+    manifest = {'categories': {}}
+    start = time.time()
+
+    to_build = []
+    for category in categories:
+        if args.force == 0 and is_up_to_date(args.data_dir, category):
+            manifest['categories'][category] = {'status': 'skipped'}
+        else:
+            to_build.append(category)
+    build_categories(args, to_build, manifest)
+
+    failed = [category for category in categories if manifest['categories'][category]['status'] == 'failed']
+    if len(failed) == 0:
+        manifest['splits'] = write_splits(args.data_dir, categories, args.seed)
+    manifest['wall_time'] = time.time() - start
+
+    with open(args.manifest_file or "%s/build_manifest.json" % args.data_dir, 'w') as fp:
+        json.dump(manifest, fp, indent=2)
+    if len(failed) > 0:
+        print("Failed categories: %s" % failed)
+        exit(1)
+
+
+if __name__ == '__main__':
+    argParser = argparse.ArgumentParser(description="Build qar_products for all categories in parallel")
+    argParser.add_argument("--data_dir", type=str, default="../../data")
+    argParser.add_argument("--categories", type=str, default=None)
+    argParser.add_argument("--workers", type=int, default=4)
+    argParser.add_argument("--memory_budget_gb", type=float, default=0)
+    argParser.add_argument("--memory_per_category_gb", type=float, default=2)
+    argParser.add_argument("--download", type=int, default=1)
+    argParser.add_argument("--streaming", type=int, default=1)
+    argParser.add_argument("--force", type=int, default=0)
+    argParser.add_argument("--seed", type=int, default=0)
+    argParser.add_argument("--manifest_file", type=str, default=None)
+
+    args = argParser.parse_args()
+    main(args)
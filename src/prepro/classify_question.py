@@ -1,29 +1,111 @@
 import numpy as np
 import pandas as pd
-import string
 import pickle
+import json
+import os
+import argparse
+from collections import OrderedDict
 
 import sklearn
 from sklearn.metrics import classification_report
 from sklearn.feature_extraction.text import TfidfVectorizer
 from nltk import sent_tokenize
 
+from tokenization import tokenize
+
 class MeanEmbeddingVectorizer(object):
-    def __init__(self, word2vec):
-        self.word2vec = word2vec
+    # Embeddings live in one contiguous float32 matrix with a token -> row index, so a
+    # batch of texts is a single gather plus a segment sum. save/load use a .npy matrix
+    # (memory-mapped on load) and a JSON token list instead of a pickled dict.
+
+    def __init__(self, word2vec, dim=300, cache_size=10000):
         # if a text is empty we should return a vector of zeros
         # with the same dimensionality as all the other vectors
-        self.dim = 300
+        self.dim = dim
+        self.cache_size = cache_size
+        tokens = list(word2vec.keys())
+        embeddings = np.array([word2vec[w] for w in tokens], dtype=np.float32).reshape(len(tokens), dim)
+        self._set_embeddings(tokens, embeddings)
+
+    def _set_embeddings(self, tokens, embeddings):
+        self.tokens = tokens
+        self.token2row = {w: i for i, w in enumerate(tokens)}
+        self.embeddings = embeddings
+        self._cache = OrderedDict()
+
+    def __getstate__(self):
+        return {
+            'dim': self.dim,
+            'cache_size': self.cache_size,
+            'tokens': self.tokens,
+            'embeddings': np.asarray(self.embeddings),
+        }
+
+    def __setstate__(self, state):
+        self.dim = state.get('dim', 300)
+        self.cache_size = state.get('cache_size', 10000)
+        if 'word2vec' in state:
+            # pickles written before the array-backed format hold a {token: vector} dict
+            word2vec = state['word2vec']
+            tokens = list(word2vec.keys())
+            embeddings = np.array([word2vec[w] for w in tokens], dtype=np.float32).reshape(len(tokens), self.dim)
+            self._set_embeddings(tokens, embeddings)
+        else:
+            self._set_embeddings(state['tokens'], state['embeddings'])
+
+    def save(self, path):
+        np.save(path + '.npy', np.asarray(self.embeddings, dtype=np.float32))
+        with open(path + '.vocab.json', 'w') as fp:
+            json.dump(self.tokens, fp)
+
+    @classmethod
+    def load(cls, path, mmap=True, cache_size=10000):
+        vectorizer = cls.__new__(cls)
+        embeddings = np.load(path + '.npy', mmap_mode='r' if mmap else None)
+        with open(path + '.vocab.json', 'r') as fp:
+            tokens = json.load(fp)
+        vectorizer.__setstate__({
+            'dim': embeddings.shape[1],
+            'cache_size': cache_size,
+            'tokens': tokens,
+            'embeddings': embeddings,
+        })
+        return vectorizer
 
     def fit(self, X):
         return self
 
     def transform(self, X):
-        return np.array([
-            np.mean([self.word2vec[w] for w in words if w in self.word2vec]
-                    or [np.zeros(self.dim)], axis=0)
-            for words in X
-        ])
+        X = list(X)
+        vectors = np.zeros((len(X), self.dim))
+
+        misses, keys = [], []
+        for i, words in enumerate(X):
+            key = words if isinstance(words, str) else tuple(words)
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                vectors[i] = self._cache[key]
+            else:
+                misses.append(i)
+                keys.append(key)
+        if len(misses) == 0:
+            return vectors
+
+        row_ids = [[self.token2row[w] for w in X[i] if w in self.token2row] for i in misses]
+        lengths = np.array([len(ids) for ids in row_ids], dtype=np.int64)
+        nonempty = lengths > 0
+        if nonempty.any():
+            flat_ids = np.fromiter((row for ids in row_ids for row in ids), dtype=np.int64, count=lengths.sum())
+            starts = (np.cumsum(lengths) - lengths)[nonempty]
+            sums = np.add.reduceat(self.embeddings[flat_ids].astype(np.float64), starts, axis=0)
+            vectors[np.array(misses)[nonempty]] = sums / lengths[nonempty][:, None]
+
+        if self.cache_size > 0:
+            for i, key in zip(misses, keys):
+                self._cache[key] = vectors[i].copy()
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return vectors
 
 
 def get_combined_review(top_reviews):
@@ -33,18 +115,6 @@ def get_combined_review(top_reviews):
         all_reviews += ' '
     return all_reviews.strip()
 
-def tokenize(text):
-    punctuations = string.punctuation.replace("\'", '')
-
-    for ch in punctuations:
-        text = text.replace(ch, " " + ch + " ")
-
-    tokens = text.split()
-    for i, token in enumerate(tokens):
-        if not token.isupper():
-            tokens[i] = token.lower()
-    return tokens
-
 def n_intersection(q, r):
     return len(set(q).intersection(set(r)))
 
@@ -100,14 +170,25 @@ def load_vectorizers(tfidf_vectorizer_filename, w2v_vectorizer_filename):
     with open(tfidf_vectorizer_filename, 'rb') as fp:
         tfidf_vectorizer = pickle.load(fp)
 
-    with open(w2v_vectorizer_filename, 'rb') as fp:
-        w2v_vectorizer = pickle.load(fp)
+    # prefer the memory-mapped export (see convert_w2v_vectorizer) next to the pickle
+    w2v_path = os.path.splitext(w2v_vectorizer_filename)[0]
+    if os.path.exists(w2v_path + '.npy'):
+        w2v_vectorizer = MeanEmbeddingVectorizer.load(w2v_path)
+    else:
+        with open(w2v_vectorizer_filename, 'rb') as fp:
+            w2v_vectorizer = pickle.load(fp)
 
     return {
         'w2v': w2v_vectorizer,
         'tfidf': tfidf_vectorizer
     }
 
+def convert_w2v_vectorizer(w2v_vectorizer_filename):
+    # writes <name>.npy and <name>.vocab.json next to a pickled MeanEmbeddingVectorizer
+    with open(w2v_vectorizer_filename, 'rb') as fp:
+        w2v_vectorizer = pickle.load(fp)
+    w2v_vectorizer.save(os.path.splitext(w2v_vectorizer_filename)[0])
+
 def compute_features(vectorizers, question, reviews):
     q_tokens = tokenize(question)
     r_tokens = tokenize(reviews)
@@ -129,6 +210,56 @@ def compute_features(vectorizers, question, reviews):
         [n_q, n_r, intersection_n, intr_frac, w2v_sent, tfidf_sent, w2v_sent_mean, tfidf_sent_mean]
     ])
 
+def _segment_reduce(values, lengths):
+    # max and mean of values over consecutive segments of the given lengths; 0 for empty segments
+    lengths = np.asarray(lengths, dtype=np.int64)
+    maxes = np.zeros(len(lengths))
+    means = np.zeros(len(lengths))
+    nonempty = lengths > 0
+    if nonempty.any():
+        starts = (np.cumsum(lengths) - lengths)[nonempty]
+        maxes[nonempty] = np.maximum.reduceat(values, starts)
+        means[nonempty] = np.add.reduceat(values, starts) / lengths[nonempty]
+    return maxes, means
+
+def compute_features_batch(vectorizers, questions, reviews_list):
+    # compute_features for many (question, combined reviews) pairs: every question and
+    # review sentence goes through each vectorizer exactly once
+    n_qs, n_rs, intersections, intr_fracs = [], [], [], []
+    sentences, n_sentences = [], []
+    for question, reviews in zip(questions, reviews_list):
+        q_tokens = tokenize(question)
+        r_tokens = tokenize(reviews)
+        r_sents = sent_tokenize(reviews)
+
+        intersection_n = len(set(q_tokens).intersection(set(r_tokens)))
+        n_qs.append(len(q_tokens))
+        n_rs.append(len(r_tokens))
+        intersections.append(intersection_n)
+        intr_fracs.append(intersection_n / len(q_tokens))
+        sentences += r_sents
+        n_sentences.append(len(r_sents))
+
+    owners = np.repeat(np.arange(len(questions)), n_sentences)
+
+    if len(sentences) > 0:
+        q_tfidf = vectorizers['tfidf'].transform(questions)
+        s_tfidf = vectorizers['tfidf'].transform(sentences)
+        tfidf_sims = np.asarray(s_tfidf.multiply(q_tfidf[owners]).sum(axis=1)).ravel()
+
+        q_w2v = vectorizers['w2v'].transform(questions)
+        s_w2v = vectorizers['w2v'].transform(sentences)
+        w2v_sims = np.einsum('ij,ij->i', s_w2v, q_w2v[owners])
+    else:
+        tfidf_sims = w2v_sims = np.zeros(0)
+
+    w2v_sent, w2v_sent_mean = _segment_reduce(w2v_sims, n_sentences)
+    tfidf_sent, tfidf_sent_mean = _segment_reduce(tfidf_sims, n_sentences)
+
+    return np.column_stack([
+        n_qs, n_rs, intersections, intr_fracs, w2v_sent, tfidf_sent, w2v_sent_mean, tfidf_sent_mean
+    ])
+
 def predictions_k(model, X, k):
     probs = model.predict_proba(X)
     return probs[:, 1] >= k
@@ -140,3 +271,20 @@ def is_answerable(model, vectorizers, question, top_reviews):
 def is_suggestive(model, vectorizers, question, top_reviews):
     features = compute_features(vectorizers, question, get_combined_review(top_reviews))
     return 1 - int(predictions_k(model, features, 0.5)[0])
+
+def is_answerable_batch(model, vectorizers, pairs):
+    # pairs: list of (question, top_reviews); one predict_proba call for the whole batch
+    if len(pairs) == 0:
+        return []
+    questions = [question for question, _ in pairs]
+    reviews_list = [get_combined_review(top_reviews) for _, top_reviews in pairs]
+    features = compute_features_batch(vectorizers, questions, reviews_list)
+    return [int(prediction) for prediction in predictions_k(model, features, 0.7)]
+
+
+if __name__ == '__main__':
+    argParser = argparse.ArgumentParser(description="Convert a pickled w2v vectorizer to the memory-mapped format")
+    argParser.add_argument("--w2v_vectorizer_file", type=str, default='../../data/w2v_vectorizer.pkl')
+
+    args = argParser.parse_args()
+    convert_w2v_vectorizer(args.w2v_vectorizer_file)
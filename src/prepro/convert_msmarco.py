@@ -1,46 +1,47 @@
 import argparse
 import json
-from tqdm import tqdm
 
+QUERY_TYPES = {
+	"descriptive": "DESCRIPTION",
+	"yesno": "YESNO",
+}
 
-def main(args):
-	wfp = open(args.output_file, 'w')
-	rfp = open(args.input_file, 'r')
 
-	for line in tqdm(rfp):
-		row = json.loads(line)
+def to_msmarco(row):
+	passages = []
+	for review in row["review_snippets"]:
+		passage = {}
+		passage["is_selected"] = 1
+		passage["url"] = ""
+		passage["passage_text"] = review
+		passages.append(passage)
 
-		if row["is_answerable"] == 1:
-			reviews = row["review_snippets"]
-			passages = []
-			for review in reviews:
-				passage = {}
-				passage["is_selected"] = 1
-				passage["url"] = ""
-				passage["passage_text"] = review
-				passages.append(passage)
+	answers = row["answers"]
 
-			answers = row["answers"]
+	final_json = {}
+	final_json["answers"] = [answer["answerText"] for answer in answers]
+	final_json["passages"] = passages
+	final_json["query"] = row["questionText"]
+	final_json["query_id"] = row["qid"]
 
-			final_json = {}
-			final_json["answers"] = [answer["answerText"] for answer in answers]
-			final_json["passages"] = passages
-			final_json["query"] = row["questionText"]
-			final_json["query_id"] = row["qid"]
-			
-			if row["questionType"] == "descriptive":
-				final_json["query_type"] = "DESCRIPTION"
-			elif row["questionType"] == "yesno":
-				final_json["query_type"] = "YESNO"
-			else:
-				print("new query_type "+ row)
-				exit(0)
+	if row["questionType"] not in QUERY_TYPES:
+		raise ValueError("new query_type %s" % row["questionType"])
+	final_json["query_type"] = QUERY_TYPES[row["questionType"]]
 
-			final_json["wellFormedAnswers"] = []
+	final_json["wellFormedAnswers"] = []
+	return final_json
 
-			wfp.write(json.dumps(final_json) + '\n')
 
-	wfp.close()
+def main(args):
+	# the conversion loop lives in convert_squad so that one pass over the input can
+	# also write the SQuAD and R-Net files; it pulls in nltk, so import it lazily
+	import convert_squad
+	convert_squad.convert(args, {
+		'squad': args.squad_file,
+		'msmarco': args.output_file,
+		'rnet_examples': args.rnet_examples_file,
+		'rnet_eval': args.rnet_eval_file,
+	})
 
 
 if __name__ == '__main__':
@@ -48,7 +49,13 @@ if __name__ == '__main__':
 	argParser = argparse.ArgumentParser(description="Convert Amazon QAR to MSMARCO format")
 	argParser.add_argument("--input_file", type=str)
 	argParser.add_argument("--output_file", type=str)
+	argParser.add_argument("--squad_file", type=str, default=None)
+	argParser.add_argument("--rnet_examples_file", type=str, default=None)
+	argParser.add_argument("--rnet_eval_file", type=str, default=None)
+	argParser.add_argument("--rnet_answers", type=str, default="answers_snippet_spans_bleu2")
+	argParser.add_argument("--span_max_num", type=int, default=5)
+	argParser.add_argument("--workers", type=int, default=1)
+	argParser.add_argument("--chunksize", type=int, default=8)
 
 	args = argParser.parse_args()
 	main(args)
-
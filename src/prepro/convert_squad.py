@@ -10,7 +10,12 @@ from evaluator.evaluator import COCOEvalCap
 from operator import itemgetter, attrgetter
 from tqdm import tqdm
 
+import convert_msmarco
+import convert_rnet
+import record_pipeline
 import retrieval_models
+import span_oracle
+from tokenization import tokenize
 from nltk.corpus import stopwords
 
 
@@ -36,19 +41,6 @@ def top_reviews_and_scores(question_tokens, review_tokens, inverted_index, revie
     return scores[:num_reviews], top_review_ids[:num_reviews]
 
 
-def tokenize(text):
-    punctuations = string.punctuation.replace("\'", '')
-
-    for ch in punctuations:
-        text = text.replace(ch, " " + ch + " ")
-
-    tokens = text.split()
-    for i, token in enumerate(tokens):
-        if not token.isupper():
-            tokens[i] = token.lower()
-    return tokens
-
-
 def get_tokens(texts, stop_words):
     text_tokens = [tokenize(r) for r in texts]
     return [[token for token in r if token not in stop_words and token not in string.punctuation] for r in text_tokens]
@@ -64,34 +56,23 @@ def find_answer_spans(args, answer_span_lens, answers, context, stop_words, ques
     sentence_tokens = list(map(set, sentence_tokens))
     inverted_index = create_inverted_index(sentence_tokens)
 
-    gold_answers_dict = {}
-    gold_answers_dict[0] = [answer["answerText"] for answer in answers]
-    answers_snippet_spans_bleu2 = []
-    answers_snippet_spans_bleu4 = []
-    answers_snippet_spans_rouge = []
+    oracle = span_oracle.SpanOracle([answer["answerText"] for answer in answers])
+    spans = []
+    bleu2_scores, bleu4_scores, rouge_scores = [], [], []
 
     for answer_span_len in answer_span_lens:
+        num_windows = len(context) - answer_span_len
+        bleu_scores = oracle.window_bleu(context, answer_span_len, num_windows)
+        bleu2_scores += [scores[1] for scores in bleu_scores]
+        bleu4_scores += [scores[3] for scores in bleu_scores]
+        rouge_scores += oracle.window_rouge(context, answer_span_len, num_windows)
+
         char_index = 0
-        for word_index in range(len(context)-answer_span_len):
-            span = ' '.join(context[word_index: word_index+answer_span_len])
-            
-            generated_answer_dict = {}
-            generated_answer_dict[0] = [span]
-            
-            scores = COCOEvalCap.compute_scores(gold_answers_dict, generated_answer_dict)
-            answers_snippet_spans_bleu2.append((scores['Bleu_2'], {
-                'answer_start': char_index,
-                'text': span
-            }))
-            answers_snippet_spans_bleu4.append((scores['Bleu_4'], {
+        for word_index in range(num_windows):
+            spans.append({
                 'answer_start': char_index,
-                'text': span
-            }))
-            answers_snippet_spans_rouge.append((scores['ROUGE_L'], {
-                'answer_start': char_index,
-                'text': span
-            }))
-
+                'text': ' '.join(context[word_index: word_index+answer_span_len])
+            })
             char_index += (len(context[word_index]) + 1)
 
     answers_sentence_ir = []
@@ -117,26 +98,23 @@ def find_answer_spans(args, answer_span_lens, answers, context, stop_words, ques
             })
 
     for sentence in context_sentences:
-        bleu_scores = COCOEvalCap.compute_scores(
-            gold_answers_dict,
-            {0: [sentence]}
-        )
+        bleu_scores = oracle.sentence_bleu(sentence)
         idx = context_text.find(sentence)
         if idx >= 0:
-            answers_sentence_bleu2.append((bleu_scores['Bleu_2'], {
+            answers_sentence_bleu2.append((bleu_scores[1], {
                 'answer_start': idx,
                 'text': sentence
             }))
-            answers_sentence_bleu4.append((bleu_scores['Bleu_4'], {
+            answers_sentence_bleu4.append((bleu_scores[3], {
                 'answer_start': idx,
                 'text': sentence
             }))
 
     answers_sentence_bleu2 = [i[1] for i in sorted(answers_sentence_bleu2, reverse=True, key=itemgetter(0))[:args.span_max_num]]
     answers_sentence_bleu4 = [i[1] for i in sorted(answers_sentence_bleu4, reverse=True, key=itemgetter(0))[:args.span_max_num]]
-    answers_snippet_spans_bleu2 = [i[1] for i in sorted(answers_snippet_spans_bleu2, reverse=True, key=itemgetter(0))[:args.span_max_num]]
-    answers_snippet_spans_bleu4 = [i[1] for i in sorted(answers_snippet_spans_bleu4, reverse=True, key=itemgetter(0))[:args.span_max_num]]
-    answers_snippet_spans_rouge = [i[1] for i in sorted(answers_snippet_spans_rouge, reverse=True, key=itemgetter(0))[:args.span_max_num]]
+    answers_snippet_spans_bleu2 = [spans[i] for i in span_oracle.top_k(bleu2_scores, args.span_max_num)]
+    answers_snippet_spans_bleu4 = [spans[i] for i in span_oracle.top_k(bleu4_scores, args.span_max_num)]
+    answers_snippet_spans_rouge = [spans[i] for i in span_oracle.top_k(rouge_scores, args.span_max_num)]
 
     return answers_snippet_spans_bleu2, answers_snippet_spans_bleu4, answers_snippet_spans_rouge, answers_sentence_ir, answers_sentence_bleu2, answers_sentence_bleu4
 
@@ -155,48 +133,94 @@ def create_inverted_index(review_tokens):
     return term_dict
 
 
-def main(args):
-    stop_words = set(stopwords.words('english'))
+def to_squad(args, row, stop_words):
     answer_span_lens = [10, 20]
-    
-    wfp = open(args.output_file, 'w')
-    rfp = open(args.input_file, 'r')
 
-    for line in tqdm(rfp):
-        row = json.loads(line)
+    reviews = row["review_snippets"]
+    context = ' '.join(' '.join(reviews).split())
+
+    answers = row["answers"]
 
-        #if row["questionType"] == "yesno":
-        #   continue
+    question_text = row["questionText"]
+    question_tokens = tokenize(question_text)
 
-        if row["is_answerable"] == 1:
-            reviews = row["review_snippets"]
-            context = ' '.join(' '.join(reviews).split())
+    answers_snippet_spans_bleu2, answers_snippet_spans_bleu4, answers_snippet_spans_rouge, answers_sentence_ir, answers_sentence_bleu2, answers_sentence_bleu4 = find_answer_spans(args, answer_span_lens, answers, context, stop_words, question_tokens)
 
-            answers = row["answers"]
+    qas = [{
+        'id': row["qid"],
+        'is_impossible': False,
+        'question': row["questionText"],
+        'answers_snippet_spans_bleu2': answers_snippet_spans_bleu2,
+        'answers_snippet_spans_bleu4': answers_snippet_spans_bleu4,
+        'answers_snippet_spans_rouge': answers_snippet_spans_rouge,
+        'answers_sentence_ir': answers_sentence_ir,
+        'answers_sentence_bleu2': answers_sentence_bleu2,
+        'answers_sentence_bleu4': answers_sentence_bleu4,
+        'human_answers': [answer["answerText"] for answer in answers],
+    }]
 
-            question_text = row["questionText"]
-            question_tokens = tokenize(question_text)
+    return {
+        'context': context,
+        'qas': qas,
+    }
 
-            answers_snippet_spans_bleu2, answers_snippet_spans_bleu4, answers_snippet_spans_rouge, answers_sentence_ir, answers_sentence_bleu2, answers_sentence_bleu4 = find_answer_spans(args, answer_span_lens, answers, context, stop_words, question_tokens)
 
-            qas = [{
-                'id': row["qid"],
-                'is_impossible': False,
-                'question': row["questionText"],
-                'answers_snippet_spans_bleu2': answers_snippet_spans_bleu2,
-                'answers_snippet_spans_bleu4': answers_snippet_spans_bleu4,
-                'answers_snippet_spans_rouge': answers_snippet_spans_rouge,
-                'answers_sentence_ir': answers_sentence_ir,
-                'answers_sentence_bleu2': answers_sentence_bleu2,
-                'answers_sentence_bleu4': answers_sentence_bleu4,
-                'human_answers': [answer["answerText"] for answer in answers],
-            }]
+# per-process state, filled by init_worker
+_worker = {}
 
-            wfp.write(json.dumps({
-                'context': context,
-                'qas': qas,
-            }) + '\n')
-    wfp.close()
+
+def init_worker(args, formats):
+    _worker['args'] = args
+    _worker['formats'] = formats
+    _worker['stop_words'] = set(stopwords.words('english'))
+
+
+def process_record(record):
+    record_idx, line = record
+    row = json.loads(line)
+    formats = _worker['formats']
+
+    #if row["questionType"] == "yesno":
+    #   continue
+
+    outputs = {}
+    if row["is_answerable"] != 1:
+        return outputs
+
+    if 'msmarco' in formats:
+        outputs['msmarco'] = [convert_msmarco.to_msmarco(row)]
+
+    if formats & {'squad', 'rnet_examples', 'rnet_eval'}:
+        paragraph = to_squad(_worker['args'], row, _worker['stop_words'])
+        outputs['squad'] = [paragraph]
+        if formats & {'rnet_examples', 'rnet_eval'}:
+            outputs['rnet_examples'], outputs['rnet_eval'] = convert_rnet.to_rnet(paragraph, record_idx, _worker['args'].rnet_answers)
+    return outputs
+
+
+def convert(args, output_files):
+    # one pass over the QAR file writes every format that has an output file
+    with record_pipeline.RecordWriter(output_files) as writer:
+        results = record_pipeline.map_ordered(
+            process_record,
+            record_pipeline.read_records(args.input_file),
+            args.workers,
+            args.chunksize,
+            initializer=init_worker,
+            initargs=(args, writer.formats())
+        )
+        for outputs in tqdm(results):
+            writer.write(outputs)
+    print("Written: %s" % writer.counts)
+
+
+def main(args):
+    convert(args, {
+        'squad': args.output_file,
+        'msmarco': args.msmarco_file,
+        'rnet_examples': args.rnet_examples_file,
+        'rnet_eval': args.rnet_eval_file,
+    })
 
 
 if __name__ == '__main__':
@@ -204,9 +228,14 @@ if __name__ == '__main__':
     argParser = argparse.ArgumentParser(description="Convert Amazon QAR to Squad format")
     argParser.add_argument("--input_file", type=str)
     argParser.add_argument("--output_file", type=str)
+    argParser.add_argument("--msmarco_file", type=str, default=None)
+    argParser.add_argument("--rnet_examples_file", type=str, default=None)
+    argParser.add_argument("--rnet_eval_file", type=str, default=None)
+    argParser.add_argument("--rnet_answers", type=str, default="answers_snippet_spans_bleu2")
     argParser.add_argument("--span_max_num", type=int, default=5)
     argParser.add_argument("--evaluation_metric", type=str, default="Bleu_2")
+    argParser.add_argument("--workers", type=int, default=1)
+    argParser.add_argument("--chunksize", type=int, default=8)
 
     args = argParser.parse_args()
     main(args)
-
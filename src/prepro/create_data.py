@@ -1,7 +1,9 @@
 import argparse
 import string
-import math
 import json
+import os
+import threading
+import multiprocessing
 import numpy as np
 import numpy.random as random
 
@@ -12,44 +14,100 @@ from nltk.corpus import stopwords
 from tqdm import tqdm
 
 import retrieval_models
+from tokenization import tokenize
 import classify_question
 from classify_question import MeanEmbeddingVectorizer
 
 np.random.seed(0)
 
+WILSON_CONFIDENCE = 0.98
+WILSON_Z = st.norm.ppf(1 - (1 - WILSON_CONFIDENCE) / 2)
 
-def top_reviews_and_scores(question_tokens, review_tokens, inverted_index, reviews, review_ids, select_mode, num_reviews):
-    if select_mode == "random":
-        scores = list(random.uniform(size=len(reviews)))
-    elif select_mode in ["bm25", "indri"]:
-        scores = retrieval_models.retrieval_model_scores(question_tokens, review_tokens, inverted_index, select_mode)
-    elif select_mode == 'wilson':
-        scores = []
-        for r in range(len(reviews)):
-            counts = reviews[r]['helpful']
-            helpful_count = int(counts[0])
-            unhelpful_count = int(counts[1]) - helpful_count
-            scores.append(_wilson_score(helpful_count, unhelpful_count))
-    elif select_mode == 'helpful':
-        scores = [r['helpful'] for r in reviews]
+
+def _top_k_indices(scores, num_reviews):
+    # indices of the num_reviews highest scores, best first; ties go to the earlier review
+    n = len(scores)
+    if num_reviews is None:
+        num_reviews = n
+    if num_reviews <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if num_reviews < n:
+        kth_score = np.partition(scores, n - num_reviews)[n - num_reviews]
+        candidates = np.flatnonzero(scores >= kth_score)
     else:
-        raise 'Unimplemented Review Select Mode'
+        candidates = np.arange(n)
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order][:num_reviews]
+
+
+def _top_k(scores, review_ids, num_reviews):
+    scores = np.asarray(scores, dtype=np.float64)
+    if len(scores) == 0:
+        return (), ()
+    top = _top_k_indices(scores, num_reviews)
+    return tuple(scores[top].tolist()), tuple(review_ids[i] for i in top)
+
+
+def _helpful_counts(reviews):
+    return np.array([[int(review['helpful'][0]), int(review['helpful'][1])] for review in reviews], dtype=np.float64).reshape(-1, 2)
+
+
+def helpful_scores(reviews):
+    # orders reviews by (helpful votes, total votes), like comparing the 'helpful' lists
+    counts = _helpful_counts(reviews)
+    return counts[:, 0] * (counts[:, 1].max(initial=0) + 1) + counts[:, 1]
+
+
+def wilson_scores(reviews):
+    # lower bound of the Wilson score interval for every review at once; 0 without votes
+    counts = _helpful_counts(reviews)
+    n = counts[:, 1]
+    voted = n > 0
+    n = np.where(voted, n, 1)
+    phat = counts[:, 0] / n
+    z2 = WILSON_Z * WILSON_Z
+    scores = (phat + z2/(2*n) - WILSON_Z * np.sqrt((phat*(1-phat)+z2/(4*n))/n))/(1+z2/n)
+    return np.where(voted, scores, 0.0)
+
+
+class ProductRetrievalContext(object):
+    # Everything about a product that does not depend on the question: the review and
+    # sentence retrieval engines, the helpful/wilson rankings and the random sentence pool.
+    # Built once per product and queried for every question in row["questions"].
+
+    def __init__(self, reviews, review_max_len, stop_words, select_mode, select_num, rng=random):
+        self.select_mode = select_mode
+        self.select_num = select_num
+        self.rng = rng
+
+        review_texts, review_tokens, all_sentences, sentence_tokens = process_reviews(reviews, review_max_len, stop_words)
+        self.review_texts = review_texts
+        self.sentences = all_sentences
+
+        self.review_engine = retrieval_models.RetrievalEngine(create_inverted_index(review_tokens), list(map(set, review_tokens)))
+        self.sentence_engine = retrieval_models.RetrievalEngine(create_inverted_index(sentence_tokens), list(map(set, sentence_tokens)))
 
-    scores, top_review_ids = zip(*sorted(list(zip(scores, review_ids)), reverse=True)) if len(scores) > 0 else ([], [])
-    return scores[:num_reviews], top_review_ids[:num_reviews]
+        review_ids = [review["reviewText"] for review in reviews]
+        self.wilson_scores = wilson_scores(reviews)
+        self.helpful_scores = helpful_scores(reviews)
+        _, self.top_reviews_helpful = _top_k(self.helpful_scores, review_ids, 1)
+        _, self.top_reviews_wilson = _top_k(self.wilson_scores, review_ids, 1)
 
+    def _top(self, engine, texts, question_tokens):
+        if self.select_mode == "random":
+            scores = list(self.rng.uniform(size=len(texts)))
+        else:
+            scores = engine.scores(question_tokens, self.select_mode).tolist()
+        return _top_k(scores, texts, self.select_num)
 
-def tokenize(text):
-    punctuations = string.punctuation.replace("\'", '')
+    def top_reviews(self, question_tokens):
+        return self._top(self.review_engine, self.review_texts, question_tokens)
 
-    for ch in punctuations:
-        text = text.replace(ch, " " + ch + " ")
+    def top_sentences(self, question_tokens):
+        return self._top(self.sentence_engine, self.sentences, question_tokens)
 
-    tokens = text.split()
-    for i, token in enumerate(tokens):
-        if not token.isupper():
-            tokens[i] = token.lower()
-    return tokens
+    def random_sentence(self):
+        return _top_k(list(self.rng.uniform(size=len(self.sentences))), self.sentences, 1)
 
 
 def process_reviews(reviews, review_max_len, stop_words):
@@ -96,92 +154,149 @@ def create_inverted_index(review_tokens):
     return term_dict
 
 
-def main(args):
-    stop_words = set(stopwords.words('english'))
-    answer_span_lens = range(2, 10)
+# per-process state, loaded once by init_worker
+_worker = {}
+
+
+def init_worker(args):
+    _worker['args'] = args
+    _worker['stop_words'] = set(stopwords.words('english'))
+    _worker['classifier_model_answerable'] = classify_question.load_classification_model('../../data/model_answerable.pkl')
+    #_worker['classifier_model_suggestive'] = classify_question.load_classification_model('../../data/model_suggestive.pkl')
+    _worker['classifier_vectorizers'] = classify_question.load_vectorizers('../../data/tfidf_vectorizer.pkl', '../../data/w2v_vectorizer.pkl')
+
+
+def product_rng(seed, offset):
+    # seeded by the product's byte offset so random_sentence does not depend on
+    # the number of workers or on where a resumed run started
+    return np.random.RandomState([seed, offset % 2**32, offset // 2**32])
+
+
+def process_product(item):
+    offset, end_offset, line = item
+    args = _worker['args']
+    classifier_model_answerable = _worker['classifier_model_answerable']
+    classifier_vectorizers = _worker['classifier_vectorizers']
 
-    wfp = open(args.output_file, 'w')
-    rfp = open(args.input_file, 'r')
+    row = json.loads(line)
+    if "reviews" not in row:
+        raise ValueError("Wrong Format at offset %d: %s" % (offset, row))
 
-    classifier_model_answerable = classify_question.load_classification_model('../../data/model_answerable.pkl')
-    #classifier_model_suggestive = classify_question.load_classification_model('../../data/model_suggestive.pkl')
-    classifier_vectorizers = classify_question.load_vectorizers('../../data/tfidf_vectorizer.pkl', '../../data/w2v_vectorizer.pkl')
+    reviews = row["reviews"]
+    if len(reviews) == 0:
+        print("Zero Reviews", row)
+        return end_offset, []
 
-    for line in tqdm(rfp):
-        row = json.loads(line)
-        if "reviews" not in row:
-            print("Wrong Format" + row)
-            exit(0)
+    context = ProductRetrievalContext(
+        reviews, args.review_max_len, _worker['stop_words'],
+        args.review_select_mode, args.review_select_num,
+        rng=product_rng(args.seed, offset)
+    )
 
-        reviews = row["reviews"]
-        if len(reviews) == 0:
-            print("Zero Reviews", row)
+    output_jsons = []
+    for question in row["questions"]:
+        question_text = question["questionText"]
+        question_tokens = set(tokenize(question_text))
+
+        scores_q, top_reviews_q = context.top_reviews(question_tokens)
+        top_reviews_helpful = context.top_reviews_helpful
+        top_reviews_wilson = context.top_reviews_wilson
+        _, top_sentences_ir = context.top_sentences(question_tokens)
+        _, top_sentences_random = context.random_sentence()
+
+        if len(top_reviews_q) == 0:
+            print("Zero Top Reviews", row)
             continue
 
-        review_texts, review_tokens, all_sentences, sentence_tokens = process_reviews(reviews, args.review_max_len, stop_words)
-
-        inverted_index = create_inverted_index(review_tokens)
-        review_tokens = list(map(set, review_tokens))
-        sentence_tokens = list(map(set, sentence_tokens))
-
-        for question in row["questions"]:
-            question_text = question["questionText"]
-            question_tokens = tokenize(question_text)
-
-            scores_q, top_reviews_q = top_reviews_and_scores(
-                set(question_tokens),
-                review_tokens,
-                inverted_index,
-                None,
-                review_texts,
-                args.review_select_mode,
-                args.review_select_num
-            )
-
-            _, top_reviews_helpful = top_reviews_and_scores(None, None, None, reviews, [review["reviewText"] for review in reviews], 'helpful', 1)
-            _, top_reviews_wilson = top_reviews_and_scores(None, None, None, reviews, [review["reviewText"] for review in reviews], 'wilson', 1)
-
-            _, top_sentences_ir = top_reviews_and_scores(
-                set(question_tokens),
-                sentence_tokens,
-                inverted_index,
-                all_sentences,
-                all_sentences,
-                args.review_select_mode,
-                args.review_select_num
-            )
-            _, top_sentences_random = top_reviews_and_scores(None, None, None, all_sentences, all_sentences, 'random', 1)
-
-            if len(top_reviews_q) == 0:
-                print("Zero Top Reviews", row)
-                continue
-
-            final_json = {}
-            final_json['asin'] = row['asin']
-            final_json['category'] = row['category']
-            final_json['questionText'] = question_text
-            final_json['questionType'] = question["questionType"]
-            final_json['review_snippets'] = top_reviews_q
-            final_json['random_sentence'] = top_sentences_random
-            final_json['top_sentences_IR'] = top_sentences_ir
-            final_json['top_review_wilson'] = top_reviews_wilson
-            final_json['top_review_helpful'] = top_reviews_helpful
-            final_json['answers'] = question["answers"]
-            final_json['is_answerable'] = classify_question.is_answerable(classifier_model_answerable, classifier_vectorizers, question_text, top_reviews_q)
-            #final_json['is_suggestive'] = 0 if (final_json['is_answerable'] == 0) else classify_question.is_suggestive(classifier_model_suggestive, classifier_vectorizers, question_text, top_reviews_q)
-            #print(final_json)
-            wfp.write(json.dumps(final_json) + '\n')
-    wfp.close()
+        final_json = {}
+        final_json['asin'] = row['asin']
+        final_json['category'] = row['category']
+        final_json['questionText'] = question_text
+        final_json['questionType'] = question["questionType"]
+        final_json['review_snippets'] = top_reviews_q
+        final_json['random_sentence'] = top_sentences_random
+        final_json['top_sentences_IR'] = top_sentences_ir
+        final_json['top_review_wilson'] = top_reviews_wilson
+        final_json['top_review_helpful'] = top_reviews_helpful
+        final_json['answers'] = question["answers"]
+        #final_json['is_suggestive'] = 0 if (final_json['is_answerable'] == 0) else classify_question.is_suggestive(classifier_model_suggestive, classifier_vectorizers, question_text, top_reviews_q)
+        output_jsons.append(final_json)
+
+    # answerability for all questions of the product in one classifier call
+    is_answerable = classify_question.is_answerable_batch(
+        classifier_model_answerable, classifier_vectorizers,
+        [(final_json['questionText'], final_json['review_snippets']) for final_json in output_jsons]
+    )
+    output_lines = []
+    for final_json, answerable in zip(output_jsons, is_answerable):
+        final_json['is_answerable'] = answerable
+        output_lines.append(json.dumps(final_json) + '\n')
+    return end_offset, output_lines
+
+
+def read_products(input_file, start_offset, in_flight):
+    # yields (offset, end_offset, line); in_flight bounds how far reading runs ahead of writing
+    with open(input_file, 'rb') as rfp:
+        rfp.seek(start_offset)
+        offset = start_offset
+        for line in rfp:
+            in_flight.acquire()
+            yield offset, offset + len(line), line
+            offset += len(line)
+
+
+def read_checkpoint(checkpoint_file):
+    if not os.path.exists(checkpoint_file):
+        return 0, 0
+    with open(checkpoint_file, 'r') as fp:
+        input_offset, output_offset = map(int, fp.read().split())
+    return input_offset, output_offset
+
+
+def write_checkpoint(checkpoint_file, input_offset, output_offset):
+    with open(checkpoint_file + '.tmp', 'w') as fp:
+        fp.write('%d %d\n' % (input_offset, output_offset))
+    os.replace(checkpoint_file + '.tmp', checkpoint_file)
 
-def _wilson_score(positive, negative):
-    confidence = 0.98
-    n = positive + negative
-    if n == 0:
-        return 0.0
-    phat = (1.0 * positive) / n
-    z = st.norm.ppf(1 - (1 - confidence) / 2)
-    return (phat + z*z/(2*n) - z * math.sqrt((phat*(1-phat)+z*z/(4*n))/n))/(1+z*z/n)
 
+def main(args):
+    # the checkpoint records the input offset of the next unprocessed product and
+    # the output size at that point, so a resumed run drops any partially written tail
+    checkpoint_file = args.output_file + '.checkpoint'
+    start_offset, output_offset = 0, 0
+    if args.resume:
+        start_offset, output_offset = read_checkpoint(checkpoint_file)
+    elif args.start_offset > 0:
+        start_offset = args.start_offset
+
+    wfp = open(args.output_file, 'r+b' if output_offset > 0 else 'wb')
+    wfp.seek(output_offset)
+    wfp.truncate()
+
+    in_flight = threading.BoundedSemaphore(max(1, args.workers) * args.chunksize * 4)
+    products = read_products(args.input_file, start_offset, in_flight)
+    if args.workers > 1:
+        pool = multiprocessing.Pool(args.workers, initializer=init_worker, initargs=(args,))
+        results = pool.imap(process_product, products, chunksize=args.chunksize)
+    else:
+        pool = None
+        init_worker(args)
+        results = map(process_product, products)
+
+    for n_products, (end_offset, output_lines) in enumerate(tqdm(results), 1):
+        in_flight.release()
+        for output_line in output_lines:
+            wfp.write(output_line.encode('utf-8'))
+        if n_products % args.checkpoint_every == 0:
+            wfp.flush()
+            write_checkpoint(checkpoint_file, end_offset, wfp.tell())
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    wfp.close()
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
 
 if __name__ == '__main__':
     # parse arguments
@@ -191,6 +306,12 @@ if __name__ == '__main__':
     argParser.add_argument("--review_select_mode", type=str)
     argParser.add_argument("--review_select_num", type=int)
     argParser.add_argument("--review_max_len", type=int, default=100)
+    argParser.add_argument("--workers", type=int, default=1)
+    argParser.add_argument("--chunksize", type=int, default=8)
+    argParser.add_argument("--seed", type=int, default=0)
+    argParser.add_argument("--checkpoint_every", type=int, default=100)
+    argParser.add_argument("--start_offset", type=int, default=0)
+    argParser.add_argument("--resume", action="store_true")
 
     args = argParser.parse_args()
     main(args)
@@ -0,0 +1,180 @@
+import argparse
+import ast
+import gzip
+import io
+import itertools
+import json
+import re
+import shutil
+import subprocess
+import time
+
+# The raw Amazon QA/review dumps hold one Python dict literal per line. Lines are parsed
+# with json.loads when they already are JSON, then by translating the Python literal to
+# JSON, and only then with ast.literal_eval. Nothing is ever passed to eval.
+
+BUFFER_SIZE = 16 * 1024 * 1024
+
+_LITERAL_RE = re.compile(r"""[uU]?'(?:[^'\\]|\\.)*'|[uU]?"(?:[^"\\]|\\.)*"|\bTrue\b|\bFalse\b|\bNone\b""", re.S)
+_BODY_RE = re.compile(r'\\(x[0-9a-fA-F]{2}|.)|"', re.S)
+_KEYWORDS = {'True': 'true', 'False': 'false', 'None': 'null'}
+# python escapes that mean the same in JSON; anything else falls back to ast.literal_eval
+_JSON_ESCAPES = set('\\"bfnrtu')
+
+
+def _translate_body(match):
+    escape = match.group(1)
+    if escape is None:
+        # a bare double quote inside a single-quoted string
+        return '\\"'
+    if escape[0] == 'x' and len(escape) == 3:
+        return '\\u00' + escape[1:]
+    if escape == "'":
+        return "'"
+    if escape in _JSON_ESCAPES:
+        return match.group(0)
+    raise ValueError('Untranslatable escape: \\%s' % escape)
+
+
+def _translate_token(match):
+    token = match.group(0)
+    if token in _KEYWORDS:
+        return _KEYWORDS[token]
+
+    if token[0] in 'uU':
+        token = token[1:]
+    body = token[1:-1]
+    if '\\' in body or '"' in body:
+        body = _BODY_RE.sub(_translate_body, body)
+    return '"' + body + '"'
+
+
+def literal_to_json(text):
+    if '"' in text or '\\' in text:
+        return _LITERAL_RE.sub(_translate_token, text)
+
+    # no escapes and no double-quoted strings: every single quote delimits a string,
+    # so the even pieces are exactly the text outside strings
+    pieces = text.split("'")
+    for i in range(0, len(pieces), 2):
+        piece = pieces[i]
+        if piece.endswith(('u', 'U')):
+            piece = piece[:-1]
+        pieces[i] = piece.replace('True', 'true').replace('False', 'false').replace('None', 'null')
+    return '"'.join(pieces)
+
+
+def parse_line(line):
+    if isinstance(line, bytes):
+        line = line.decode('utf-8')
+    try:
+        return json.loads(line)
+    except ValueError:
+        pass
+    try:
+        return json.loads(literal_to_json(line))
+    except ValueError:
+        return ast.literal_eval(line)
+
+
+class PigzReader(object):
+    # lines of a file decompressed by a pigz process. Like the gzip fallback, it
+    # raises when the file turns out to be corrupt or truncated: the exit status of
+    # pigz is checked at EOF. Closing before EOF stops and reaps the process.
+    def __init__(self, path, buffer_size=BUFFER_SIZE):
+        self.path = path
+        self.process = subprocess.Popen(['pigz', '-dc', path], stdout=subprocess.PIPE, bufsize=buffer_size)
+
+    def __iter__(self):
+        # the last line is held back until the exit status is known, so that the
+        # cut-off line of a truncated file is never handed out
+        last = None
+        for line in self.process.stdout:
+            if last is not None:
+                yield last
+            last = line
+        self._check()
+        if last is not None:
+            yield last
+
+    def _check(self):
+        returncode = self.process.wait()
+        if returncode != 0:
+            raise IOError('pigz failed on %s with exit code %d' % (self.path, returncode))
+
+    def close(self):
+        self.process.stdout.close()
+        if self.process.poll() is None:
+            self.process.terminate()
+        self.process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_dump(path, buffer_size=BUFFER_SIZE, use_pigz=True):
+    # decompresses through pigz in a separate process when it is installed
+    if use_pigz and path.endswith('.gz') and shutil.which('pigz') is not None:
+        return PigzReader(path, buffer_size)
+    if path.endswith('.gz'):
+        return io.BufferedReader(gzip.open(path, 'rb'), buffer_size=buffer_size)
+    return open(path, 'rb', buffering=buffer_size)
+
+
+class ParseStats(object):
+    def __init__(self):
+        self.lines = 0
+        self.bytes = 0
+        self.start = time.time()
+
+    def report(self):
+        elapsed = max(time.time() - self.start, 1e-9)
+        return '%d lines, %.1f MB in %.1fs (%.0f lines/s, %.1f MB/s)' % (
+            self.lines, self.bytes / 1e6, elapsed, self.lines / elapsed, self.bytes / 1e6 / elapsed
+        )
+
+
+def parse(path, stats=None, buffer_size=BUFFER_SIZE, use_pigz=True):
+    fp = open_dump(path, buffer_size, use_pigz)
+    try:
+        for line in fp:
+            if stats is not None:
+                stats.lines += 1
+                stats.bytes += len(line)
+            yield parse_line(line)
+    finally:
+        fp.close()
+
+
+def benchmark(path, num_lines):
+    with open_dump(path) as fp:
+        lines = list(itertools.islice(fp, num_lines))
+    n_bytes = sum(len(line) for line in lines)
+
+    def run(name, parse_fn):
+        start = time.time()
+        parsed = [parse_fn(line) for line in lines]
+        elapsed = max(time.time() - start, 1e-9)
+        print('%-16s %.0f lines/s, %.1f MB/s' % (name, len(lines) / elapsed, n_bytes / 1e6 / elapsed))
+        return parsed
+
+    expected = run('eval', eval)
+    run('ast.literal_eval', lambda line: ast.literal_eval(line.decode('utf-8')))
+    assert run('parse_line', parse_line) == expected
+
+    stats = ParseStats()
+    for _ in parse(path, stats):
+        pass
+    print('full file: %s' % stats.report())
+
+
+if __name__ == '__main__':
+    argParser = argparse.ArgumentParser(description="Benchmark the raw dump parser against eval")
+    argParser.add_argument("--input_file", type=str)
+    argParser.add_argument("--num_lines", type=int, default=100000)
+
+    args = argParser.parse_args()
+    benchmark(args.input_file, args.num_lines)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+# vectorized_bleu.py
+#
+# Corpus and per sentence BLEU of integer encoded corpora with NumPy, with the same
+# scores as BleuScorer.compute_score(option='closest').
+#
+# Instead of cooking every sentence into a dict of n-gram tuples, all sentences are
+# concatenated into one flat array of word ids:
+#   - the n-grams of order k are numbered with dense int64 ids, by extending the ids
+#     of the (k-1)-grams with the next word, in one pass over all positions
+#   - hypothesis counts and reference max counts are keyed by segment * G + n-gram
+#     id, and counted with np.unique on sorted arrays
+#   - clipped counts come from intersecting the sorted hypothesis keys with the
+#     sorted reference keys with np.searchsorted
+
+import itertools
+import math
+
+import numpy as np
+
+
+def encode(sentences, vocab):
+    '''Takes a list of sentences as strings and returns the word ids of all their
+    words in one flat int64 array, and the number of words of every sentence. Words
+    are split on whitespace as in precook(), new words are added to vocab.'''
+    sentences = [sentence.split() for sentence in sentences]
+    lengths = np.array([len(words) for words in sentences], dtype=np.int64)
+    words = list(itertools.chain.from_iterable(sentences))
+    for word in set(words).difference(vocab):
+        vocab[word] = len(vocab)
+    ids = list(map(vocab.__getitem__, words))
+    return np.array(ids, dtype=np.int64), lengths
+
+
+def corpus_bleu(hyp_ids, hyp_lengths, ref_ids, ref_lengths, ref_segments, n=4):
+    '''Computes BLEU-1..n of a corpus of segments, with one hypothesis and one or
+    more references each.
+
+    hyp_ids, hyp_lengths    word ids and lengths of the hypotheses, one per segment
+    ref_ids, ref_lengths    word ids and lengths of all references
+    ref_segments            the segment of every reference
+
+    Returns (bleus, sentence_bleus): the n corpus scores as floats, and an [n, S]
+    array of the scores of every segment.'''
+    hyp_lengths = np.asarray(hyp_lengths, dtype=np.int64)
+    ref_lengths = np.asarray(ref_lengths, dtype=np.int64)
+    ref_segments = np.asarray(ref_segments, dtype=np.int64)
+    num_segments = len(hyp_lengths)
+
+    testlen = hyp_lengths
+    reflen = _closest_reflen(testlen, ref_lengths, ref_segments)
+    guess = np.maximum(0, testlen[None, :] - np.arange(n)[:, None])
+    correct = _clipped_counts(hyp_ids, hyp_lengths, ref_ids, ref_lengths, ref_segments, n)
+
+    small = 1e-9
+    tiny = 1e-15 ## so that if guess is 0 still return 0
+
+    # per segment scores, in the order of operations of BleuScorer.compute_score.
+    # Roots and brevity penalties are taken with Python's pow and math.exp, as the
+    # SIMD loops of np.power and np.exp may round the last bit differently.
+    sentence_bleus = np.zeros((n, num_segments))
+    bleu = np.ones(num_segments)
+    for k in range(n):
+        bleu = bleu * ((correct[k].astype(np.float64) + tiny) / (guess[k].astype(np.float64) + small))
+        root = 1. / (k + 1)
+        sentence_bleus[k] = [value ** root for value in bleu.tolist()]
+    ratio = (testlen + tiny) / (reflen + small) ## N.B.: avoid zero division
+    short = np.nonzero(ratio < 1)[0]
+    sentence_bleus[:, short] *= [math.exp(1 - 1 / value) for value in ratio[short].tolist()]
+
+    # corpus scores from the summed counts
+    total_testlen, total_reflen = int(testlen.sum()), int(reflen.sum())
+    bleus = []
+    bleu = 1.
+    for k in range(n):
+        bleu *= float(int(correct[k].sum()) + tiny) / (int(guess[k].sum()) + small)
+        bleus.append(bleu ** (1. / (k + 1)))
+    ratio = (total_testlen + tiny) / (total_reflen + small)
+    if ratio < 1:
+        for k in range(n):
+            bleus[k] *= math.exp(1 - 1 / ratio)
+
+    return bleus, sentence_bleus
+
+
+def _closest_reflen(testlen, ref_lengths, ref_segments):
+    # the reference length closest to the hypothesis length of every segment, the
+    # shorter one on ties
+    assert len(np.unique(ref_segments)) == len(testlen), 'every segment needs a reference'
+    diff = np.abs(ref_lengths - testlen[ref_segments])
+    order = np.lexsort((ref_lengths, diff, ref_segments))
+    _, first = np.unique(ref_segments[order], return_index=True)
+    return ref_lengths[order[first]]
+
+
+def _clipped_counts(hyp_ids, hyp_lengths, ref_ids, ref_lengths, ref_segments, n):
+    # [n, S] sums over the n-grams of every hypothesis of min(count, max count in a
+    # reference of its segment)
+    num_segments = len(hyp_lengths)
+    lengths = np.concatenate([hyp_lengths, ref_lengths])
+    # sentences [0, S) are the hypotheses, followed by the references
+    sentence_segments = np.concatenate([np.arange(num_segments, dtype=np.int64), ref_segments])
+    words = np.concatenate([np.asarray(hyp_ids, dtype=np.int64), np.asarray(ref_ids, dtype=np.int64)])
+    num_words = len(words)
+
+    sentences = np.repeat(np.arange(len(lengths)), lengths)
+    starts = np.cumsum(lengths) - lengths
+    # words from every position to the end of its sentence
+    remaining = lengths[sentences] - (np.arange(num_words) - starts[sentences])
+
+    # n-gram ids and word ids are below num_words + 1, so keys do not collide
+    G = num_words + 1
+    words = np.unique(words, return_inverse=True)[1].reshape(-1).astype(np.int64)
+    grams = words
+    correct = np.zeros((n, num_segments), dtype=np.int64)
+    for k in range(1, n + 1):
+        positions = np.nonzero(remaining >= k)[0]
+        if k > 1:
+            # a k-gram is the (k-1)-gram at its position followed by the next word
+            extended = grams[positions] * G + words[positions + k - 1]
+            grams = np.full(num_words, -1, dtype=np.int64)
+            grams[positions] = np.unique(extended, return_inverse=True)[1].reshape(-1)
+
+        sentence = sentences[positions]
+        is_hyp = sentence < num_segments
+        hyp_keys, hyp_counts = np.unique(sentence[is_hyp] * G + grams[positions[is_hyp]], return_counts=True)
+
+        # counts of every reference, then their maximum over the references of a segment
+        ref_keys, ref_counts = np.unique(sentence[~is_hyp] * G + grams[positions[~is_hyp]], return_counts=True)
+        ref_keys = sentence_segments[ref_keys // G] * G + ref_keys % G
+        order = np.argsort(ref_keys, kind='mergesort')
+        ref_keys, first = np.unique(ref_keys[order], return_index=True)
+        ref_maxcounts = np.maximum.reduceat(ref_counts[order], first)
+
+        # intersection of the sorted hypothesis and reference keys; a sentinel key
+        # past all others keeps searchsorted in bounds
+        ref_keys = np.append(ref_keys, np.iinfo(np.int64).max)
+        ref_maxcounts = np.append(ref_maxcounts, 0)
+        found = np.searchsorted(ref_keys, hyp_keys)
+        clipped = np.where(ref_keys[found] == hyp_keys, np.minimum(hyp_counts, ref_maxcounts[found]), 0)
+        correct[k - 1] = np.bincount(hyp_keys // G, weights=clipped, minlength=num_segments).astype(np.int64)
+    return correct
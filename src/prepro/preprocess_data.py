@@ -1,15 +1,19 @@
+import os
 import json
-import gzip
+import sqlite3
 import wget
 import argparse
 from tqdm import tqdm
 import pandas as pd
 
+import dump_parser
+
 
 def parse(path):
-	g = gzip.open(path, 'r')
-	for l in tqdm(g):
-		yield eval(l)
+	stats = dump_parser.ParseStats()
+	for d in tqdm(dump_parser.parse(path, stats)):
+		yield d
+	print(path, stats.report())
 
 
 def getDF(path):
@@ -105,6 +109,61 @@ def clean_review_data(data_dir, category):
 	return review_df
 
 
+STORE_BATCH_SIZE = 10000
+
+
+def build_review_store(data_dir, category, store_path):
+	# spills cleaned reviews into an asin-indexed sqlite table so the join never
+	# holds a whole category in memory
+	input_path = "%s/reviews_%s.json.gz" % (data_dir, category)
+	if os.path.exists(store_path):
+		os.remove(store_path)
+
+	conn = sqlite3.connect(store_path)
+	conn.execute('PRAGMA journal_mode = OFF')
+	conn.execute('PRAGMA synchronous = OFF')
+	conn.execute('CREATE TABLE reviews (asin TEXT, review TEXT)')
+
+	batch = []
+	for review in parse(input_path):
+		batch.append((review['asin'], json.dumps(clean_review(review))))
+		if len(batch) >= STORE_BATCH_SIZE:
+			conn.executemany('INSERT INTO reviews VALUES (?, ?)', batch)
+			batch = []
+	if len(batch) > 0:
+		conn.executemany('INSERT INTO reviews VALUES (?, ?)', batch)
+
+	conn.execute('CREATE INDEX reviews_asin ON reviews (asin)')
+	conn.commit()
+	return conn
+
+
+def stream_qar_products(data_dir, category, conn):
+	# same rows, in the same order, as the pd.merge of clean_qa_data and clean_review_data
+	input_path = "%s/QA_%s.json.gz" % (data_dir, category)
+	for qa in parse(input_path):
+		rows = conn.execute('SELECT review FROM reviews WHERE asin = ? ORDER BY rowid', (qa['asin'],)).fetchall()
+		if len(rows) == 0:
+			continue
+
+		j = {}
+		j['asin'] = qa['asin']
+		j['questions'] = clean_questions(qa['questions'])
+		j['reviews'] = [json.loads(review) for (review,) in rows]
+		j['category'] = category
+		yield j
+
+
+def write_streaming(data_dir, category, output_path):
+	store_path = "%s/reviews_%s.sqlite" % (data_dir, category)
+	conn = build_review_store(data_dir, category, store_path)
+	with open(output_path, 'w') as fp:
+		for j in stream_qar_products(data_dir, category, conn):
+			fp.write(json.dumps(j) + "\n")
+	conn.close()
+	os.remove(store_path)
+
+
 def main(args):
 	data_dir, category, download = args.data_dir, args.category, args.download
 	
@@ -115,13 +174,16 @@ def main(args):
 		review_url_prefix = 'http://snap.stanford.edu/data/amazon/productGraph/categoryFiles/reviews_'
 		download_data(data_dir, category, review_url_prefix)
 
+	output_path =  "%s/qar_products_%s.jsonl" % (data_dir, category)
+	if args.streaming == 1:
+		write_streaming(data_dir, category, output_path)
+		return
 
 	qa_df = clean_qa_data(data_dir, category)
 	reviews_df = clean_review_data(data_dir, category)
 	
 	qa_reviews_df = pd.merge(qa_df, reviews_df, on=['asin', 'asin'])
 
-	output_path =  "%s/qar_products_%s.jsonl" % (data_dir, category)
 	with open(output_path, 'w') as fp:
 		for (_, row) in qa_reviews_df.iterrows():
 			j = {}
@@ -137,6 +199,7 @@ if __name__=="__main__":
 	argParser.add_argument("--data_dir", type=str)
 	argParser.add_argument("--category", type=str)
 	argParser.add_argument("--download", type=int, default=1)
+	argParser.add_argument("--streaming", type=int, default=0)
 
 	args = argParser.parse_args()
 	main(args)
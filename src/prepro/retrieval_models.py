@@ -3,6 +3,7 @@ import re
 
 import numpy as np
 import operator
+import scipy.sparse as sp
 
 
 class BM25(object):
@@ -80,11 +81,115 @@ def get_doc_length(term_dict, docId):
             count += term_dict[key][docId]
     return count
 
+class RetrievalEngine(object):
+    # Scores all documents of a product at once against a CSR term-document matrix.
+    # Doc lengths, avgdl, idf and collection frequencies are computed once at construction,
+    # so each question only pays for the columns of its own tokens.
+
+    def __init__(self, inverted_index, doc_tokens, k1=1.2, b=0.75, lambda_=0.75, mu=5000):
+        self.k1 = k1
+        self.b = b
+        self.lambda_ = lambda_
+        self.mu = mu
+
+        self.N = N = len(doc_tokens)
+        self.vocab = {token: i for i, token in enumerate(inverted_index)}
+
+        rows, cols, counts = [], [], []
+        for token, postings in inverted_index.items():
+            col = self.vocab[token]
+            for doc_id, count in postings.items():
+                rows.append(doc_id)
+                cols.append(col)
+                counts.append(count)
+        n_rows = max([N] + [doc_id + 1 for doc_id in rows])
+        term_freqs = sp.csr_matrix(
+            (np.array(counts, dtype=np.float64), (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64))),
+            shape=(n_rows, len(self.vocab))
+        )
+        self.term_freqs = term_freqs[:N]
+
+        # the documents being scored need not be the ones the index was built from
+        member_rows, member_cols = [], []
+        for doc_id, tokens in enumerate(doc_tokens):
+            for token in set(tokens):
+                if token in self.vocab:
+                    member_rows.append(doc_id)
+                    member_cols.append(self.vocab[token])
+        self.doc_terms = sp.csr_matrix(
+            (np.ones(len(member_rows)), (np.array(member_rows, dtype=np.int64), np.array(member_cols, dtype=np.int64))),
+            shape=(N, len(self.vocab))
+        )
+
+        df = np.diff(term_freqs.tocsc().indptr)
+        self.idf = np.log(1 + (N - df + 0.5) / (df + 0.5))
+        self.collection_freqs = np.asarray(term_freqs.sum(axis=0)).ravel()
+
+        doc_lengths = np.asarray(self.term_freqs.sum(axis=1)).ravel()
+        average_doc_length = term_freqs.sum() / N if N > 0 else 0
+        if average_doc_length > 0:
+            self.bm25_norms = self.k1 * ((1 - self.b) + self.b * (doc_lengths / average_doc_length))
+        else:
+            self.bm25_norms = np.zeros(N)
+        self.indri_doc_lengths = np.array([len(tokens) for tokens in doc_tokens], dtype=np.float64)
+
+    @classmethod
+    def from_tokens(cls, doc_tokens, **kwargs):
+        inverted_index = {}
+        for doc_id, tokens in enumerate(doc_tokens):
+            update_dictionary(inverted_index, tokens, doc_id)
+        return cls(inverted_index, doc_tokens, **kwargs)
+
+    def scores(self, question_tokens, retrieval_algo):
+        if self.N == 0:
+            return np.zeros(0)
+        if retrieval_algo == "bm25":
+            return self.bm25_scores(question_tokens)
+        elif retrieval_algo == "indri":
+            return self.indri_scores(question_tokens)
+        else:
+            raise 'Unimplemented retrieval algo: %s' % retrieval_algo
+
+    def bm25_scores(self, question_tokens):
+        cols = np.array(sorted(set(self.vocab[token] for token in question_tokens if token in self.vocab)), dtype=np.int64)
+        matches = self.doc_terms[:, cols].tocoo()
+        term_cols = cols[matches.col]
+        tf = self.collection_freqs[term_cols]
+        weights = self.idf[term_cols] * tf / (tf + self.bm25_norms[matches.row])
+        return np.bincount(matches.row, weights=weights, minlength=self.N)
+
+    def indri_scores(self, question_tokens):
+        question_tokens = list(question_tokens)
+        exponent = float(1) / len(question_tokens)
+        cols = np.array([self.vocab.get(token, -1) for token in question_tokens], dtype=np.int64)
+        known = cols >= 0
+
+        tf = np.zeros((self.N, len(cols)))
+        tf[:, known] = self.term_freqs[:, cols[known]].toarray()
+        collection_freqs = np.zeros(len(cols))
+        collection_freqs[known] = self.collection_freqs[cols[known]]
+        p_mle = np.maximum(collection_freqs, 1) / self.N
+
+        term_scores = self.lambda_ * p_mle
+        term_scores = term_scores + (1 - self.lambda_) * (tf + self.mu * p_mle) / (self.indri_doc_lengths[:, None] + self.mu)
+        return np.power(np.prod(term_scores, axis=1), exponent)
+
+
 def retrieval_model_scores(question_tokens, review_tokens, inverted_index, retrieval_algo):
     N = len(review_tokens)
     if N == 0:
         return []
 
+    engine = RetrievalEngine(inverted_index, review_tokens)
+    return engine.scores(question_tokens, retrieval_algo).tolist()
+
+
+def retrieval_model_scores_slow(question_tokens, review_tokens, inverted_index, retrieval_algo):
+    # per-term reference implementation of retrieval_model_scores
+    N = len(review_tokens)
+    if N == 0:
+        return []
+
     avg_length = get_average_sentence_length(inverted_index, N)
 
     bm25_model = BM25(k1=1.2, k3=0, b=0.75)
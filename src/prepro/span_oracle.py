@@ -0,0 +1,149 @@
+import math
+import heapq
+
+import numpy as np
+
+
+class SpanOracle(object):
+    # Scores every fixed-length word window of a context against the gold answers and
+    # returns exactly the Bleu_1..4 (closest reflen) and ROUGE_L values that
+    # COCOEvalCap.compute_scores gives for each window on its own.
+    # Reference n-gram max counts are cooked once; clipped matches are updated as the
+    # window slides, and the ROUGE-L LCS DP runs over all windows at once.
+
+    def __init__(self, answers, n=4, beta=1.2):
+        assert len(answers) > 0
+        self.n = n
+        self.beta = beta
+
+        self.ref_lens = []
+        self.max_counts = {}
+        for answer in answers:
+            words = answer.split()
+            self.ref_lens.append(len(words))
+            counts = {}
+            for k in range(1, n + 1):
+                for i in range(len(words) - k + 1):
+                    ngram = tuple(words[i:i + k])
+                    counts[ngram] = counts.get(ngram, 0) + 1
+            for ngram, count in counts.items():
+                self.max_counts[ngram] = max(self.max_counts.get(ngram, 0), count)
+
+        # Rouge splits on single spaces, unlike Bleu
+        self.rouge_refs = [answer.split(" ") for answer in answers]
+
+    def bleu(self, testlen, correct):
+        # BleuScorer.compute_score(option='closest') for a single hypothesis
+        small = 1e-9
+        tiny = 1e-15
+        reflen = min((abs(l - testlen), l) for l in self.ref_lens)[1]
+
+        bleus = []
+        bleu = 1.
+        for k in range(self.n):
+            guess = max(0, testlen - k)
+            bleu *= float(correct[k] + tiny) / (guess + small)
+            bleus.append(bleu ** (1. / (k + 1)))
+        ratio = (testlen + tiny) / (reflen + small)
+        if ratio < 1:
+            for k in range(self.n):
+                bleus[k] *= math.exp(1 - 1 / ratio)
+        return bleus
+
+    def sentence_bleu(self, sentence):
+        words = sentence.split()
+        correct = [0] * self.n
+        counts = {}
+        for k in range(1, self.n + 1):
+            for i in range(len(words) - k + 1):
+                ngram = tuple(words[i:i + k])
+                max_count = self.max_counts.get(ngram, 0)
+                count = counts.get(ngram, 0)
+                if count < max_count:
+                    correct[k - 1] += 1
+                counts[ngram] = count + 1
+        return self.bleu(len(words), correct)
+
+    def window_bleu(self, words, window_len, num_windows):
+        # Bleu_1..4 of words[i:i+window_len] for i in range(num_windows)
+        if num_windows <= 0:
+            return []
+
+        # n-grams starting at each position, None when no reference contains them
+        orders = range(1, min(self.n, window_len) + 1)
+        keys = {}
+        for k in orders:
+            keys[k] = []
+            for p in range(len(words) - k + 1):
+                ngram = tuple(words[p:p + k])
+                keys[k].append(ngram if ngram in self.max_counts else None)
+
+        correct = [0] * self.n
+        window_counts = {}
+
+        def add(ngram):
+            count = window_counts.get(ngram, 0)
+            if count < self.max_counts[ngram]:
+                correct[len(ngram) - 1] += 1
+            window_counts[ngram] = count + 1
+
+        def remove(ngram):
+            count = window_counts[ngram] - 1
+            if count < self.max_counts[ngram]:
+                correct[len(ngram) - 1] -= 1
+            window_counts[ngram] = count
+
+        for k in orders:
+            for p in range(window_len - k + 1):
+                if keys[k][p] is not None:
+                    add(keys[k][p])
+
+        scores = [self.bleu(window_len, correct)]
+        for i in range(1, num_windows):
+            for k in orders:
+                if keys[k][i - 1] is not None:
+                    remove(keys[k][i - 1])
+                if keys[k][i + window_len - k] is not None:
+                    add(keys[k][i + window_len - k])
+            scores.append(self.bleu(window_len, correct))
+        return scores
+
+    def window_rouge(self, words, window_len, num_windows):
+        # ROUGE_L of words[i:i+window_len] for i in range(num_windows)
+        if num_windows <= 0:
+            return []
+
+        vocab = {}
+        word_ids = np.array([vocab.setdefault(w, len(vocab)) for w in words], dtype=np.int64)
+
+        prec_max = np.zeros(num_windows)
+        rec_max = np.zeros(num_windows)
+        for ref in self.rouge_refs:
+            ref_ids = [vocab.get(w, -1) for w in ref]
+            # lcs[i, j]: LCS of the first p words of window i and the first j reference words
+            lcs = np.zeros((num_windows, len(ref_ids) + 1), dtype=np.int64)
+            for p in range(window_len):
+                column = word_ids[p:p + num_windows]
+                new_lcs = np.zeros_like(lcs)
+                for j in range(1, len(ref_ids) + 1):
+                    new_lcs[:, j] = np.where(
+                        column == ref_ids[j - 1],
+                        lcs[:, j - 1] + 1,
+                        np.maximum(lcs[:, j], new_lcs[:, j - 1])
+                    )
+                lcs = new_lcs
+            prec_max = np.maximum(prec_max, lcs[:, -1] / float(window_len))
+            rec_max = np.maximum(rec_max, lcs[:, -1] / float(len(ref_ids)))
+
+        scores = []
+        for prec, rec in zip(prec_max.tolist(), rec_max.tolist()):
+            if prec != 0 and rec != 0:
+                scores.append(((1 + self.beta**2) * prec * rec) / float(rec + self.beta**2 * prec))
+            else:
+                scores.append(0.0)
+        return scores
+
+
+def top_k(scores, k):
+    # indices of the k best scores, ties in order of appearance (a stable reverse sort)
+    return heapq.nsmallest(k, range(len(scores)), key=lambda i: (-scores[i], i))
@@ -0,0 +1,110 @@
+import argparse
+import dbm
+import hashlib
+import itertools
+import json
+import string
+import time
+
+# every punctuation character except the apostrophe is split off as its own token
+PUNCTUATIONS = string.punctuation.replace("\'", '')
+_PUNCTUATION_SET = frozenset(PUNCTUATIONS)
+
+
+def tokenize(text):
+    # only the punctuation characters present in the text need a replace pass
+    for ch in _PUNCTUATION_SET.intersection(text):
+        text = text.replace(ch, " " + ch + " ")
+
+    # lowercase the whole text at once and restore the all-caps tokens
+    tokens = text.split()
+    lowered = text.lower().split()
+    for i in itertools.compress(range(len(tokens)), map(str.isupper, tokens)):
+        lowered[i] = tokens[i]
+    return lowered
+
+
+def tokenize_slow(text):
+    # the original one-replace-per-character implementation, kept for benchmarking
+    for ch in PUNCTUATIONS:
+        text = text.replace(ch, " " + ch + " ")
+
+    tokens = text.split()
+    for i, token in enumerate(tokens):
+        if not token.isupper():
+            tokens[i] = token.lower()
+    return tokens
+
+
+class TokenCache(object):
+    # on-disk text -> tokens cache keyed by the sha1 of the text
+
+    def __init__(self, filename, flag='c'):
+        self.db = dbm.open(filename, flag)
+
+    @staticmethod
+    def key(text):
+        return hashlib.sha1(text.encode('utf-8')).digest()
+
+    def get(self, text):
+        value = self.db.get(self.key(text))
+        return None if value is None else value.decode('utf-8').split()
+
+    def put(self, text, tokens):
+        self.db[self.key(text)] = ' '.join(tokens).encode('utf-8')
+
+    def close(self):
+        self.db.close()
+
+
+def tokenize_many(texts, cache=None):
+    for text in texts:
+        if cache is None:
+            yield tokenize(text)
+            continue
+        tokens = cache.get(text)
+        if tokens is None:
+            tokens = tokenize(text)
+            cache.put(text, tokens)
+        yield tokens
+
+
+def _sample_texts(input_file, num_lines):
+    texts = []
+    with open(input_file, 'r') as fp:
+        for i, line in enumerate(fp):
+            if i >= num_lines:
+                break
+            row = json.loads(line)
+            texts.append(row['questionText'])
+            texts += [answer['answerText'] for answer in row['answers']]
+            texts += row['review_snippets']
+    return texts
+
+
+def benchmark(input_file, num_lines):
+    texts = _sample_texts(input_file, num_lines)
+    n_chars = sum(len(text) for text in texts)
+
+    start = time.time()
+    slow_tokens = [tokenize_slow(text) for text in texts]
+    slow_time = time.time() - start
+
+    start = time.time()
+    fast_tokens = list(tokenize_many(texts))
+    fast_time = time.time() - start
+
+    assert slow_tokens == fast_tokens
+    print('%d texts, %.1f MB' % (len(texts), n_chars / 1e6))
+    print('tokenize_slow: %.3fs (%.1f MB/s)' % (slow_time, n_chars / 1e6 / slow_time))
+    print('tokenize:      %.3fs (%.1f MB/s)' % (fast_time, n_chars / 1e6 / fast_time))
+    print('speedup: %.1fx' % (slow_time / fast_time))
+
+
+if __name__ == '__main__':
+    argParser = argparse.ArgumentParser(description="Benchmark the tokenizer against the per-character implementation")
+    argParser.add_argument("--input_file", type=str, default='../../data/train-qar.jsonl')
+    argParser.add_argument("--num_lines", type=int, default=10000)
+
+    args = argParser.parse_args()
+    benchmark(args.input_file, args.num_lines)